@@ -0,0 +1,88 @@
+import os
+import streamlit as st
+
+import metrics
+
+
+def admin_token():
+    try:
+        if "ADMIN_TOKEN" in st.secrets:
+            return st.secrets["ADMIN_TOKEN"]
+    except Exception:
+        pass
+    return os.getenv("ADMIN_TOKEN")
+
+
+def is_admin_request():
+    # Opened with ?admin=<ADMIN_TOKEN>; without a configured token the page doesn't exist
+    token = admin_token()
+    return bool(token) and st.query_params.get("admin") == token
+
+
+LIVE_REFRESH_SECONDS = 5
+
+
+@st.fragment(run_every=LIVE_REFRESH_SECONDS)
+def render_live_analytics():
+    from live_analytics import get_live_analytics
+
+    live = get_live_analytics()
+    summaries = live.summaries()
+    waiting = live.waiting()
+    st.subheader("Class analytics")
+    st.caption(f"Attempt 1 vs attempt 2, as in analysis.py; updates every {LIVE_REFRESH_SECONDS}s.")
+    st.dataframe(
+        [{"topic": topic, "students": s["sample_size"], "waiting for attempt 2": waiting.get(topic, 0)
+          if topic != "all topics" else sum(waiting.values()),
+          "mean attempt 1": round(s["mean_attempt1"], 1), "mean attempt 2": round(s["mean_attempt2"], 1),
+          "% improved": round(s["percent_improved"], 1),
+          "median improvement": round(s["improvement_metrics"]["median_improvement"], 1),
+          "normalized gain": round(s["improvement_metrics"]["normalized_gain"], 3),
+          "SD attempt 1": round(s["consistency_metrics"]["sd_attempt1"], 1),
+          "SD attempt 2": round(s["consistency_metrics"]["sd_attempt2"], 1),
+          "correlation": round(s["consistency_metrics"]["correlation"], 3),
+          "% moved to mastery": round(s["mastery_threshold_metrics"]["moved_to_mastery"], 1)}
+         for topic, s in summaries.items()],
+        hide_index=True,
+    )
+
+
+def render_admin():
+    st.title("📈 Live Metrics")
+    render_live_analytics()
+    snap = metrics.snapshot()
+    st.caption(f"This worker process, up {snap['uptime'] / 60:.0f} min. Refresh the page to update.")
+
+    histograms = snap["histograms"]
+    if histograms:
+        st.subheader("Latency")
+        st.dataframe(
+            [{"stage": name, "count": h["count"], "mean (ms)": round(1000 * h["mean"], 1),
+              "p50 (ms)": round(1000 * h["p50"], 1), "p95 (ms)": round(1000 * h["p95"], 1),
+              "p99 (ms)": round(1000 * h["p99"], 1)}
+             for name, h in sorted(histograms.items())],
+            hide_index=True,
+        )
+        name = st.selectbox("Histogram", sorted(histograms), index=sorted(histograms).index("submit.total")
+                            if "submit.total" in histograms else 0)
+        buckets = histograms[name]["buckets"]
+        st.bar_chart({"requests": {f"≤{b}s": n for b, n in buckets.items()}})
+    else:
+        st.markdown("No submissions recorded yet.")
+
+    counters = snap["counters"]
+    hits = counters.get("feedback_cache.hits", 0)
+    lookups = hits + counters.get("feedback_cache.misses", 0)
+    coalesced = counters.get("singleflight.coalesced", 0)
+    generations = coalesced + counters.get("singleflight.leaders", 0)
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Feedback cache hit rate", f"{100 * hits / lookups:.0f}%" if lookups else "–")
+    col2.metric("Shared generations", f"{100 * coalesced / generations:.0f}%" if generations else "–")
+    col3.metric("OpenAI tokens", f"{counters.get('openai.total_tokens', 0):,}")
+    col4.metric("OpenAI retries", counters.get("openai.retries", 0))
+
+    st.subheader("Counters")
+    st.dataframe([{"name": k, "value": v} for k, v in sorted(counters.items())], hide_index=True)
+    if snap["gauges"]:
+        st.subheader("Gauges")
+        st.dataframe([{"name": k, "value": v} for k, v in sorted(snap["gauges"].items())], hide_index=True)
@@ -1,15 +1,111 @@
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-from scipy.stats import wilcoxon, ttest_rel
 import os
+import argparse
+import datetime as dt
+import hashlib
+import json
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+def read_export(filepath, usecols=None, **kwargs):
+    # Rows of a sheet whose header row predates Prompt Version and Feedback Degraded carry fields the
+    # header doesn't name; left to itself pandas would shift every column. Reading everything, those
+    # columns are named (blank in older rows). With usecols, the rest are ignored, as long as the names
+    # are exactly the header's. The header row is skipped rather than parsed (header=0), which would
+    # hold every row to its width.
+    from utils import sheet_header
+    header = [str(c).strip() for c in pd.read_csv(filepath, nrows=0).columns]
+    names = header if usecols is not None else sheet_header(header)
+    return pd.read_csv(filepath, names=names, header=None, skiprows=1, index_col=False, usecols=usecols,
+                       **kwargs)
 
 def load_data(filepath):
-    df = pd.read_csv(filepath)
-    df = df.rename(columns=lambda x: x.strip())
+    df = read_export(filepath)
+    df["Attempt"] = df["Attempt"].astype(int)
+    df["Score"] = df["Score"].astype(float)
+    return df
+
+def load_sheet_data():
+    # Reads through the same local sheet mirror the app uses for attempt checks
+    from utils import get_sheet_mirror, sheet_header
+    mirror = get_sheet_mirror()
+    rows = mirror.rows()
+    header = sheet_header(mirror.header)
+    width = len(header)
+    df = pd.DataFrame([list(r[:width]) + [""] * (width - len(r)) for r in rows], columns=header)
+    if "Prompt Version" in df:
+        # Rows written before the column existed leave it blank
+        df["Prompt Version"] = df["Prompt Version"].replace("", np.nan)
+    df["Attempt"] = df["Attempt"].astype(int)
+    df["Score"] = df["Score"].astype(float)
+    return df
+
+def load_archive_data(topics=None, start=None, end=None):
+    # Reads only the pivot's columns, and only the topic/date partitions asked for
+    from archive import load_archive
+    df = load_archive(columns=["user_id", "topic", "attempt", "score", "timestamp", "prompt_version"],
+                      topics=topics, start=start, end=end)
+    df = df.rename(columns={"user_id": "User ID", "topic": "Topic", "attempt": "Attempt", "score": "Score",
+                            "timestamp": "Timestamp", "prompt_version": "Prompt Version"})
     df["Attempt"] = df["Attempt"].astype(int)
     df["Score"] = df["Score"].astype(float)
     return df
 
+PIVOT_COLUMNS = ["User ID", "Topic", "Attempt", "Score"]
+
+def _global_codes(values, ids):
+    # Codes for this chunk's values that stay the same across chunks; ids maps value -> code
+    codes, uniques = pd.factorize(values)
+    mapped = np.array([ids.setdefault(v, len(ids)) for v in uniques.tolist()], dtype=np.int64)
+    return mapped[codes] if len(mapped) else codes.astype(np.int64)
+
+def load_pivot_chunked(filepath, chunksize=500_000):
+    # Same result as pivot_attempts(filter_attempts(load_data(filepath))), but the CSV is read a chunk
+    # at a time and only a running score sum and count per (User ID, Topic) pair and attempt are kept.
+    # Memory grows with the pairs that actually occur, not with rows or with users x topics.
+    dtype = {"User ID": str, "Topic": str, "Score": float}
+    user_ids, topic_ids = {}, {}
+    # Sorted pair codes (user code << 32 | topic code) and their running sums and counts per attempt
+    keys = np.zeros(0, dtype=np.int64)
+    sums = np.zeros((0, 2))
+    counts = np.zeros((0, 2), dtype=np.int64)
+    for chunk in read_export(filepath, usecols=PIVOT_COLUMNS, dtype=dtype, chunksize=chunksize):
+        chunk["Attempt"] = chunk["Attempt"].astype(int)
+        # pivot_table drops rows with a missing key; factorize would code them -1, which reads as the last id
+        chunk = filter_attempts(chunk).dropna(subset=["User ID", "Topic"])
+        users = _global_codes(chunk["User ID"], user_ids)
+        topics = _global_codes(chunk["Topic"], topic_ids)
+        chunk_keys, local = np.unique((users << 32) | topics, return_inverse=True)
+        # pivot_table's mean skips missing scores
+        scores = chunk["Score"].to_numpy()
+        scored = ~np.isnan(scores)
+        slots = local[scored] * 2 + chunk["Attempt"].to_numpy()[scored] - 1
+        size = 2 * len(chunk_keys)
+        chunk_sums = np.bincount(slots, weights=scores[scored], minlength=size).reshape(-1, 2)
+        chunk_counts = np.bincount(slots, minlength=size).reshape(-1, 2)
+        # Merge into the running totals; only pairs seen so far take up room
+        merged = np.union1d(keys, chunk_keys)
+        if len(merged) > len(keys):
+            grown_sums, grown_counts = np.zeros((len(merged), 2)), np.zeros((len(merged), 2), dtype=np.int64)
+            at = np.searchsorted(merged, keys)
+            grown_sums[at], grown_counts[at] = sums, counts
+            keys, sums, counts = merged, grown_sums, grown_counts
+        at = np.searchsorted(keys, chunk_keys)
+        sums[at] += chunk_sums
+        counts[at] += chunk_counts
+    # pivot_table leaves out a (User ID, Topic) pair with no score at all
+    kept = counts.sum(axis=1) > 0
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = sums[kept] / counts[kept]
+    pivot = pd.DataFrame({
+        "User ID": np.array(list(user_ids), dtype=object)[keys[kept] >> 32],
+        "Topic": np.array(list(topic_ids), dtype=object)[keys[kept] & 0xFFFFFFFF],
+        "Score_Attempt1": means[:, 0],
+        "Score_Attempt2": means[:, 1],
+    })
+    return pivot.sort_values(["User ID", "Topic"]).reset_index(drop=True)
+
 def filter_attempts(df):
     return df[df["Attempt"].isin([1, 2])]
 
@@ -68,6 +164,8 @@ def mastery_threshold_metrics(df, threshold=80):
     }
 
 def run_stats(df):
+    # scipy.stats takes longer to import than the rest of this module; loaders and plots don't need it
+    from scipy.stats import wilcoxon, ttest_rel
     w_stat, w_p = wilcoxon(df["Score_Attempt1"], df["Score_Attempt2"])
     t_stat, t_p = ttest_rel(df["Score_Attempt1"], df["Score_Attempt2"])
     return {
@@ -94,38 +192,250 @@ def summarize(df):
         "sample_size": len(df)
     }
 
-def plot_improvement_hist(df):
-    plt.figure(figsize=(8,5))
+# Above this many points the scatter plot switches to hexbin density (or a sample, see --scatter)
+SCATTER_MAX_POINTS = 5000
+PLOT_DPI = 100
+
+def _pyplot():
+    # matplotlib is only imported when a plot actually has to be drawn, headless
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    return plt
+
+def plot_hash(df, columns, **options):
+    # Content hash of just the columns a plot draws, plus its options
+    digest = hashlib.sha256(json.dumps(options, sort_keys=True).encode("utf-8"))
+    digest.update(pd.util.hash_pandas_object(df[columns], index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+def _is_current(path, digest):
+    try:
+        with open(path + ".hash", "r", encoding="utf-8") as f:
+            return os.path.exists(path) and f.read().strip() == digest
+    except FileNotFoundError:
+        return False
+
+def _save(fig, path, digest):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    fig.savefig(path, dpi=PLOT_DPI)
+    with open(path + ".hash", "w", encoding="utf-8") as f:
+        f.write(digest)
+
+def plot_improvement_hist(df, path="results/plot_improvement_hist.png", title=None, force=False):
+    # Returns False when the plot in results/ already shows this data
+    digest = plot_hash(df, ["Improvement"], kind="hist", bins=10, title=title)
+    if not force and _is_current(path, digest):
+        return False
+    plt = _pyplot()
+    fig = plt.figure(figsize=(8,5))
     plt.hist(df["Improvement"], bins=10)
     plt.axvline(0, color='black', linestyle='--')
-    plt.title("Score Improvement from Attempt 1 to Attempt 2")
+    plt.title(title or "Score Improvement from Attempt 1 to Attempt 2")
     plt.xlabel("Improvement")
     plt.ylabel("Number of Users")
     plt.tight_layout()
-    os.makedirs("results", exist_ok=True)
-    plt.savefig("results/plot_improvement_hist.png")
-    plt.close()
+    _save(fig, path, digest)
+    plt.close(fig)
+    return True
 
-def plot_attempt_scatter(df):
-    plt.figure(figsize=(8,5))
-    plt.scatter(df["Score_Attempt1"], df["Score_Attempt2"])
+def plot_attempt_scatter(df, path="results/plot_attempt_scatter.png", title=None, style="auto", force=False):
+    # style: "scatter", "hexbin", "decimate" (a fixed random sample), or "auto" = hexbin for large N
+    if style == "auto":
+        style = "hexbin" if len(df) > SCATTER_MAX_POINTS else "scatter"
+    digest = plot_hash(df, ["Score_Attempt1", "Score_Attempt2"], kind="scatter", style=style,
+                       max_points=SCATTER_MAX_POINTS, title=title)
+    if not force and _is_current(path, digest):
+        return False
+    plt = _pyplot()
+    fig = plt.figure(figsize=(8,5))
+    if style == "hexbin":
+        plt.hexbin(df["Score_Attempt1"], df["Score_Attempt2"], gridsize=25, extent=(0, 100, 0, 100),
+                   mincnt=1, bins="log", cmap="Blues")
+        plt.colorbar(label="Number of Users")
+    else:
+        if style == "decimate" and len(df) > SCATTER_MAX_POINTS:
+            df = df.sample(SCATTER_MAX_POINTS, random_state=0)
+        plt.scatter(df["Score_Attempt1"], df["Score_Attempt2"])
     plt.plot([0, 100], [0, 100], linestyle='--', color='gray')
-    plt.title("Attempt 1 vs Attempt 2 Scores")
+    plt.title(title or "Attempt 1 vs Attempt 2 Scores")
     plt.xlabel("Attempt 1 Score")
     plt.ylabel("Attempt 2 Score")
     plt.tight_layout()
-    os.makedirs("results", exist_ok=True)
-    plt.savefig("results/plot_attempt_scatter.png")
-    plt.close()
+    _save(fig, path, digest)
+    plt.close(fig)
+    return True
 
-def main():
-    df = load_data("submissions/submissions_google.csv")
-    df = filter_attempts(df)
-    pivot = pivot_attempts(df)
-    filtered = remove_perfect_first_attempt(pivot)
-    paired = compute_improvement(filtered)
-    stats = run_stats(paired)
-    summary = summarize(paired)
+def _plot_topic(task):
+    topic, df, style, force = task
+    folder = os.path.join("results", "topics", topic)
+    return (plot_improvement_hist(df, os.path.join(folder, "plot_improvement_hist.png"),
+                                  title=f"Score Improvement from Attempt 1 to Attempt 2 ({topic})", force=force)
+            + plot_attempt_scatter(df, os.path.join(folder, "plot_attempt_scatter.png"),
+                                   title=f"Attempt 1 vs Attempt 2 Scores ({topic})", style=style, force=force))
+
+def plot_topics(paired, style="auto", force=False, workers=None):
+    # results/topics/<topic>/: each topic on its own process; unchanged topics cost one hash each
+    tasks = [(str(topic), group[["Score_Attempt1", "Score_Attempt2", "Improvement"]], style, force)
+             for topic, group in paired.groupby("Topic", sort=True)]
+    workers = min(workers or os.cpu_count() or 1, len(tasks))
+    if workers <= 1:
+        return sum(_plot_topic(task) for task in tasks)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return sum(pool.map(_plot_topic, tasks))
+
+# Groups compared in --parallel mode, when the data has them. A cohort is the academic term of the
+# first attempt; the prompt version is recorded with each submission by the app.
+GROUP_DIMENSIONS = ["Topic", "Cohort", "Prompt Version"]
+# Resampled counts held in memory at once per worker (resamples x distinct score pairs)
+RESAMPLE_BLOCK = 2_000_000
+
+def term_of(timestamps):
+    ts = pd.to_datetime(timestamps, errors="coerce", format="ISO8601")
+    season = np.select([ts.dt.month <= 5, ts.dt.month <= 7], ["Spring", "Summer"], "Fall")
+    return (ts.dt.year.astype("Int64").astype(str) + " " + season).where(ts.notna(), "unknown")
+
+def pair_groups(df, paired):
+    # Adds the group columns of each pair's first attempt
+    extra = {}
+    first = df[df["Attempt"] == 1].drop_duplicates(["User ID", "Topic"])
+    if "Timestamp" in first:
+        extra["Cohort"] = term_of(first["Timestamp"])
+    if "Prompt Version" in first:
+        extra["Prompt Version"] = first["Prompt Version"].fillna("unknown")
+    if not extra:
+        return paired
+    groups = first[["User ID", "Topic"]].assign(**extra)
+    return paired.merge(groups, on=["User ID", "Topic"], how="left")
+
+def normalized_gains(a1, a2):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        gain = (a2 - a1) / (100 - a1)
+    # Same as improvement_metrics: a gain from a perfect first attempt counts as 0
+    return np.where(np.isinf(gain), 0.0, gain)
+
+def _blocks(resamples, width):
+    rows = max(1, RESAMPLE_BLOCK // max(width, 1))
+    for start in range(0, resamples, rows):
+        yield min(rows, resamples - start)
+
+def score_pairs(a1, a2):
+    # Scores take few distinct values, so a group is a handful of distinct (attempt 1, attempt 2)
+    # pairs with counts. Resampling draws counts per distinct pair, which has the same distribution
+    # as resampling students one by one, in O(resamples x distinct pairs) instead of x students.
+    distinct, counts = np.unique(np.column_stack([a1, a2]), axis=0, return_counts=True)
+    return distinct[:, 0], distinct[:, 1], counts
+
+def bootstrap_means(a1, a2, resamples, rng):
+    # Bootstrap distribution of (mean improvement, mean normalized gain): shape 2 x resamples
+    d1, d2, counts = score_pairs(a1, a2)
+    values = np.vstack([d2 - d1, normalized_gains(d1, d2)])
+    n = counts.sum()
+    out = []
+    for rows in _blocks(resamples, len(counts)):
+        draws = rng.multinomial(n, counts / n, size=rows)
+        out.append(values @ draws.T / n)
+    return np.concatenate(out, axis=1)
+
+def permutation_means(a1, a2, resamples, rng):
+    # Null distribution of the two means when each student's attempts are swapped with probability 1/2
+    # (feedback has no effect), and the centered sign-flip distribution that gives a permutation CI
+    d1, d2, counts = score_pairs(a1, a2)
+    n = counts.sum()
+    forward = np.vstack([d2 - d1, normalized_gains(d1, d2)])
+    swapped = np.vstack([d1 - d2, normalized_gains(d2, d1)])
+    centered = forward - (forward @ counts / n)[:, None]
+    null, flipped = [], []
+    for rows in _blocks(resamples, len(counts)):
+        swaps = rng.binomial(counts, 0.5, size=(rows, len(counts)))
+        null.append((swapped @ swaps.T + forward @ (counts - swaps).T) / n)
+        flipped.append(centered @ (counts - 2 * swaps).T / n)
+    return np.concatenate(null, axis=1), np.concatenate(flipped, axis=1)
+
+def _safe_stats(df):
+    # wilcoxon refuses groups where nobody's score changed
+    try:
+        return run_stats(df)
+    except ValueError:
+        nan = float("nan")
+        return {"wilcoxon": {"stat": nan, "p": nan}, "paired_t": {"stat": nan, "p": nan}}
+
+def analyze_group(task):
+    dimension, value, a1, a2, resamples, seed = task
+    group = pd.DataFrame({"Score_Attempt1": a1, "Score_Attempt2": a2, "Improvement": a2 - a1})
+    result = {"dimension": dimension, "group": value, "n": len(a1)}
+    if len(a1) < 2:
+        return result
+    # Seeded by group, so results don't depend on which worker ran what
+    rng = np.random.default_rng([seed, zlib.crc32(f"{dimension}={value}".encode())])
+    observed = np.array([np.mean(a2 - a1), np.mean(normalized_gains(a1, a2))])
+    boot = bootstrap_means(a1, a2, resamples, rng)
+    null, flipped = permutation_means(a1, a2, resamples, rng)
+    result["summary"] = summarize(group)
+    result["stats"] = _safe_stats(group)
+    for i, name in enumerate(["mean_improvement", "normalized_gain"]):
+        result[name] = {
+            "estimate": observed[i],
+            "bootstrap_ci": list(np.percentile(boot[i], [2.5, 97.5])),
+            "bootstrap_se": float(np.std(boot[i], ddof=1)),
+            "permutation_ci": list(observed[i] - np.percentile(flipped[i], [97.5, 2.5])),
+            "permutation_p": float((1 + np.sum(np.abs(null[i]) >= abs(observed[i]))) / (resamples + 1)),
+        }
+    return result
+
+def group_tasks(pairs, resamples, seed):
+    tasks = [("all", "all", pairs["Score_Attempt1"].to_numpy(float), pairs["Score_Attempt2"].to_numpy(float),
+              resamples, seed)]
+    for dimension in GROUP_DIMENSIONS:
+        if dimension not in pairs:
+            continue
+        for value, group in pairs.groupby(dimension, sort=True):
+            tasks.append((dimension, str(value), group["Score_Attempt1"].to_numpy(float),
+                          group["Score_Attempt2"].to_numpy(float), resamples, seed))
+    return tasks
+
+def _plain(value):
+    # JSON without NaN, numpy scalars or tuples
+    if isinstance(value, dict):
+        return {k: _plain(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_plain(v) for v in value]
+    if isinstance(value, (np.floating, float)):
+        return None if np.isnan(value) else float(value)
+    if isinstance(value, np.integer):
+        return int(value)
+    return value
+
+def run_group_analysis(pairs, resamples=10_000, seed=0, workers=None, report_path="results/report.json"):
+    # Every group on a process pool; one report with all of them
+    tasks = group_tasks(pairs, resamples, seed)
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        results = [analyze_group(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as pool:
+            results = list(pool.map(analyze_group, tasks))
+    report = {"generated": dt.datetime.now().isoformat(), "resamples": resamples, "seed": seed,
+              "groups": results}
+    os.makedirs(os.path.dirname(report_path) or ".", exist_ok=True)
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(_plain(report), f, indent=2)
+    return results
+
+def print_group_results(results):
+    print("\n===== Groups (95% bootstrap CI, permutation p) =====")
+    for r in results:
+        label = "all" if r["dimension"] == "all" else f"{r['dimension']}={r['group']}"
+        if "mean_improvement" not in r:
+            print(f"{label}: n={r['n']} (too few pairs)")
+            continue
+        imp, gain = r["mean_improvement"], r["normalized_gain"]
+        print(f"{label}: n={r['n']}  improvement {imp['estimate']:.2f} "
+              f"[{imp['bootstrap_ci'][0]:.2f}, {imp['bootstrap_ci'][1]:.2f}] p={imp['permutation_p']:.4f}  "
+              f"gain {gain['estimate']:.3f} [{gain['bootstrap_ci'][0]:.3f}, {gain['bootstrap_ci'][1]:.3f}] "
+              f"p={gain['permutation_p']:.4f}")
+
+def print_summary(summary, stats):
     print("\n===== Core Summary =====")
     print(f"Users included in analysis: {summary['sample_size']}")
     print(f"Percent improved: {summary['percent_improved']:.2f}")
@@ -143,8 +453,104 @@ def main():
         print(f"{k}: {v:.2f}")
     print("\n===== Statistical Tests =====")
     print(stats)
-    plot_improvement_hist(paired)
-    plot_attempt_scatter(paired)
+
+# An export of a sheet whose header row predates Prompt Version and Feedback Degraded: rows written
+# since then carry two more fields than the header names. The last two rows have no User ID or Topic.
+CHECK_EXPORT = """User ID,Attempt,Topic,Score,Timestamp,Answers
+u1,1,gps,10,2025-01-01T00:00:00,{}
+u1,2,gps,20,2025-01-01T00:05:00,"{""0"": [1]}",v1,False
+u2,1,gps,30,2025-01-02T00:00:00,{},v1,True
+u2,2,gps,40,2025-01-02T00:05:00,{},,False
+u2,3,gps,90,2025-01-02T00:09:00,{},v2,False
+u3,1,ml,50,2025-01-03T00:00:00,{},v2,False
+,2,gps,10,2025-01-03T00:01:00,{},v2,False
+u3,2,,70,2025-01-03T00:02:00,{},v2,False
+"""
+CHECK_PIVOT = [("u1", "gps", 10.0, 20.0), ("u2", "gps", 30.0, 40.0), ("u3", "ml", 50.0, None)]
+
+def check_export():
+    # load_data and load_pivot_chunked must both read CHECK_EXPORT into CHECK_PIVOT (blank keys dropped)
+    import tempfile
+    expected = pd.DataFrame(CHECK_PIVOT, columns=["User ID", "Topic", "Score_Attempt1", "Score_Attempt2"])
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "export.csv")
+        with open(path, "w") as f:
+            f.write(CHECK_EXPORT)
+        results = {
+            "load_data": pivot_attempts(filter_attempts(load_data(path))),
+            "load_pivot_chunked": load_pivot_chunked(path, chunksize=2),
+        }
+    ok = True
+    for name, pivot in results.items():
+        got = pivot.sort_values(["User ID", "Topic"]).reset_index(drop=True)
+        got.columns.name = None
+        try:
+            pd.testing.assert_frame_equal(got, expected, check_dtype=False)
+            print(f"{name}: ok")
+        except AssertionError as e:
+            ok = False
+            print(f"{name}: mismatch\n{e}")
+    return ok
+
+def main():
+    parser = argparse.ArgumentParser(description="Attempt 1 vs attempt 2 analysis")
+    parser.add_argument("--source", choices=["csv", "sheets", "archive"], default="csv",
+                        help="read the exported CSV, the live Google Sheet, or the Parquet archive of the "
+                             "local log (sealed segments compacted by archive.py)")
+    parser.add_argument("--csv", default="submissions/submissions_google.csv")
+    parser.add_argument("--topic", action="append", help="with --source archive: only these topics (repeatable)")
+    parser.add_argument("--since", type=dt.date.fromisoformat, help="with --source archive: first date (YYYY-MM-DD)")
+    parser.add_argument("--until", type=dt.date.fromisoformat, help="with --source archive: last date (YYYY-MM-DD)")
+    parser.add_argument("--chunked", action="store_true",
+                        help="stream the CSV in chunks with bounded memory (for large multi-term exports)")
+    parser.add_argument("--chunksize", type=int, default=500_000, help="rows per chunk with --chunked")
+    parser.add_argument("--parallel", action="store_true",
+                        help="also analyze each topic, cohort and prompt version on a process pool, with "
+                             "bootstrap and permutation intervals, into one report")
+    parser.add_argument("--resamples", type=int, default=10_000, help="bootstrap/permutation resamples per group")
+    parser.add_argument("--workers", type=int, help="processes for --parallel (default: all cores)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--report", default="results/report.json", help="where --parallel writes its report")
+    parser.add_argument("--topic-plots", action="store_true", help="also plot each topic, in parallel")
+    parser.add_argument("--scatter", choices=["auto", "scatter", "hexbin", "decimate"], default="auto",
+                        help=f"scatter plot style; auto uses hexbin above {SCATTER_MAX_POINTS} users")
+    parser.add_argument("--force-plots", action="store_true", help="redraw plots even if the data is unchanged")
+    parser.add_argument("--check-export", action="store_true",
+                        help="check that both CSV readers parse an export whose header predates newer "
+                             "columns, and drop rows without a User ID or Topic")
+    args = parser.parse_args()
+    if args.check_export:
+        if not check_export():
+            raise SystemExit(1)
+        return
+    if args.chunked:
+        if args.source != "csv":
+            parser.error("--chunked reads a CSV export; use --source csv")
+        pivot = load_pivot_chunked(args.csv, args.chunksize)
+    else:
+        if args.source == "sheets":
+            df = load_sheet_data()
+        elif args.source == "archive":
+            df = load_archive_data(args.topic, args.since, args.until)
+        else:
+            df = load_data(args.csv)
+        df = filter_attempts(df)
+        pivot = pivot_attempts(df)
+    filtered = remove_perfect_first_attempt(pivot)
+    paired = compute_improvement(filtered)
+    stats = run_stats(paired)
+    summary = summarize(paired)
+    print_summary(summary, stats)
+    rendered = plot_improvement_hist(paired, force=args.force_plots)
+    rendered += plot_attempt_scatter(paired, style=args.scatter, force=args.force_plots)
+    if args.topic_plots:
+        rendered += plot_topics(paired, style=args.scatter, force=args.force_plots, workers=args.workers)
+    print(f"Plots redrawn: {rendered} (plots whose data is unchanged are kept)")
+    if args.parallel:
+        pairs = paired if args.chunked else pair_groups(df, paired)
+        results = run_group_analysis(pairs, args.resamples, args.seed, args.workers, args.report)
+        print_group_results(results)
+        print(f"Group report saved to {args.report}")
     print("Analysis complete. Plots saved.")
 
 if __name__ == "__main__":
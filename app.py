@@ -1,9 +1,22 @@
 #app.py
+import contextlib
+import os
+import time
 import streamlit as st
 from utils import (load_article, load_questions)
 from engine import handle_submission
+from pipeline import get_pipeline, QueueFull
+from admin import is_admin_request, render_admin
+import metrics
 
 st.set_page_config(page_title="🧠 Reading Comprehension Quiz", layout="centered")
+metrics.start_exporters()
+# Every widget interaction that reaches the server reruns this script
+metrics.inc("app.script_runs")
+
+if is_admin_request():
+    render_admin()
+    st.stop()
 
 if "user_id" not in st.session_state:
     st.session_state.user_id = None
@@ -17,12 +30,29 @@ if "submitted" not in st.session_state:
 if "feedback" not in st.session_state:
     st.session_state.feedback = None
 
+if "feedback_stream" not in st.session_state:
+    st.session_state.feedback_stream = None
+
+if "feedback_job" not in st.session_state:
+    st.session_state.feedback_job = None
+
 if "attempt" not in st.session_state:
     st.session_state.attempt = None
 
 # topic = "ai"
 topic = "gps"
 
+# How feedback reaches the results page:
+#   "stream"   - shown as it is generated
+#   "blocking" - the submit waits for the full response
+#   "job"      - the submit returns right away; the results page polls a background job
+feedback_delivery = os.getenv("FEEDBACK_DELIVERY", "stream")
+
+# How answers reach the server:
+#   "form"       - selections stay in the browser until "Submit Answers", so the quiz page runs once
+#   "checkboxes" - every click reruns the script
+quiz_mode = os.getenv("QUIZ_MODE", "form")
+
 # Enter phone number page (used as ID)
 if not st.session_state.user_id and not st.session_state.quiz_started:
     st.title("📱 Enter Your Phone Number")
@@ -60,7 +90,32 @@ if st.session_state.submitted:
 
     # Attempt 1 — feedback shown only if not perfect
     if st.session_state.attempt == 1:
-        if st.session_state.feedback:
+        if st.session_state.feedback_job is not None:
+            job = get_pipeline().status(st.session_state.feedback_job)
+            st.subheader("📘 Feedback")
+            if job["status"] == "done":
+                st.session_state.feedback = job["feedback"]
+                st.session_state.feedback_job = None
+                st.write(st.session_state.feedback)
+            elif job["status"] in ("failed", "unknown"):
+                st.session_state.feedback_job = None
+                st.session_state.feedback = None
+                st.error("Sorry, we couldn't generate feedback this time. Your submission was still recorded.")
+            else:
+                with st.spinner("Preparing your feedback..."):
+                    time.sleep(1)
+                st.rerun()
+        elif st.session_state.feedback_stream is not None:
+            st.subheader("📘 Feedback")
+            try:
+                st.session_state.feedback = st.write_stream(st.session_state.feedback_stream)
+            except Exception as e:
+                # The stream ends with fallback feedback on its own; what's left is the record failing
+                # to save once it has ended
+                print(f"Warning: streaming feedback failed: {e}")
+                st.error("Sorry, we couldn't record your submission this time.")
+            st.session_state.feedback_stream = None
+        elif st.session_state.feedback:
             st.subheader("📘 Feedback")
             st.write(st.session_state.feedback)
         else:
@@ -86,16 +141,20 @@ st.markdown("---")
 questions = load_questions(topic)
 user_answers = {}
 
-for i, q in enumerate(questions):
-    st.write(f"**Q{i+1}. {q['question']}**")
-    selected = []
-    for opt in q["options"]:
-        if st.checkbox(opt, key=f"q{i}_{opt}"):
-            selected.append(opt)
-    user_answers[i] = selected
-    st.markdown("---")
+with st.form("quiz", border=False) if quiz_mode == "form" else contextlib.nullcontext():
+    for i, q in enumerate(questions):
+        st.write(f"**Q{i+1}. {q['question']}**")
+        selected = []
+        for opt in q["options"]:
+            if st.checkbox(opt, key=f"q{i}_{opt}"):
+                selected.append(opt)
+        user_answers[i] = selected
+        st.markdown("---")
 
-if st.button("Submit Answers"):
+    submit_button = st.form_submit_button if quiz_mode == "form" else st.button
+    submitted = submit_button("Submit Answers")
+
+if submitted:
     payload = {
         "user_id": st.session_state.user_id,
         "topic": topic,
@@ -104,15 +163,26 @@ if st.button("Submit Answers"):
     }
 
     with st.spinner("Processing your submission..."):
-        result = handle_submission(payload)
+        if feedback_delivery == "job":
+            try:
+                result = get_pipeline().submit(payload)
+            except QueueFull as e:
+                st.error(str(e))
+                st.stop()
+        else:
+            result = handle_submission(payload, stream=feedback_delivery == "stream")
 
     if result.get("blocked"):
         st.session_state.submitted = True
         st.session_state.attempt = result.get("attempt")
         st.session_state.feedback = None
+        st.session_state.feedback_stream = None
+        st.session_state.feedback_job = None
         st.session_state.score = None
     else:
         st.session_state.feedback = result.get("feedback")
+        st.session_state.feedback_stream = result.get("feedback_stream")
+        st.session_state.feedback_job = result.get("job_id")
         st.session_state.attempt = result.get("attempt")
         st.session_state.score = result.get("score")
         st.session_state.submitted = True
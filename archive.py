@@ -0,0 +1,218 @@
+import argparse
+import datetime as dt
+import glob
+import json
+import os
+import time
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+from utils import ARCHIVE_DIR, ARCHIVE_STATE_PATH, sealed_segments, _iter_log_file
+
+# Sealed log segments compacted into Parquet, partitioned as topic=<topic>/date=<YYYY-MM-DD>/, with
+# typed columns instead of JSON. Readers ask for the columns they need and filter on topic and date,
+# so only the matching partitions and column chunks are read. The active log is never compacted,
+# and the JSONL segments stay where they are as the source of truth.
+
+
+PARTITIONING = ds.partitioning(pa.schema([("topic", pa.string()), ("date", pa.date32())]), flavor="hive")
+
+BASE_FIELDS = [
+    ("user_id", pa.string()),
+    ("attempt", pa.int32()),
+    ("score", pa.float64()),
+    ("timestamp", pa.timestamp("us")),
+    ("user_answers", pa.string()),
+    ("prompt_version", pa.string()),
+    ("feedback_degraded", pa.bool_()),
+]
+
+
+def compacted_segments():
+    # Basenames of the sealed segments already in the archive
+    try:
+        with open(ARCHIVE_STATE_PATH, "r", encoding="utf-8") as f:
+            return set(json.load(f)["segments"])
+    except (FileNotFoundError, ValueError, KeyError):
+        return set()
+
+
+def _save_state(segments):
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    tmp = ARCHIVE_STATE_PATH + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"segments": sorted(segments)}, f)
+    os.replace(tmp, ARCHIVE_STATE_PATH)
+
+
+def _as_list(value):
+    if value is None:
+        return None
+    return [str(v) for v in (value if isinstance(value, list) else [value])]
+
+
+def _question_columns(records):
+    # q<i>_answer / q<i>_correct from flatten_answers, in question order
+    names = {k for r in records for k in r if k.startswith("q") and k.endswith(("_answer", "_correct"))}
+    def order(name):
+        idx, _, kind = name[1:].partition("_")
+        return (int(idx) if idx.isdigit() else float("inf"), idx, kind != "answer")
+    return sorted(names, key=order)
+
+
+def _topic_table(records):
+    timestamps = []
+    for r in records:
+        try:
+            timestamps.append(dt.datetime.fromisoformat(r["timestamp"]))
+        except (KeyError, TypeError, ValueError):
+            timestamps.append(None)
+    columns = {
+        "user_id": pa.array([str(r["user_id"]).strip() for r in records], pa.string()),
+        "attempt": pa.array([int(r.get("attempt") or 0) for r in records], pa.int32()),
+        "score": pa.array([float(r["score"]) if r.get("score") is not None else None for r in records],
+                          pa.float64()),
+        "timestamp": pa.array(timestamps, pa.timestamp("us")),
+        # Kept whole as well, so nothing in the log is lost in the archive
+        "user_answers": pa.array([json.dumps(r.get("user_answers", {})) for r in records], pa.string()),
+        "prompt_version": pa.array([r.get("prompt_version") for r in records], pa.string()),
+        "feedback_degraded": pa.array([r.get("feedback_degraded") for r in records], pa.bool_()),
+        "date": pa.array([t.date() if t else None for t in timestamps], pa.date32()),
+    }
+    for name in _question_columns(records):
+        values = [r.get(name) for r in records]
+        try:
+            columns[name] = pa.array(values, pa.list_(pa.string()))
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # A bare string or non-string options from an older record
+            columns[name] = pa.array([_as_list(v) for v in values], pa.list_(pa.string()))
+    return pa.table(columns)
+
+
+def compact_segment(path, archive_dir=ARCHIVE_DIR):
+    # Writes one Parquet file per (topic, date) in the segment; re-running overwrites the same files
+    by_topic = {}
+    for record in _iter_log_file(path):
+        if record.get("user_id") is None or record.get("topic") is None:
+            continue
+        by_topic.setdefault(str(record["topic"]).strip(), []).append(record)
+    segment = os.path.basename(path)[:-len(".jsonl")]
+    rows = 0
+    for topic, records in by_topic.items():
+        table = _topic_table(records)
+        ds.write_dataset(
+            table, os.path.join(archive_dir, f"topic={topic}"), format="parquet",
+            partitioning=ds.partitioning(pa.schema([("date", pa.date32())]), flavor="hive"),
+            basename_template=f"{segment}-{{i}}.parquet", existing_data_behavior="overwrite_or_ignore",
+        )
+        rows += len(records)
+    return rows
+
+
+def compact(rebuild=False):
+    # Archives every sealed segment that isn't archived yet; returns (segments, rows) compacted
+    done = set() if rebuild else compacted_segments()
+    segments = rows = 0
+    for path in sealed_segments():
+        name = os.path.basename(path)
+        if name in done:
+            continue
+        rows += compact_segment(path)
+        done.add(name)
+        # Recorded after its files are written, so a crash only means the segment is redone
+        _save_state(done)
+        segments += 1
+    return segments, rows
+
+
+def archive_files(archive_dir=ARCHIVE_DIR):
+    # Only files of segments recorded as done; a segment cut short by a crash is left out until redone
+    done = {name[:-len(".jsonl")] for name in compacted_segments()}
+    paths = glob.glob(os.path.join(archive_dir, "topic=*", "date=*", "*.parquet"))
+    return sorted(p for p in paths if os.path.basename(p).rsplit("-", 1)[0] in done)
+
+
+def archive_dataset(columns=None, archive_dir=ARCHIVE_DIR):
+    files = archive_files(archive_dir)
+    if not files:
+        return None
+    schema = pa.schema(BASE_FIELDS + list(zip(PARTITIONING.schema.names, PARTITIONING.schema.types)))
+    if columns is None or not set(columns) <= set(schema.names):
+        # Topics have different numbers of questions, so the q<i> columns come from every file's footer
+        dataset = ds.dataset(files, format="parquet", partitioning=PARTITIONING, partition_base_dir=archive_dir)
+        schema = pa.unify_schemas([schema] + [f.physical_schema for f in dataset.get_fragments()])
+    return ds.dataset(files, format="parquet", partitioning=PARTITIONING, partition_base_dir=archive_dir,
+                      schema=schema)
+
+
+def _filter(topics=None, start=None, end=None):
+    expr = None
+    def both(a, b):
+        return b if a is None else a & b
+    if topics:
+        expr = both(expr, ds.field("topic").isin(list(topics)))
+    if start is not None:
+        expr = both(expr, ds.field("date") >= start)
+    if end is not None:
+        expr = both(expr, ds.field("date") <= end)
+    return expr
+
+
+def read_archive(columns=None, topics=None, start=None, end=None):
+    # Arrow table of the archived submissions; partitions outside topics/[start, end] are never opened
+    dataset = archive_dataset(columns)
+    if dataset is None:
+        fields = [f for f in BASE_FIELDS + list(zip(PARTITIONING.schema.names, PARTITIONING.schema.types))
+                  if columns is None or f[0] in columns]
+        return pa.schema(fields).empty_table()
+    return dataset.to_table(columns=columns, filter=_filter(topics, start, end))
+
+
+def load_archive(columns=None, topics=None, start=None, end=None):
+    return read_archive(columns, topics, start, end).to_pandas()
+
+
+def iter_archived_attempt_keys():
+    # (user_id, topic) for every archived submission; reads just those two columns
+    table = read_archive(columns=["user_id", "topic"])
+    yield from zip(table.column("user_id").to_pylist(), table.column("topic").to_pylist())
+
+
+def topic_report(topics=None, start=None, end=None):
+    # Submissions, students and mean score per topic and attempt
+    table = read_archive(columns=["topic", "attempt", "user_id", "score"], topics=topics, start=start, end=end)
+    grouped = table.group_by(["topic", "attempt"]).aggregate(
+        [("score", "count"), ("user_id", "count_distinct"), ("score", "mean")]
+    )
+    return grouped.sort_by([("topic", "ascending"), ("attempt", "ascending")]).to_pandas().rename(
+        columns={"score_count": "submissions", "user_id_count_distinct": "students", "score_mean": "mean_score"}
+    )
+
+
+def _date(value):
+    return dt.date.fromisoformat(value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compact sealed submission log segments into a Parquet archive")
+    parser.add_argument("--rebuild", action="store_true", help="re-archive every sealed segment")
+    parser.add_argument("--report", action="store_true", help="print per-topic totals from the archive")
+    parser.add_argument("--topic", action="append", help="only these topics in --report (repeatable)")
+    parser.add_argument("--since", type=_date, help="first date (YYYY-MM-DD) in --report")
+    parser.add_argument("--until", type=_date, help="last date (YYYY-MM-DD) in --report")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    segments, rows = compact(rebuild=args.rebuild)
+    print(f"Archived {rows} submissions from {segments} segment(s) in {time.perf_counter() - start:.2f}s "
+          f"({len(compacted_segments())} segment(s) in {ARCHIVE_DIR})")
+    if args.report:
+        start = time.perf_counter()
+        report = topic_report(args.topic, args.since, args.until)
+        print(report.to_string(index=False) if len(report) else "No archived submissions match.")
+        print(f"({1000 * (time.perf_counter() - start):.0f} ms)")
+
+
+if __name__ == "__main__":
+    main()
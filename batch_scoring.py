@@ -0,0 +1,220 @@
+import argparse
+import itertools
+import json
+import os
+import random
+
+import numpy as np
+import pandas as pd
+
+from utils import DATA_DIR, compute_score, load_answers, load_questions
+
+# Scores many submissions in one pass, e.g. to re-grade history after an answer key in
+# data/<topic>/answers.json is corrected. Each question's options map to bits of a uint64, so a
+# selection becomes one integer and "selection == key" is a single vectorized comparison.
+# Must agree exactly with utils.compute_score; "python batch_scoring.py --check-parity" checks it.
+
+# Any option that isn't in the question's vocabulary (renamed options, typos) sets this bit. The
+# key never has it, so such a selection is wrong, as it is for compute_score.
+UNKNOWN_BIT = np.uint64(1 << 63)
+MAX_OPTIONS = 63
+
+
+class _Ids(dict):
+    # key -> 0, 1, 2, ... in order of first lookup
+    def __missing__(self, key):
+        self[key] = len(self)
+        return len(self) - 1
+
+
+class AnswerKeyEncoding:
+    def __init__(self, correct_answers, questions=None):
+        key = {int(k): (v if isinstance(v, list) else [v]) for k, v in correct_answers.items()}
+        self.question_ids = sorted(key)
+        self._column = {q_idx: i for i, q_idx in enumerate(self.question_ids)}
+        self.vocabulary = []
+        for q_idx in self.question_ids:
+            options = list(dict.fromkeys(key[q_idx]))
+            if questions is not None and q_idx < len(questions):
+                options += [o for o in questions[q_idx]["options"] if o not in options]
+            if len(options) > MAX_OPTIONS:
+                raise ValueError(f"Question {q_idx} has more than {MAX_OPTIONS} options")
+            self.vocabulary.append({option: 1 << bit for bit, option in enumerate(options)})
+        self.key = np.array([self._mask(i, key[q_idx]) for i, q_idx in enumerate(self.question_ids)],
+                            dtype=np.uint64)
+
+    def _mask(self, column, selected):
+        vocabulary = self.vocabulary[column]
+        mask = 0
+        for option in set(selected):
+            mask |= vocabulary.get(option, int(UNKNOWN_BIT))
+        return mask
+
+    def encode(self, submissions):
+        # submissions: iterable of user_answers dicts -> (n, questions) uint64 matrix.
+        # Questions left out of a submission encode as 0, the empty selection. The dicts are flattened
+        # without a Python-level loop; students pick from a handful of combinations, so each distinct
+        # selection is encoded once (for every question) and the masks are gathered from that table.
+        submissions = submissions if isinstance(submissions, list) else list(submissions)
+        width = len(self.question_ids)
+        counts = np.fromiter(map(len, submissions), dtype=np.int64, count=len(submissions))
+        questions = list(itertools.chain.from_iterable(map(dict.keys, submissions)))
+        selections = list(itertools.chain.from_iterable(map(dict.values, submissions)))
+        # Question keys come as ints or as strings (JSON); there are only a few distinct ones
+        forms = {q: self._column.get(int(q), -1) for q in set(questions)}
+        columns = np.fromiter(map(forms.__getitem__, questions), dtype=np.int64, count=len(questions))
+        distinct = _Ids()
+        ids = np.fromiter(map(distinct.__getitem__, map(tuple, selections)), dtype=np.int64,
+                          count=len(selections))
+        table = np.array([[self._mask(column, selected) for column in range(width)] for selected in distinct],
+                         dtype=np.uint64).reshape(len(distinct), width)
+        masks = np.zeros((len(submissions), width), dtype=np.uint64)
+        rows = np.repeat(np.arange(len(submissions)), counts)
+        known = columns >= 0
+        # A key given twice (0 and "0") keeps the later selection, as assigning them in order would
+        masks[rows[known], columns[known]] = table[ids[known], columns[known]]
+        return masks
+
+    def correctness(self, masks):
+        return masks == self.key
+
+    def scores(self, correct):
+        total = len(self.question_ids)
+        if total == 0:
+            return np.zeros(len(correct))
+        return 100 * correct.sum(axis=1) / total
+
+
+def score_batch(submissions, correct_answers, questions=None):
+    # One row per submission: the score, then q<i> = whether question i was answered exactly right
+    encoding = AnswerKeyEncoding(correct_answers, questions)
+    correct = encoding.correctness(encoding.encode(submissions))
+    df = pd.DataFrame(correct, columns=[f"q{q_idx}" for q_idx in encoding.question_ids])
+    df.insert(0, "score", encoding.scores(correct))
+    return df
+
+
+def _parse_answers(value):
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            return {}
+    return value if isinstance(value, dict) else {}
+
+
+def load_submissions(source="local"):
+    # Historical submissions as a DataFrame with the stored score and the parsed answers
+    if source == "sheets":
+        from utils import get_sheet_mirror, sheet_header
+        mirror = get_sheet_mirror()
+        header = sheet_header(mirror.header)
+        df = pd.DataFrame([list(r[:len(header)]) + [""] * (len(header) - len(r)) for r in mirror.rows()],
+                          columns=header)
+        df = df.rename(columns={"User ID": "user_id", "Attempt": "attempt", "Topic": "topic",
+                                "Score": "score", "Timestamp": "timestamp", "Answers": "user_answers"})
+    else:
+        from utils import iter_local_submissions
+        df = pd.DataFrame([{field: r.get(field) for field in
+                            ("user_id", "attempt", "topic", "score", "timestamp", "user_answers")}
+                           for r in iter_local_submissions()],
+                          columns=["user_id", "attempt", "topic", "score", "timestamp", "user_answers"])
+    df["user_answers"] = df["user_answers"].map(_parse_answers)
+    df["score"] = pd.to_numeric(df["score"], errors="coerce")
+    return df
+
+
+def regrade(df, topics=None):
+    # Re-scores every submission against the current answer keys. Adds new_score, changed and the
+    # per-question columns; topics without a data/<topic>/ folder are left out.
+    parts = []
+    for topic, group in df.groupby("topic", sort=True):
+        if topics and topic not in topics:
+            continue
+        try:
+            correct_answers = load_answers(topic)
+            questions = load_questions(topic)
+        except FileNotFoundError:
+            print(f"Warning: no answer key for topic {topic!r}; skipping {len(group)} submissions")
+            continue
+        scored = score_batch(group["user_answers"], correct_answers, questions)
+        scored.index = group.index
+        part = group.drop(columns=["user_answers"]).assign(new_score=scored.pop("score"))
+        part["changed"] = ~np.isclose(part["score"], part["new_score"])
+        parts.append(pd.concat([part, scored], axis=1))
+    if not parts:
+        return pd.DataFrame()
+    return pd.concat(parts).sort_index()
+
+
+def random_submissions(questions, n, seed=0):
+    # Covers what compute_score has to handle: missing and extra questions, str and int keys,
+    # duplicates, unknown options and the occasional non-list value
+    rng = random.Random(seed)
+    submissions = []
+    for _ in range(n):
+        user_answers = {}
+        for q_idx, q in enumerate(questions):
+            roll = rng.random()
+            if roll < 0.1:
+                continue
+            selected = rng.sample(q["options"], rng.randint(0, len(q["options"])))
+            if roll < 0.15:
+                selected.append("not an option")
+            elif roll < 0.2 and selected:
+                selected.append(selected[0])
+            elif roll < 0.22:
+                selected = rng.choice(q["options"])
+            user_answers[str(q_idx) if rng.random() < 0.5 else q_idx] = selected
+        if rng.random() < 0.05:
+            user_answers[len(questions) + 3] = ["extra"]
+        submissions.append(user_answers)
+    return submissions
+
+
+def check_parity(topic, n=20000, seed=0):
+    correct_answers = load_answers(topic)
+    questions = load_questions(topic)
+    submissions = random_submissions(questions, n, seed)
+    # Perfect submissions in every accepted form too
+    submissions.append(dict(correct_answers))
+    submissions.append({int(k): list(reversed(v)) for k, v in correct_answers.items()})
+    submissions.append({})
+    batch = score_batch(submissions, correct_answers, questions)["score"].tolist()
+    mismatches = [(i, expected, got) for i, (expected, got) in
+                  enumerate(zip((compute_score(s, correct_answers) for s in submissions), batch))
+                  if expected != got]
+    for i, expected, got in mismatches[:5]:
+        print(f"  mismatch: {submissions[i]} compute_score={expected} batch={got}")
+    print(f"{topic}: {len(submissions)} submissions, {len(mismatches)} mismatches")
+    return not mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-grade stored submissions against the current answer keys")
+    parser.add_argument("--source", choices=["local", "sheets"], default="local")
+    parser.add_argument("--topic", action="append", help="only these topics (repeatable)")
+    parser.add_argument("--out", default="results/regraded.csv")
+    parser.add_argument("--check-parity", action="store_true",
+                        help="compare against compute_score on random submissions instead of re-grading")
+    args = parser.parse_args()
+
+    if args.check_parity:
+        topics = args.topic or sorted(os.listdir(DATA_DIR))
+        if not all([check_parity(topic) for topic in topics]):
+            raise SystemExit(1)
+        return
+
+    regraded = regrade(load_submissions(args.source), args.topic)
+    if regraded.empty:
+        print("No submissions to re-grade.")
+        return
+    regraded.to_csv(args.out, index=False)
+    changed = regraded[regraded["changed"]]
+    print(f"Re-graded {len(regraded)} submissions; {len(changed)} scores changed. Saved to {args.out}")
+    for topic, group in changed.groupby("topic"):
+        print(f"  {topic}: {len(group)} changed, mean change {(group['new_score'] - group['score']).mean():+.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1093 @@
+import argparse
+import asyncio
+import os
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import utils
+
+
+def _rate(fn, seconds):
+    runs = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        fn()
+        runs += 1
+    return runs / (time.perf_counter() - start)
+
+
+def bench_catalog(topic="gps", seconds=2.0):
+    # One quiz-page rerun loads the article and questions; a submit also loads and scores the answers
+    questions = utils.read_questions(topic)
+    user_answers = {i: q["options"][:1] for i, q in enumerate(questions)}
+
+    def rerun_uncached():
+        utils.read_article(topic)
+        utils.read_questions(topic)
+
+    def rerun_cached():
+        utils.load_article(topic)
+        utils.load_questions(topic)
+
+    def submit_uncached():
+        utils.read_article(topic)
+        answers = utils.read_answers(topic)
+        utils.compute_score(user_answers, answers)
+        utils.flatten_answers(user_answers, answers)
+
+    def submit_cached():
+        utils.load_article(topic)
+        answers = utils.load_answers(topic)
+        utils.compute_score(user_answers, answers, utils.load_answer_sets(topic))
+        utils.flatten_answers(user_answers, answers, utils.load_normalized_answers(topic))
+
+    print(f"===== Topic catalog ({topic}) =====")
+    for name, uncached, cached in [("reruns", rerun_uncached, rerun_cached),
+                                   ("submits", submit_uncached, submit_cached)]:
+        before = _rate(uncached, seconds)
+        after = _rate(cached, seconds)
+        print(f"{name}/sec without catalog: {before:,.0f}")
+        print(f"{name}/sec with catalog:    {after:,.0f} ({after / before:.1f}x)")
+
+
+def _use_fake_openai(server):
+    os.environ["OPENAI_BASE_URL"] = server.base_url
+    os.environ.setdefault("OPENAI_API_KEY", "fake-key")
+
+
+def bench_stream(topic="gps", students=30, first_token_delay=0.5, token_delay=0.02):
+    # Time-to-first-feedback for a class submitting at once: blocking vs streaming
+    import engine
+    from fakes import FakeOpenAIServer
+
+    article = utils.load_article(topic)
+    answers = utils.load_answers(topic)
+    user_answers = {i: [] for i in range(len(answers))}
+
+    def blocking():
+        start = time.perf_counter()
+        engine.get_feedback(article, answers, user_answers)
+        return time.perf_counter() - start
+
+    def streaming():
+        start = time.perf_counter()
+        first = None
+        for _ in engine.stream_feedback(article, answers, user_answers):
+            first = first or time.perf_counter() - start
+        return first
+
+    with FakeOpenAIServer(first_token_delay=first_token_delay, token_delay=token_delay) as server:
+        _use_fake_openai(server)
+        print(f"===== Time to first feedback ({students} concurrent students) =====")
+        with ThreadPoolExecutor(max_workers=students) as pool:
+            for name, fn in [("blocking", blocking), ("streaming", streaming)]:
+                times = list(pool.map(lambda _: fn(), range(students)))
+                print(f"{name:<16} median {statistics.median(times):.3f}s  max {max(times):.3f}s")
+
+
+def bench_async(topic="gps", students=30, first_token_delay=0.5, token_delay=0.02, seed=3):
+    # The budgeted path (cache, single-flight, scheduler, budget) from a thread per student vs from
+    # one asyncio event loop; distinct answers, so every student needs a model call
+    import random
+    import engine
+    from fakes import FakeOpenAIServer
+    from feedback_cache import FeedbackCache
+
+    rng = random.Random(seed)
+    article = utils.load_article(topic)
+    answers = utils.load_answers(topic)
+    questions = utils.load_questions(topic)
+    classroom = [{i: rng.sample(q["options"], rng.randint(0, 2)) for i, q in enumerate(questions)}
+                 for _ in range(students)]
+
+    def streaming(user_answers):
+        start = time.perf_counter()
+        stream, _ = engine.budgeted_stream(topic, article, answers, user_answers)
+        first = None
+        for _ in stream:
+            first = first or time.perf_counter() - start
+        return first, time.perf_counter() - start
+
+    async def streaming_async(user_answers):
+        start = time.perf_counter()
+        stream, _ = await engine.budgeted_stream_async(topic, article, answers, user_answers)
+        first = None
+        async for _ in stream:
+            first = first or time.perf_counter() - start
+        return first, time.perf_counter() - start
+
+    async def blocking_async(user_answers):
+        start = time.perf_counter()
+        await engine.budgeted_feedback_async(topic, article, answers, user_answers)
+        return time.perf_counter() - start, time.perf_counter() - start
+
+    async def burst(fn):
+        return await asyncio.gather(*[fn(a) for a in classroom])
+
+    def threads(fn):
+        with ThreadPoolExecutor(max_workers=students) as pool:
+            return list(pool.map(fn, classroom))
+
+    with FakeOpenAIServer(first_token_delay=first_token_delay, token_delay=token_delay) as server:
+        _use_fake_openai(server)
+        print(f"===== Budgeted feedback from threads vs asyncio ({students} concurrent students) =====")
+        # Connections, prompt building and retrieval warmed up first
+        engine.budgeted_feedback(topic, article, answers, {})
+        runs = [
+            ("threads, stream", lambda: threads(streaming)),
+            ("asyncio, stream", lambda: asyncio.run(burst(streaming_async))),
+            ("asyncio, blocking", lambda: asyncio.run(burst(blocking_async))),
+        ]
+        for name, run in runs:
+            engine.set_feedback_cache(FeedbackCache())
+            before = server.requests
+            results = run()
+            firsts = [first for first, _ in results if first is not None]
+            print(f"{name:<18} first text median {statistics.median(firsts):.3f}s  "
+                  f"done max {max(total for _, total in results):.3f}s  LLM calls {server.requests - before}")
+        engine.set_feedback_cache(None)
+
+
+def bench_pool(topic="gps", students=50, first_token_delay=0.2):
+    # A burst of submissions with a fresh client per call (the old get_client) vs the shared provider
+    import engine
+    from fakes import FakeOpenAIServer
+
+    article = utils.load_article(topic)
+    answers = utils.load_answers(topic)
+    user_answers = {i: [] for i in range(len(answers))}
+
+    def call(provider):
+        start = time.perf_counter()
+        provider.client.chat.completions.create(
+            model=engine.FEEDBACK_MODEL,
+            messages=engine.build_messages(article, answers, user_answers),
+        )
+        return time.perf_counter() - start
+
+    with FakeOpenAIServer(first_token_delay=first_token_delay, token_delay=0) as server:
+        _use_fake_openai(server)
+        print(f"===== OpenAI client pooling ({students} submissions, 2 bursts) =====")
+        fresh = []
+        shared = engine.OpenAIProvider()
+        for name, provider_for_call in [("fresh client", lambda: fresh.append(engine.OpenAIProvider()) or fresh[-1]),
+                                        ("shared client", lambda: shared)]:
+            with ThreadPoolExecutor(max_workers=students) as pool:
+                times = []
+                for _ in range(2):
+                    times += pool.map(lambda _: call(provider_for_call()), range(students))
+            providers = fresh if name == "fresh client" else [shared]
+            connects = sum(p.stats["connects"] for p in providers)
+            handshake = sum(p.stats["connect_seconds"] + p.stats["tls_seconds"] for p in providers)
+            times.sort()
+            print(f"{name:<14} p50 {times[len(times) // 2]:.3f}s  p95 {times[int(len(times) * 0.95)]:.3f}s  "
+                  f"connections {connects}  handshake time {handshake:.3f}s")
+        for p in fresh + [shared]:
+            p.close()
+
+
+def bench_feedback_cache(topic="gps", students=200, patterns=12, first_token_delay=0.3, seed=1):
+    # A class where most students share a handful of mistake patterns
+    import random
+    import engine
+    from fakes import FakeOpenAIServer
+    from feedback_cache import FeedbackCache
+
+    rng = random.Random(seed)
+    article = utils.load_article(topic)
+    answers = utils.load_answers(topic)
+    questions = utils.load_questions(topic)
+    common = []
+    for _ in range(patterns):
+        pattern = {int(k): list(v) for k, v in answers.items()}
+        q = rng.randrange(len(questions))
+        pattern[q] = rng.sample(questions[q]["options"], rng.randint(1, 2))
+        common.append(pattern)
+
+    with FakeOpenAIServer(first_token_delay=first_token_delay, token_delay=0) as server:
+        _use_fake_openai(server)
+        engine.set_feedback_cache(FeedbackCache())
+        start = time.perf_counter()
+        for _ in range(students):
+            engine.get_cached_feedback(topic, article, answers, rng.choice(common))
+        elapsed = time.perf_counter() - start
+        stats = engine.get_feedback_cache().stats()
+        print(f"===== Feedback cache ({students} students, {patterns} mistake patterns) =====")
+        print(f"hit rate {stats['hit_rate']:.1%}  LLM calls {server.requests}  "
+              f"total {elapsed:.2f}s (uncached would be ~{students * first_token_delay:.0f}s)")
+
+
+def bench_fragments(topic="gps", students=200, mistake_rate=0.3, first_token_delay=0.2, seed=1):
+    # Each student misses a few questions, picking from two common mistakes per question.
+    # Whole responses rarely repeat; per-question fragments do.
+    import random
+    import engine
+    from fakes import FakeOpenAIServer
+    from feedback_cache import FeedbackCache
+
+    rng = random.Random(seed)
+    article = utils.load_article(topic)
+    answers = utils.load_answers(topic)
+    questions = utils.load_questions(topic)
+    mistakes = {int(k): [[o for o in questions[int(k)]["options"] if o not in v][:1], list(v)[:1]]
+                for k, v in answers.items()}
+    classroom = []
+    for _ in range(students):
+        submission = {int(k): list(v) for k, v in answers.items()}
+        for q in submission:
+            if rng.random() < mistake_rate:
+                submission[q] = rng.choice(mistakes[q])
+        classroom.append(submission)
+
+    print(f"===== Full vs per-question feedback ({students} students) =====")
+    with FakeOpenAIServer(first_token_delay=first_token_delay, token_delay=0) as server:
+        _use_fake_openai(server)
+        for mode in ("full", "per_question"):
+            engine.set_feedback_cache(FeedbackCache())
+            before = server.requests
+            start = time.perf_counter()
+            for submission in classroom:
+                if mode == "full":
+                    engine.get_cached_feedback(topic, article, answers, submission)
+                else:
+                    engine.get_composed_feedback(topic, article, submission)
+            stats = engine.get_feedback_cache().stats()
+            print(f"{mode:<13} hit rate {stats['hit_rate']:.1%}  LLM calls {server.requests - before}  "
+                  f"total {time.perf_counter() - start:.2f}s")
+
+
+def bench_coalescing(topic="gps", students=20, latency=1.0):
+    # A class submitting the same mistakes at once against a slow model. Without the single-flight
+    # layer every student misses the cache; with it they share one upstream request, in each path.
+    import engine
+    from fakes import FakeOpenAIProvider
+    from feedback_cache import FeedbackCache
+
+    article = utils.load_article(topic)
+    answers = utils.load_answers(topic)
+    mistake = {int(k): list(v) for k, v in answers.items()}
+    mistake[0] = []
+    paths = {
+        "blocking": lambda: engine.get_cached_feedback(topic, article, answers, mistake),
+        "streaming": lambda: "".join(engine.stream_cached_feedback(topic, article, answers, mistake)),
+        "per_question": lambda: engine.get_composed_feedback(topic, article, mistake),
+    }
+    timeout = engine.feedback_flights.timeout
+    failed = False
+
+    def burst(fn, client_kwargs):
+        provider = FakeOpenAIProvider(**client_kwargs)
+        engine.set_provider(provider)
+        engine.set_feedback_cache(FeedbackCache())
+        before = engine.feedback_flights.stats()
+        start = time.perf_counter()
+
+        def call(_):
+            try:
+                return fn()
+            except Exception as e:
+                return e
+        with ThreadPoolExecutor(max_workers=students) as pool:
+            results = list(pool.map(call, range(students)))
+        after = engine.feedback_flights.stats()
+        coalesced = after["coalesced"] - before["coalesced"]
+        calls = coalesced + after["leaders"] - before["leaders"]
+        return results, provider.client.requests, coalesced / calls, time.perf_counter() - start
+
+    print(f"===== Request coalescing ({students} identical submissions, {latency:.1f}s model) =====")
+    for name, fn in paths.items():
+        results, requests, ratio, elapsed = burst(fn, {"latency": latency})
+        ok = all(r == results[0] and isinstance(r, str) and r for r in results)
+        failed |= requests != 1 or not ok
+        print(f"{name:<13} upstream requests {requests}  coalescing ratio {ratio:.0%}  "
+              f"all got the feedback: {ok}  {elapsed:.2f}s")
+
+    results, requests, _, _ = burst(paths["blocking"], {"latency": latency, "fail_rate": 1.0})
+    ok = all(isinstance(r, RuntimeError) for r in results)
+    failed |= requests != 1 or not ok
+    print(f"upstream error: requests {requests}  every caller got the error: {ok}")
+
+    engine.feedback_flights.timeout = latency / 4
+    try:
+        results, requests, _, _ = burst(paths["blocking"], {"latency": latency})
+    finally:
+        engine.feedback_flights.timeout = timeout
+    timeouts = sum(isinstance(r, TimeoutError) for r in results)
+    failed |= requests != 1 or timeouts != students - 1
+    print(f"waiter timeout {latency / 4:.2f}s: requests {requests}  timed out {timeouts}  "
+          f"leader finished: {sum(isinstance(r, str) for r in results) == 1}")
+    if failed:
+        raise SystemExit("FAILED")
+
+
+def bench_latency_budget(topic="gps", students=60, latency=0.5, stall_rate=0.1, stall_latency=8.0,
+                         fallback_latency=0.6, hedge_after=1.5, budget=3.0, seed=3):
+    # Submit latency against a provider where stall_rate of the calls hang for stall_latency seconds:
+    # unbounded, hedged to a fallback endpoint, with a budget, and both. Every submission has its own
+    # mistakes, so the cache doesn't help. Degraded results must match the records' flag.
+    import json
+    import random
+    import tempfile
+    import engine
+    from fakes import FakeOpenAIProvider
+    from feedback_cache import FeedbackCache
+
+    rng = random.Random(seed)
+    questions = utils.load_questions(topic)
+    classroom = [{i: rng.sample(q["options"], rng.randint(0, 2)) for i, q in enumerate(questions)}
+                 for _ in range(students)]
+    settings = (engine.FEEDBACK_BUDGET, engine.FEEDBACK_HEDGE_AFTER)
+    scenarios = [("no budget", 0, 0), ("hedged", 0, hedge_after), ("budget", budget, 0),
+                 ("hedged + budget", budget, hedge_after)]
+    cwd = os.getcwd()
+    print(f"===== Latency budget ({students} submissions, {latency:.1f}s model, {stall_rate:.0%} of calls "
+          f"stall {stall_latency:.0f}s, fallback {fallback_latency:.1f}s) =====")
+    failed = False
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        try:
+            for n, (name, budget_s, hedge_s) in enumerate(scenarios):
+                engine.FEEDBACK_BUDGET, engine.FEEDBACK_HEDGE_AFTER = budget_s, hedge_s
+                primary = FakeOpenAIProvider(latency=latency, stall_rate=stall_rate, stall_latency=stall_latency,
+                                             seed=seed)
+                fallback = FakeOpenAIProvider(latency=fallback_latency)
+                engine.set_provider(primary)
+                engine.set_fallback_provider(fallback)
+                engine.set_feedback_cache(FeedbackCache())
+
+                def submit(i):
+                    start = time.perf_counter()
+                    result = engine.handle_submission({"user_id": f"+20{n:02d}{i:08d}", "topic": topic,
+                                                       "answers": classroom[i], "num_questions": len(questions)})
+                    return time.perf_counter() - start, result
+
+                with ThreadPoolExecutor(max_workers=10) as pool:
+                    results = list(pool.map(submit, range(students)))
+                times = sorted(t for t, _ in results)
+                degraded = sum(bool(r.get("feedback_degraded")) for _, r in results)
+                with open(utils.SUBMISSIONS_PATH, encoding="utf-8") as f:
+                    flagged = sum(1 for line in f if json.loads(line)["user_id"].startswith(f"+20{n:02d}")
+                                  and json.loads(line).get("feedback_degraded"))
+                failed |= flagged != degraded
+                print(f"{name:<16} p50 {times[len(times) // 2]:.2f}s  p99 {times[int(len(times) * 0.99)]:.2f}s  "
+                      f"max {times[-1]:.2f}s  hedged {fallback.client.requests}  degraded {degraded} "
+                      f"(records flagged {flagged})")
+        finally:
+            os.chdir(cwd)
+            engine.FEEDBACK_BUDGET, engine.FEEDBACK_HEDGE_AFTER = settings
+            engine.set_fallback_provider(None)
+    if failed:
+        raise SystemExit("FAILED")
+
+
+def bench_scheduler(topic="gps", students=60, warmups=40, latency=0.5, provider_limit=8, seed=5):
+    # A warm-up run is filling the cache when a class submits at once, against a provider that answers
+    # 429 past provider_limit concurrent calls: every call sent straight through vs the admission
+    # scheduler (adaptive concurrency, then with a requests/min budget too)
+    import contextlib
+    import io
+    import random
+    import tempfile
+    import engine
+    import scheduler
+    from fakes import FakeOpenAIProvider
+    from feedback_cache import FeedbackCache
+
+    rng = random.Random(seed)
+    article = utils.load_article(topic)
+    correct_answers = utils.load_answers(topic)
+    questions = utils.load_questions(topic)
+    classroom = [{i: rng.sample(q["options"], rng.randint(0, 2)) for i, q in enumerate(questions)}
+                 for _ in range(students + warmups)]
+    scenarios = [
+        ("unscheduled", lambda: scheduler.Scheduler(max_concurrency=1000, min_concurrency=1000)),
+        ("adaptive", lambda: scheduler.Scheduler(max_concurrency=32)),
+        ("adaptive + 600 rpm", lambda: scheduler.Scheduler(rpm=600, max_concurrency=32)),
+    ]
+    cwd = os.getcwd()
+    print(f"===== LLM admission scheduler ({students} submissions during {warmups} warm-up calls, "
+          f"provider allows {provider_limit} at once) =====")
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        try:
+            for n, (name, make) in enumerate(scenarios):
+                provider = FakeOpenAIProvider(latency=latency, max_in_flight=provider_limit)
+                engine.set_provider(provider)
+                engine.set_feedback_cache(FeedbackCache())
+                engine.set_scheduler(make())
+
+                def warm(i):
+                    start = time.perf_counter()
+                    try:
+                        with scheduler.priority(scheduler.WARMUP):
+                            engine.get_cached_feedback(topic, article, correct_answers, classroom[students + i])
+                        return time.perf_counter() - start, True
+                    except Exception:
+                        return time.perf_counter() - start, False
+
+                def submit(i):
+                    start = time.perf_counter()
+                    result = engine.handle_submission({"user_id": f"+30{n:02d}{i:08d}", "topic": topic,
+                                                       "answers": classroom[i], "num_questions": len(questions)})
+                    return time.perf_counter() - start, result
+
+                # Each refused call prints a warning; only the totals matter here
+                with ThreadPoolExecutor(max_workers=students + warmups) as pool, \
+                        contextlib.redirect_stdout(io.StringIO()):
+                    warm_futures = [pool.submit(warm, i) for i in range(warmups)]
+                    time.sleep(0.1)
+                    submitted = list(pool.map(submit, range(students)))
+                    warmed = [f.result() for f in warm_futures]
+                times = sorted(t for t, _ in submitted)
+                degraded = sum(bool(r.get("feedback_degraded")) for _, r in submitted)
+                stats = engine.get_scheduler().stats()
+                print(f"{name:<19} submit p50 {times[len(times) // 2]:.2f}s  p99 {times[int(len(times) * 0.99)]:.2f}s  "
+                      f"degraded {degraded}  warm-up failed {sum(not ok for _, ok in warmed)} "
+                      f"(done in {max(t for t, _ in warmed):.1f}s)  429s {provider.client.rate_limited}  "
+                      f"peak upstream {provider.client.peak_in_flight}  limit {stats['concurrency_limit']}")
+        finally:
+            os.chdir(cwd)
+            engine.set_scheduler(None)
+
+
+def _record_calls(provider):
+    # Wall-clock start of every call the fake provider receives, comparable across processes
+    times = []
+    create = provider.client.create
+
+    def timed(*args, **kwargs):
+        times.append(time.time())
+        return create(*args, **kwargs)
+    provider.client.chat.completions.create = timed
+    return times
+
+
+def _warmup_worker(args):
+    # warmup.py in its own process: a pool of warm-up calls against the budget at `path` (None = its own)
+    workdir, path, rpm, topic, calls, latency = args
+    import engine
+    import scheduler
+    from fakes import FakeOpenAIProvider
+
+    os.chdir(workdir)
+    provider = FakeOpenAIProvider(latency=latency)
+    times = _record_calls(provider)
+    engine.set_provider(provider)
+    engine.set_scheduler(scheduler.Scheduler(rpm=rpm, max_concurrency=8, path=path))
+    article = utils.load_article(topic)
+    correct_answers = utils.load_answers(topic)
+
+    def warm(_):
+        with scheduler.priority(scheduler.WARMUP):
+            engine.get_feedback(article, correct_answers, {})
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(warm, range(calls)))
+    return times
+
+
+def bench_scheduler_shared(topic="gps", students=30, warmups=60, rpm=600, latency=0.3):
+    # warmup.py running next to the app: with their own budgets the two processes together send up to
+    # twice the account's rpm; with the shared one they stay under it and students go first
+    import multiprocessing
+    import tempfile
+    import engine
+    import scheduler
+    from fakes import FakeOpenAIProvider
+
+    article = utils.load_article(topic)
+    correct_answers = utils.load_answers(topic)
+    print(f"===== Scheduler across processes ({students} submissions while another process warms "
+          f"{warmups}, {rpm:.0f} rpm = {rpm / 60:.0f}/s) =====")
+    ctx = multiprocessing.get_context("spawn")
+    for name, shared in (("separate budgets", False), ("shared budget", True)):
+        with tempfile.TemporaryDirectory() as workdir:
+            path = os.path.join(workdir, "llm_scheduler.sqlite3") if shared else None
+            provider = FakeOpenAIProvider(latency=latency)
+            times = _record_calls(provider)
+            engine.set_provider(provider)
+            engine.set_scheduler(scheduler.Scheduler(rpm=rpm, max_concurrency=32, path=path))
+            try:
+                with ctx.Pool(1) as pool:
+                    warm = pool.apply_async(_warmup_worker, ((workdir, path, rpm, topic, warmups, latency),))
+                    # Let warm-up get going first, as it would before a class starts
+                    time.sleep(2.0)
+
+                    def submit(_):
+                        start = time.perf_counter()
+                        engine.get_feedback(article, correct_answers, {})
+                        return time.perf_counter() - start
+                    window_start = time.time()
+                    with ThreadPoolExecutor(max_workers=students) as threads:
+                        waits = sorted(threads.map(submit, range(students)))
+                    window_end = time.time()
+                    warm_times = warm.get()
+            finally:
+                engine.set_scheduler(None)
+        calls = sorted(times + warm_times)
+        # A bucket lets through one second's burst on top of the rate, so look at a window longer than that
+        busiest = max(sum(1 for t in calls[i:] if t < start + 5.0) for i, start in enumerate(calls))
+        during = sum(1 for t in warm_times if window_start <= t < window_end)
+        print(f"{name:<17} submit p50 {waits[len(waits) // 2]:.2f}s  max {waits[-1]:.2f}s  "
+              f"busiest 5s {busiest} calls (budget {rpm / 12:.0f} + burst {rpm / 60:.0f})  warm-up calls while students waited {during}")
+
+
+def bench_sheets(students=200, latency=0.3):
+    # Submit-path cost of one append_row per submission vs the write-behind queue
+    import tempfile
+    from fakes import FakeWorksheet
+
+    row = ["+200000000000", 1, "gps", 50.0, "2025-01-01T00:00:00", "{}"]
+    print(f"===== Sheets writes ({students} submissions, {latency:.1f}s per API call) =====")
+    ws = FakeWorksheet(latency=latency)
+    with ThreadPoolExecutor(max_workers=20) as pool:
+        start = time.perf_counter()
+        list(pool.map(lambda _: ws.append_row(row), range(students)))
+    print(f"append_row per submission: {time.perf_counter() - start:.2f}s, {ws.calls} API calls")
+
+    ws = FakeWorksheet(latency=latency)
+    with tempfile.TemporaryDirectory() as tmp:
+        writer = utils.SheetWriter(worksheet=lambda: ws, spool_path=os.path.join(tmp, "spool.jsonl"))
+        with ThreadPoolExecutor(max_workers=20) as pool:
+            start = time.perf_counter()
+            list(pool.map(lambda _: writer.append(row), range(students)))
+        submit = time.perf_counter() - start
+        writer.close()
+    print(f"write-behind queue:        {submit:.2f}s on the submit path, {ws.calls} API calls")
+
+
+def _submit_worker(args):
+    workdir, topic, users, submissions, seed = args
+    import random
+    import engine
+    os.chdir(workdir)
+    rng = random.Random(seed)
+    answers = {int(k): list(v) for k, v in utils.load_answers(topic).items()}
+    for _ in range(submissions):
+        # Perfect answers, so no feedback call is needed and the race window is just the storage layer
+        engine.handle_submission({"user_id": rng.choice(users), "topic": topic, "answers": answers,
+                                  "num_questions": len(answers)})
+
+
+def bench_attempts(topic="gps", processes=8, users=50, submissions=100, segment_bytes=20000):
+    # Several worker processes hammering the same students; every student must end up with
+    # exactly attempts 1 and 2 in the log, each once, and the index must agree with the log
+    import json
+    import multiprocessing
+    import tempfile
+    from collections import Counter, defaultdict
+
+    os.environ["SUBMISSIONS_SEGMENT_BYTES"] = str(segment_bytes)
+    user_ids = [f"+20{i:010d}" for i in range(users)]
+    with tempfile.TemporaryDirectory() as workdir:
+        start = time.perf_counter()
+        ctx = multiprocessing.get_context("spawn")
+        with ctx.Pool(processes) as pool:
+            pool.map(_submit_worker, [(workdir, topic, user_ids, submissions, seed) for seed in range(processes)])
+        elapsed = time.perf_counter() - start
+
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            attempts = defaultdict(list)
+            lines = bad = 0
+            for path in utils.sealed_segments() + [utils.SUBMISSIONS_PATH]:
+                with open(path, encoding="utf-8") as f:
+                    for line in f:
+                        lines += 1
+                        try:
+                            rec = json.loads(line)
+                            attempts[rec["user_id"]].append(rec["attempt"])
+                        except ValueError:
+                            bad += 1
+            index = utils.AttemptIndex()
+            index_counts = Counter({u: index.count(u, topic) for u in user_ids})
+            segments = len(utils.sealed_segments())
+        finally:
+            os.chdir(cwd)
+
+    wrong = {u: sorted(a) for u, a in attempts.items() if sorted(a) != [1, 2]}
+    mismatched = [u for u in user_ids if index_counts[u] != len(attempts.get(u, []))]
+    print(f"===== Concurrent attempts ({processes} processes x {submissions} submits, {users} students) =====")
+    print(f"{lines} records in {segments + 1} segments in {elapsed:.2f}s")
+    print(f"corrupt lines: {bad}  students with lost/duplicated attempts: {len(wrong)}  "
+          f"index mismatches: {len(mismatched)}")
+    if bad or wrong or mismatched or len(attempts) != users:
+        raise SystemExit("FAILED")
+
+
+def bench_batch_scoring(topic="gps", submissions=200000, seed=0):
+    # Re-grading history: compute_score per submission vs one vectorized pass
+    from batch_scoring import AnswerKeyEncoding, random_submissions
+
+    answers = utils.load_answers(topic)
+    questions = utils.load_questions(topic)
+    subs = random_submissions(questions, submissions, seed)
+    start = time.perf_counter()
+    expected = [utils.compute_score(s, answers) for s in subs]
+    loop = time.perf_counter() - start
+    encoding = AnswerKeyEncoding(answers, questions)
+    start = time.perf_counter()
+    masks = encoding.encode(subs)
+    encoded = time.perf_counter() - start
+    scores = encoding.scores(encoding.correctness(masks)).tolist()
+    scored = time.perf_counter() - start - encoded
+    print(f"===== Batch scoring ({submissions} submissions) =====")
+    print(f"compute_score loop {loop:.2f}s  batch: encode {encoded:.2f}s + score {scored * 1000:.0f}ms "
+          f"({loop / (encoded + scored):.1f}x)  parity {'ok' if scores == expected else 'MISMATCH'}")
+
+
+_ANALYSIS_PROBE = """
+import json, resource, sys
+import analysis
+path, mode = sys.argv[1], sys.argv[2]
+if mode == "chunked":
+    pivot = analysis.load_pivot_chunked(path)
+else:
+    pivot = analysis.pivot_attempts(analysis.filter_attempts(analysis.load_data(path)))
+paired = analysis.compute_improvement(analysis.remove_perfect_first_attempt(pivot))
+summary = analysis.summarize(paired)
+print(json.dumps({"rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                  "summary": summary}, default=float))
+"""
+
+
+def _synthetic_export(path, rows, users, seed=0, block=1_000_000):
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    topics = np.array(["gps", "ai", "climate", "vaccines", "memory", "sleep"])
+    for start in range(0, rows, block):
+        n = min(block, rows - start)
+        user = rng.integers(0, users, n)
+        pd.DataFrame({
+            "User ID": np.char.add("+20", np.char.zfill(user.astype(str), 10)),
+            "Attempt": rng.integers(1, 4, n),
+            "Topic": topics[rng.integers(0, len(topics), n)],
+            "Score": rng.integers(0, 11, n) * 10.0,
+            "Timestamp": "2025-01-15T10:30:00.000000",
+            "Answers": '{"0": ["Signals from satellites"], "1": ["By measuring signal travel time"]}',
+        }).to_csv(path, mode="a", header=start == 0, index=False)
+
+
+def bench_analysis_memory(rows=10_000_000, users=500_000):
+    # Peak RSS of analysis on a large export: the in-memory path vs --chunked, each in its own process
+    import json
+    import subprocess
+    import sys
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "submissions.csv")
+        start = time.perf_counter()
+        _synthetic_export(path, rows, users)
+        print(f"===== Analysis memory ({rows:,} rows, {os.path.getsize(path) / 2**20:.0f} MB CSV, "
+              f"generated in {time.perf_counter() - start:.0f}s) =====")
+        summaries = {}
+        for mode in ("in-memory", "chunked"):
+            start = time.perf_counter()
+            proc = subprocess.run([sys.executable, "-c", _ANALYSIS_PROBE, path, mode],
+                                  cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True)
+            elapsed = time.perf_counter() - start
+            if proc.returncode != 0:
+                print(f"{mode:<10} failed after {elapsed:.0f}s (exit {proc.returncode}, likely out of memory)")
+                continue
+            result = json.loads(proc.stdout.strip().splitlines()[-1])
+            summaries[mode] = result["summary"]
+            print(f"{mode:<10} peak RSS {result['rss_mb']:>7.0f} MB  {elapsed:>5.0f}s  "
+                  f"{result['summary']['sample_size']} pairs")
+        if len(summaries) == 2:
+            print(f"summaries match: {summaries['in-memory'] == summaries['chunked']}")
+
+
+def bench_archive(records=300_000, segments=10, students=3000, days=100, seed=0):
+    # A term of submissions: a per-topic report from the JSONL log vs from the Parquet archive
+    import datetime as dt
+    import json
+    import random
+    import tempfile
+    from collections import defaultdict
+    import archive
+    from batch_scoring import random_submissions
+
+    rng = random.Random(seed)
+    topics = {t: (utils.load_questions(t), utils.load_answers(t)) for t in ("gps", "ai")}
+    pool = {t: random_submissions(q, 500, seed) for t, (q, _) in topics.items()}
+    term_start = dt.datetime(2025, 9, 1, 9)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        try:
+            os.makedirs(utils.SUBMISSIONS_DIR)
+            per_segment = records // segments
+            for n in range(segments):
+                with open(os.path.join(utils.SUBMISSIONS_DIR, f"submissions-{n + 1:05d}.jsonl"), "w") as f:
+                    for i in range(n * per_segment, (n + 1) * per_segment):
+                        topic = rng.choice(list(topics))
+                        questions, answers = topics[topic]
+                        user_answers = rng.choice(pool[topic])
+                        record = {"user_id": f"+20{rng.randrange(students):010d}", "topic": topic,
+                                  "timestamp": (term_start + dt.timedelta(days=days * i / records)).isoformat(),
+                                  "attempt": rng.randint(1, 2), "score": utils.compute_score(user_answers, answers),
+                                  "user_answers": user_answers}
+                        record.update(utils.flatten_answers(user_answers, answers))
+                        f.write(json.dumps(record) + "\n")
+
+            start = time.perf_counter()
+            archive.compact()
+            compacted = time.perf_counter() - start
+
+            start = time.perf_counter()
+            totals = defaultdict(lambda: [0, 0.0])
+            for rec in utils.iter_local_submissions():
+                if rec["topic"] == "gps":
+                    totals[rec["attempt"]][0] += 1
+                    totals[rec["attempt"]][1] += rec["score"]
+            from_log = time.perf_counter() - start
+            start = time.perf_counter()
+            report = archive.topic_report(topics=["gps"])
+            from_archive = time.perf_counter() - start
+            start = time.perf_counter()
+            archive.topic_report(topics=["gps"], start=dt.date(2025, 10, 1), end=dt.date(2025, 10, 31))
+            one_month = time.perf_counter() - start
+            agree = all(abs(totals[r.attempt][1] / totals[r.attempt][0] - r.mean_score) < 1e-9
+                        for r in report.itertuples())
+
+            start = time.perf_counter()
+            log_keys = sum(1 for _ in utils._attempt_keys(utils.iter_local_submissions()))
+            keys_log = time.perf_counter() - start
+            start = time.perf_counter()
+            archive_keys = sum(1 for _ in utils.iter_attempt_keys())
+            keys_archive = time.perf_counter() - start
+        finally:
+            os.chdir(cwd)
+    print(f"===== Archive ({records} submissions, {segments} segments, {days} days) =====")
+    print(f"compaction {compacted:.1f}s")
+    print(f"topic report: log {from_log * 1000:.0f}ms  archive {from_archive * 1000:.0f}ms  "
+          f"one month {one_month * 1000:.0f}ms  agree {agree}")
+    print(f"attempt index keys: log {keys_log * 1000:.0f}ms  archive {keys_archive * 1000:.0f}ms  "
+          f"({log_keys} / {archive_keys})")
+
+
+def bench_group_analysis(topics=6, cohorts=4, variants=2, pairs_per_group=300, resamples=10_000, seed=0):
+    # analysis.py --parallel on synthetic pairs: bootstrap + permutation for every group, one core vs all
+    import numpy as np
+    import pandas as pd
+    import analysis
+
+    rng = np.random.default_rng(seed)
+    n = topics * cohorts * variants * pairs_per_group
+    a1 = rng.integers(0, 10, n) * 10.0
+    pairs = pd.DataFrame({
+        "Topic": [f"topic{i % topics}" for i in range(n)],
+        "Cohort": [f"202{i // topics % cohorts} Fall" for i in range(n)],
+        "Prompt Version": [f"full/v{i // (topics * cohorts) % variants}" for i in range(n)],
+        "Score_Attempt1": a1,
+        "Score_Attempt2": np.clip(a1 + rng.integers(-2, 5, n) * 10.0, 0, 100),
+    })
+    groups = 1 + topics + cohorts + variants
+    print(f"===== Group analysis ({groups} groups, {n} pairs, {resamples} resamples each) =====")
+    for workers in sorted({1, os.cpu_count() or 1}):
+        start = time.perf_counter()
+        analysis.run_group_analysis(pairs, resamples=resamples, seed=seed, workers=workers,
+                                    report_path=os.devnull)
+        elapsed = time.perf_counter() - start
+        print(f"{workers} worker(s): {elapsed:.2f}s  ({groups * resamples * 2 / elapsed:,.0f} resamples/s)")
+
+
+def bench_plots(pairs=200_000, topics=6, seed=0):
+    # Nightly report plots: first render, re-run on unchanged data, and scatter vs hexbin for large N
+    import subprocess
+    import sys
+    import tempfile
+    import numpy as np
+    import pandas as pd
+    import analysis
+
+    rng = np.random.default_rng(seed)
+    a1 = rng.integers(0, 10, pairs) * 10.0
+    a2 = np.clip(a1 + rng.integers(-2, 5, pairs) * 10.0, 0, 100)
+    paired = pd.DataFrame({"Topic": [f"topic{i % topics}" for i in range(pairs)],
+                           "Score_Attempt1": a1, "Score_Attempt2": a2, "Improvement": a2 - a1})
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        try:
+            start = time.perf_counter()
+            subprocess.run([sys.executable, "-c", "import analysis"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                           check=True)
+            import_time = time.perf_counter() - start
+            timings = {}
+            for label, force in (("first run", True), ("unchanged", False)):
+                start = time.perf_counter()
+                analysis.plot_improvement_hist(paired, force=force)
+                analysis.plot_attempt_scatter(paired, force=force)
+                analysis.plot_topics(paired, force=force)
+                timings[label] = time.perf_counter() - start
+            for style in ("scatter", "hexbin", "decimate"):
+                start = time.perf_counter()
+                analysis.plot_attempt_scatter(paired, path=f"results/{style}.png", style=style, force=True)
+                timings[style] = time.perf_counter() - start
+        finally:
+            os.chdir(cwd)
+    print(f"===== Plots ({pairs} pairs, {topics} topics) =====")
+    print(f"import analysis {import_time:.2f}s (incl. interpreter)")
+    print(f"all plots: first run {timings['first run']:.2f}s  unchanged data {timings['unchanged']:.2f}s")
+    print(f"scatter of all points {timings['scatter']:.2f}s  hexbin {timings['hexbin']:.2f}s  "
+          f"decimated {timings['decimate']:.2f}s")
+
+
+def _long_reading(path, sections=40, words=110, seed=0):
+    # A synthetic reading where question i is about section i: each section has its own key terms
+    # in a sea of shared filler, like a long textbook chapter
+    import json
+    import random
+
+    rng = random.Random(seed)
+    letters = "bcdfghjklmnprstvz"
+    def word():
+        return "".join(rng.choice(letters) + rng.choice("aeiou") for _ in range(rng.randint(2, 4)))
+    filler = [word() for _ in range(300)]
+    paragraphs, questions, answers = [], [], {}
+    for i in range(sections):
+        terms = [word() for _ in range(6)]
+        sentences = []
+        while sum(len(s.split()) for s in sentences) < words:
+            sentence = rng.sample(filler, 10) + rng.sample(terms, 2)
+            rng.shuffle(sentence)
+            sentences.append(" ".join(sentence).capitalize() + ".")
+        paragraphs.append(" ".join(sentences))
+        options = [f"{terms[2]} {terms[3]}", f"{terms[4]} {terms[5]}", f"{rng.choice(filler)} {rng.choice(filler)}"]
+        questions.append({"question": f"What does the reading say about {terms[0]} and {terms[1]}?",
+                          "options": options})
+        answers[str(i)] = options[:2]
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, "article.txt"), "w", encoding="utf-8") as f:
+        f.write("\n\n".join(paragraphs))
+    with open(os.path.join(path, "questions.json"), "w", encoding="utf-8") as f:
+        json.dump(questions, f)
+    with open(os.path.join(path, "answers.json"), "w", encoding="utf-8") as f:
+        json.dump(answers, f)
+
+
+def bench_prompt_size(students=20, missed=3, sections=40, first_token_delay=0.2, prompt_token_delay=0.05, seed=1):
+    # Prompt tokens and latency for a long reading: the previous prompt (whole article, indented JSON),
+    # the whole article with compact JSON, and BM25-retrieved passages. The fake server charges
+    # prompt_token_delay seconds per 1000 prompt tokens before the first token, like prefill.
+    import json
+    import random
+    import tempfile
+    import engine
+    import prompts
+    import retrieval
+    from fakes import FakeOpenAIServer
+    from feedback_cache import FeedbackCache
+
+    rng = random.Random(seed)
+    topic = "long_reading"
+    data_dir = utils.DATA_DIR
+    with tempfile.TemporaryDirectory() as workdir:
+        _long_reading(os.path.join(workdir, topic), sections)
+        utils.DATA_DIR = workdir
+        mode = retrieval.ARTICLE_RETRIEVAL
+        try:
+            article = utils.load_article(topic)
+            answers = utils.load_answers(topic)
+            questions = utils.load_questions(topic)
+            classroom = []
+            for _ in range(students):
+                submission = {int(k): list(v) for k, v in answers.items()}
+                for q in rng.sample(range(len(questions)), missed):
+                    submission[q] = questions[q]["options"][2:]
+                classroom.append(submission)
+
+            def prompt_tokens(submission):
+                text, excerpt = engine.prompt_article(topic, article, submission)
+                messages = engine.build_messages(text, answers, submission, excerpt)
+                return sum(prompts.estimate_tokens(m["content"]) for m in messages)
+
+            def previous_prompt_tokens(submission):
+                # As build_user_prompt was before: the whole article and indent=2 JSON
+                text = prompts.build_user_prompt(article, answers, submission)
+                for value in (answers, submission):
+                    text = text.replace(prompts._compact(value), json.dumps(value, indent=2))
+                return prompts.estimate_tokens(prompts.build_system_prompt()) + prompts.estimate_tokens(text)
+
+            rows = [("whole article, indented JSON", statistics.mean(map(previous_prompt_tokens, classroom)))]
+            found = total = 0
+            with FakeOpenAIServer(first_token_delay=first_token_delay, token_delay=0,
+                                  prompt_token_delay=prompt_token_delay) as server:
+                _use_fake_openai(server)
+                for mode_name, label in (("off", "whole article, compact JSON"), ("bm25", "retrieved passages")):
+                    retrieval.ARTICLE_RETRIEVAL = mode_name
+                    engine.set_feedback_cache(FeedbackCache())
+                    tokens = statistics.mean(map(prompt_tokens, classroom))
+                    start = time.perf_counter()
+                    for submission in classroom:
+                        engine.get_cached_feedback(topic, article, answers, submission)
+                    rows.append((label, tokens, (time.perf_counter() - start) / students))
+                # Did each missed question's own section make it into the excerpt?
+                index = retrieval.get_index(topic)
+                for submission in classroom:
+                    excerpt, _ = engine.prompt_article(topic, article, submission)
+                    for q_idx, _ in engine.incorrect_questions(submission, utils.load_answer_sets(topic)):
+                        total += 1
+                        found += index.passages[q_idx] in excerpt
+        finally:
+            retrieval.ARTICLE_RETRIEVAL = mode
+            utils.DATA_DIR = data_dir
+            utils.clear_topic_cache()
+
+    print(f"===== Prompt size ({sections}-section reading, "
+          f"{prompts.estimate_tokens(article)} article tokens, {missed} missed questions) =====")
+    baseline = rows[0][1]
+    for label, tokens, *latency in rows:
+        line = f"{label:<30} {tokens:>7,.0f} prompt tokens ({tokens / baseline:.0%})"
+        if latency:
+            line += f"  {latency[0]:.2f}s per feedback"
+        print(line)
+    print(f"missed questions whose section was retrieved: {found}/{total}")
+
+
+def bench_quiz_reruns(topic="gps", students=5):
+    # Whole quizzes through streamlit's AppTest: phone number, every correct option ticked, submit,
+    # results page. With QUIZ_MODE=checkboxes each tick is a server round trip; with the form the
+    # browser keeps the ticks and only the submit reaches the server.
+    import tempfile
+    import metrics
+    import engine
+    from fakes import FakeOpenAIProvider
+    from feedback_cache import FeedbackCache
+    from streamlit.testing.v1 import AppTest
+
+    app_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+    ticks = [f"q{int(k)}_{option}" for k, v in utils.load_answers(topic).items() for option in v]
+    engine.set_provider(FakeOpenAIProvider(latency=0))
+    cwd = os.getcwd()
+    quiz_mode = os.environ.get("QUIZ_MODE")
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        try:
+            for mode in ("checkboxes", "form"):
+                os.environ["QUIZ_MODE"] = mode
+                engine.set_feedback_cache(FeedbackCache())
+                runs_before = metrics.snapshot()["counters"].get("app.script_runs", 0)
+                round_trips = 0
+                seconds = 0.0
+
+                def run(at):
+                    nonlocal round_trips, seconds
+                    start = time.perf_counter()
+                    at.run()
+                    seconds += time.perf_counter() - start
+                    round_trips += 1
+
+                for student in range(students):
+                    at = AppTest.from_file(app_path, default_timeout=60)
+                    run(at)
+                    at.text_input[0].input(f"{student:010d}")
+                    at.button[0].click()
+                    run(at)
+                    for key in ticks:
+                        at.checkbox(key=key).check()
+                        if mode == "checkboxes":
+                            run(at)
+                    next(b for b in at.button if b.label == "Submit Answers").click()
+                    run(at)
+                    # Every correct option was ticked, so anything but 100% means lost selections
+                    if at.exception or at.session_state.score != 100:
+                        raise SystemExit(f"FAILED: quiz did not complete with a full score in {mode} mode")
+                runs = metrics.snapshot()["counters"].get("app.script_runs", 0) - runs_before
+                results[mode] = (round_trips / students, runs / students, seconds / students)
+        finally:
+            os.chdir(cwd)
+            if quiz_mode is None:
+                os.environ.pop("QUIZ_MODE", None)
+            else:
+                os.environ["QUIZ_MODE"] = quiz_mode
+
+    print(f"===== Quiz page reruns ({topic}, {len(ticks)} options ticked, per completed quiz) =====")
+    for mode, (round_trips, runs, seconds) in results.items():
+        print(f"{mode:<11} round trips {round_trips:4.0f}  script runs {runs:4.0f}  server time {seconds:.2f}s")
+    before, after = results["checkboxes"][2], results["form"][2]
+    print(f"server time per quiz {before / after:.1f}x lower with the form")
+
+
+IMPORT_TARGETS = {
+    "quiz page": "import streamlit, metrics, utils, engine, pipeline, admin",
+    "submit worker": "import engine, pipeline",
+    "utils": "import utils",
+    "analysis": "import analysis",
+}
+HEAVY_PACKAGES = ("streamlit", "openai", "httpx", "gspread", "pandas", "scipy", "matplotlib", "pyarrow")
+
+
+def _import_profile(code):
+    # (cumulative import time in s, heavy packages loaded, [(top-level module, s)]) from -X importtime
+    import subprocess
+    import sys
+
+    probe = f"{code}; import sys; print(' '.join(p for p in {HEAVY_PACKAGES!r} if p in sys.modules))"
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", probe], capture_output=True, text=True,
+                          cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+    # Nested imports are indented under their parent, and interpreter startup (site, encodings) is
+    # reported too; only the probe's own imports count
+    wanted = {name.strip() for name in code[len("import "):].split(",")}
+    top = []
+    for line in proc.stderr.splitlines():
+        parts = line.split("|")
+        if len(parts) == 3 and parts[2].strip() in wanted and not parts[2].startswith("  "):
+            top.append((parts[2].strip(), int(parts[1]) / 1e6))
+    return sum(t for _, t in top), proc.stdout.split(), sorted(top, key=lambda m: -m[1])[:3]
+
+
+def bench_import_time(runs=3):
+    # Cold-start import cost of what each kind of process loads, as a fresh replica would pay it
+    print(f"===== Import time (best of {runs} cold interpreters) =====")
+    for name, code in IMPORT_TARGETS.items():
+        profiles = [_import_profile(code) for _ in range(runs)]
+        total, loaded, top = min(profiles, key=lambda p: p[0])
+        heaviest = ", ".join(f"{module} {1000 * t:.0f}ms" for module, t in top)
+        print(f"{name:<14} {1000 * total:6.0f}ms  heaviest: {heaviest}")
+        print(f"{'':<14} loaded: {' '.join(loaded) or '-'}")
+
+
+BENCHMARKS = {
+    "catalog": bench_catalog,
+    "stream": bench_stream,
+    "async": bench_async,
+    "pool": bench_pool,
+    "feedback_cache": bench_feedback_cache,
+    "fragments": bench_fragments,
+    "coalescing": bench_coalescing,
+    "latency_budget": bench_latency_budget,
+    "scheduler": bench_scheduler,
+    "scheduler_shared": bench_scheduler_shared,
+    "sheets": bench_sheets,
+    "attempts": bench_attempts,
+    "batch_scoring": bench_batch_scoring,
+    "analysis_memory": bench_analysis_memory,
+    "archive": bench_archive,
+    "group_analysis": bench_group_analysis,
+    "plots": bench_plots,
+    "prompt_size": bench_prompt_size,
+    "import_time": bench_import_time,
+    "quiz_reruns": bench_quiz_reruns,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for the feedback tool")
+    parser.add_argument("names", nargs="*", help=f"benchmarks to run: {', '.join(BENCHMARKS)} (default: all)")
+    args = parser.parse_args()
+    unknown = [name for name in args.names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmark(s): {', '.join(unknown)}")
+    for name in args.names or BENCHMARKS:
+        BENCHMARKS[name]()
+
+
+if __name__ == "__main__":
+    main()
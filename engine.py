@@ -1,96 +1,747 @@
 #engine.py
-from openai import OpenAI
-import os, json, datetime as dt
-import streamlit as st
+import os, re, json, time, asyncio, contextvars, itertools, threading, weakref, datetime as dt
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, TimeoutError as FutureTimeout, wait
 from dotenv import load_dotenv
 from prompts import (
+    PROMPT_VERSION,
+    QUESTION_PROMPT_VERSION,
     build_system_prompt, 
-    build_user_prompt)
+    build_user_prompt,
+    build_question_system_prompt,
+    build_question_prompt,
+    build_template_feedback,
+    estimate_tokens)
+from feedback_cache import FeedbackCache, SingleFlight, canonical_answers, feedback_key
+import metrics
+import retrieval
+from scheduler import LLM_RPM, LLM_TPM, SCHEDULER_PATH, Scheduler
 from utils import (
+    get_topic,
     load_article,
     load_answers,
+    load_questions,
+    load_answer_sets,
+    load_normalized_answers,
     compute_score,
     flatten_answers,
-    count_user_attempts,
+    claim_attempt,
+    release_attempt,
+    use_google_sheets,
     save_submission_local,
     save_submission_to_sheets
 )
 
 load_dotenv()
 
+FEEDBACK_MODEL = "gpt-5-nano"
+MAX_ATTEMPTS = 2
+# "full" asks for the whole numbered response at once; "per_question" assembles it from cached fragments
+FEEDBACK_MODE = os.getenv("FEEDBACK_MODE", "full")
+FRAGMENT_CONCURRENCY = int(os.getenv("FRAGMENT_CONCURRENCY", 4))
+# Seconds a submission may wait for feedback (0 = as long as the provider takes). Past it the student
+# gets degraded feedback (see fallback_feedback) and the record is marked feedback_degraded.
+FEEDBACK_BUDGET = float(os.getenv("FEEDBACK_BUDGET", 30))
+# Seconds before an unanswered request is also sent to the fallback model (and endpoint, with
+# FEEDBACK_FALLBACK_BASE_URL); the first answer wins. 0 turns hedging off.
+FEEDBACK_HEDGE_AFTER = float(os.getenv("FEEDBACK_HEDGE_AFTER", 0))
+FALLBACK_MODEL = os.getenv("FEEDBACK_FALLBACK_MODEL", FEEDBACK_MODEL)
+# Output allowance added to the prompt's token count when a call is admitted against LLM_TPM; the
+# response's usage replaces the estimate once it arrives
+EXPECTED_OUTPUT_TOKENS = int(os.getenv("LLM_EXPECTED_OUTPUT_TOKENS", 1000))
+
+class OpenAIProvider:
+    # One long-lived client (and connection pool) per provider, shared by every session in the process.
+    # Retries use the SDK's own exponential backoff, bounded by max_retries. The openai and httpx
+    # packages are imported when the first client is built, so pages that never call the model
+    # (the quiz page, local-mode workers) don't load them.
+    def __init__(self, api_key=None, base_url=None, timeout=None, max_retries=None,
+                 max_connections=None, max_keepalive_connections=None, keepalive_expiry=None):
+        self.api_key = api_key or os.getenv("OPENAI_API_KEY")
+        self.base_url = base_url or os.getenv("OPENAI_BASE_URL")
+        self.timeout = float(timeout or os.getenv("OPENAI_TIMEOUT", 60))
+        self.max_retries = int(max_retries if max_retries is not None else os.getenv("OPENAI_MAX_RETRIES", 2))
+        self.max_connections = int(max_connections or os.getenv("OPENAI_MAX_CONNECTIONS", 100))
+        self.max_keepalive_connections = int(max_keepalive_connections or os.getenv("OPENAI_MAX_KEEPALIVE", 20))
+        self.keepalive_expiry = float(keepalive_expiry or os.getenv("OPENAI_KEEPALIVE_EXPIRY", 30))
+        self.stats = {"requests": 0, "connects": 0, "connect_seconds": 0.0, "tls_seconds": 0.0}
+        self._lock = threading.Lock()
+        self._client = None
+
+    def _limits(self):
+        import httpx
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    import httpx
+                    from openai import OpenAI
+                    http_client = httpx.Client(
+                        limits=self._limits(),
+                        timeout=self.timeout,
+                        event_hooks={"request": [self._trace_request]},
+                    )
+                    self._client = OpenAI(
+                        api_key=self.api_key,
+                        base_url=self.base_url,
+                        timeout=self.timeout,
+                        max_retries=self.max_retries,
+                        http_client=http_client,
+                    )
+        return self._client
+
+    def close(self):
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None
+
+    def _record(self, step, seconds):
+        with self._lock:
+            if step == "connection.connect_tcp":
+                metrics.inc("openai.connects")
+                self.stats["connects"] += 1
+                self.stats["connect_seconds"] += seconds
+            elif step == "connection.start_tls":
+                self.stats["tls_seconds"] += seconds
+
+    def _tracer(self):
+        # httpcore reports "<step>.started" / "<step>.complete" events for each request
+        started = {}
+        def trace(name, info):
+            step, _, phase = name.rpartition(".")
+            if phase == "started":
+                started[step] = time.perf_counter()
+            elif step in started:
+                self._record(step, time.perf_counter() - started.pop(step))
+        return trace
+
+    def _count_request(self, request):
+        with self._lock:
+            self.stats["requests"] += 1
+        metrics.inc("openai.http_requests")
+        # The SDK numbers its own retries in this header
+        if int(request.headers.get("x-stainless-retry-count", 0) or 0) > 0:
+            metrics.inc("openai.retries")
+
+    def _trace_request(self, request):
+        self._count_request(request)
+        request.extensions["trace"] = self._tracer()
+
+
+
+_provider = None
+_provider_lock = threading.Lock()
+
+def get_provider():
+    global _provider
+    if _provider is None:
+        with _provider_lock:
+            if _provider is None:
+                _provider = OpenAIProvider()
+    return _provider
+
+def set_provider(provider):
+    global _provider
+    with _provider_lock:
+        _provider = provider
+
 def get_client():
-    return OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
-def get_feedback(article, correct_answers, user_answers):
-    client = get_client()
-    response = client.chat.completions.create(
-        model="gpt-5-nano",
-        messages=[
-            {"role": "system", "content": build_system_prompt()},
-            {"role": "user", "content": build_user_prompt(article, correct_answers, user_answers)}
-        ]
-    )
+    return get_provider().client
+
+_fallback_provider = None
+
+def get_fallback_provider():
+    # Hedged requests go to FEEDBACK_FALLBACK_BASE_URL when it is set, otherwise to the main endpoint
+    global _fallback_provider
+    if _fallback_provider is None:
+        base_url = os.getenv("FEEDBACK_FALLBACK_BASE_URL")
+        if not base_url:
+            return get_provider()
+        with _provider_lock:
+            if _fallback_provider is None:
+                _fallback_provider = OpenAIProvider(
+                    api_key=os.getenv("FEEDBACK_FALLBACK_API_KEY"), base_url=base_url
+                )
+    return _fallback_provider
+
+def set_fallback_provider(provider):
+    global _fallback_provider
+    with _provider_lock:
+        _fallback_provider = provider
+
+_scheduler = None
+
+def get_scheduler():
+    # LLM_RPM / LLM_TPM are the account's requests and tokens per minute (0 = unlimited);
+    # LLM_MAX_CONCURRENCY caps this process's calls in flight, and the limit adapts below it. The rpm/tpm
+    # budget is shared through LLM_SCHEDULER_PATH with the other workers and warmup.py (see scheduler.py).
+    global _scheduler
+    if _scheduler is None:
+        with _provider_lock:
+            if _scheduler is None:
+                _scheduler = Scheduler(
+                    rpm=LLM_RPM,
+                    tpm=LLM_TPM,
+                    max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", 100)),
+                    min_concurrency=int(os.getenv("LLM_MIN_CONCURRENCY", 1)),
+                    latency_target=float(os.getenv("LLM_LATENCY_TARGET", 0)),
+                    path=SCHEDULER_PATH,
+                )
+    return _scheduler
+
+def set_scheduler(scheduler):
+    global _scheduler
+    with _provider_lock:
+        _scheduler = scheduler
+
+metrics.gauge("scheduler.queue_depth", lambda: get_scheduler().queue_depth())
+metrics.gauge("scheduler.in_flight", lambda: get_scheduler().in_flight)
+metrics.gauge("scheduler.concurrency_limit", lambda: get_scheduler().stats()["concurrency_limit"])
+
+def _admit(messages):
+    # A scheduler slot for one call, sized by the prompt it sends plus the expected answer
+    tokens = sum(estimate_tokens(m["content"]) for m in messages) + EXPECTED_OUTPUT_TOKENS
+    return get_scheduler().slot(tokens)
+
+def _in_background(fn, *args):
+    # A Future for fn(*args) on its own daemon thread. Whoever stops waiting for it doesn't stop it:
+    # a late answer still lands (and is cached) after the student has moved on.
+    future = Future()
+    # Carries the caller's scheduler priority over to the new thread
+    context = contextvars.copy_context()
+    def run():
+        future.set_running_or_notify_cancel()
+        try:
+            future.set_result(context.run(fn, *args))
+        except BaseException as e:
+            future.set_exception(e)
+    threading.Thread(target=run, name="feedback-call", daemon=True).start()
+    return future
+
+def _hedged(call, slot, discard=None):
+    # call(model, client). If the primary request hasn't answered after FEEDBACK_HEDGE_AFTER seconds,
+    # the same request goes to the fallback model too and the first success wins; discard(result)
+    # releases whatever the loser returns later (e.g. closes its stream). The hedge rides in the
+    # primary's slot, but when it goes to the same endpoint it is charged to the budget as a request.
+    if FEEDBACK_HEDGE_AFTER <= 0:
+        return call(FEEDBACK_MODEL, get_client())
+    primary = _in_background(call, FEEDBACK_MODEL, get_client())
+    try:
+        return primary.result(timeout=FEEDBACK_HEDGE_AFTER)
+    except FutureTimeout:
+        pass
+    metrics.inc("openai.hedged")
+    fallback = get_fallback_provider()
+    if fallback is get_provider():
+        slot.charge_extra()
+    hedge = _in_background(call, FALLBACK_MODEL, fallback.client)
+    def release(loser):
+        if discard is not None and loser.exception() is None:
+            discard(loser.result())
+
+    pending = {primary, hedge}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                if future is hedge:
+                    metrics.inc("openai.hedge_wins")
+                for loser in pending:
+                    loser.add_done_callback(release)
+                return future.result()
+            error = future.exception()
+    raise error
+
+def build_messages(article, correct_answers, user_answers, excerpt=False):
+    return [
+        {"role": "system", "content": build_system_prompt()},
+        {"role": "user", "content": build_user_prompt(article, correct_answers, user_answers, excerpt)}
+    ]
+
+def _complete(messages, model, client):
+    with metrics.timer("openai.completion"):
+        response = client.chat.completions.create(model=model, messages=messages)
+    metrics.record_usage("openai", getattr(response, "usage", None))
+    return response
+
+def get_feedback(article, correct_answers, user_answers, excerpt=False):
+    messages = build_messages(article, correct_answers, user_answers, excerpt)
+    with _admit(messages) as slot:
+        response = _hedged(lambda model, client: _complete(messages, model, client), slot)
+        slot.settle(getattr(response, "usage", None))
     return response.choices[0].message.content
 
-def handle_submission(submission_payload):
-    user_id = submission_payload["user_id"]
-    topic = submission_payload["topic"]
-    article = load_article(topic)
-    user_answers = submission_payload["answers"]
+def _stream_chunk_text(chunk, start, first):
+    # Records time to first token and the usage block the final chunk carries
+    metrics.record_usage("openai", getattr(chunk, "usage", None))
+    if chunk.choices and chunk.choices[0].delta.content:
+        if first:
+            metrics.observe("openai.first_token", time.perf_counter() - start)
+        return chunk.choices[0].delta.content
+    return None
 
-    correct_answers = load_answers(topic)
-    score = compute_score(user_answers, correct_answers)
-    flat = flatten_answers(user_answers, correct_answers)
+def _open_stream(messages, model, client):
+    # Starts a streamed completion and reads up to its first text, which is what hedging races on
+    start = time.perf_counter()
+    stream = client.chat.completions.create(
+        model=model,
+        messages=messages,
+        stream=True,
+        stream_options={"include_usage": True}
+    )
+    chunks = iter(stream)
+    for chunk in chunks:
+        text = _stream_chunk_text(chunk, start, True)
+        if text:
+            return stream, chunks, text, start
+    return stream, chunks, None, start
 
-    attempt_number = count_user_attempts(user_id, topic)
+def stream_feedback(article, correct_answers, user_answers, excerpt=False):
+    # Yields text as the model produces it; nothing is sent until the generator is first iterated
+    messages = build_messages(article, correct_answers, user_answers, excerpt)
+    # The slot is held until the stream ends (or the consumer closes the generator)
+    with _admit(messages) as slot:
+        stream, chunks, text, start = _hedged(lambda model, client: _open_stream(messages, model, client), slot,
+                                              discard=lambda opened: opened[0].close())
+        slot.first_response()
+        if text:
+            yield text
+        for chunk in chunks:
+            slot.settle(getattr(chunk, "usage", None))
+            text = _stream_chunk_text(chunk, start, False)
+            if text:
+                yield text
+    metrics.observe("openai.completion", time.perf_counter() - start)
 
-    # Block if already attempted twice (no saving, no feedback)
-    if attempt_number >= 2:
-        return {
-            "feedback": None,
-            "attempt": attempt_number + 1,
-            "score": None,
-            "blocked": True
-        }
+_feedback_cache = None
+_feedback_cache_lock = threading.Lock()
+
+def get_feedback_cache():
+    # FEEDBACK_CACHE_PATH enables the on-disk backend (FEEDBACK_CACHE_DISK_SIZE rows, default FEEDBACK_CACHE_SIZE);
+    # FEEDBACK_CACHE_TTL is in seconds (0 = never expire)
+    global _feedback_cache
+    if _feedback_cache is None:
+        with _feedback_cache_lock:
+            if _feedback_cache is None:
+                ttl = float(os.getenv("FEEDBACK_CACHE_TTL", 0))
+                _feedback_cache = FeedbackCache(
+                    max_entries=int(os.getenv("FEEDBACK_CACHE_SIZE", 1024)),
+                    ttl=ttl or None,
+                    path=os.getenv("FEEDBACK_CACHE_PATH") or None,
+                    max_disk_entries=int(os.getenv("FEEDBACK_CACHE_DISK_SIZE", 0)) or None,
+                )
+    return _feedback_cache
+
+def set_feedback_cache(cache):
+    global _feedback_cache
+    with _feedback_cache_lock:
+        _feedback_cache = cache
+
+# Students who submit the same mistakes at the same moment share one generation instead of each
+# missing the cache and calling the model. Keyed like the cache; waiters give up after this many seconds.
+feedback_flights = SingleFlight(timeout=float(os.getenv("FEEDBACK_WAIT_TIMEOUT", 120)))
+metrics.gauge("singleflight.in_flight", feedback_flights.in_flight)
+
+def feedback_cache_key(topic, user_answers):
+    return feedback_key(
+        "feedback", topic, get_topic(topic)["fingerprint"], PROMPT_VERSION, FEEDBACK_MODEL,
+        retrieval.retrieval_tag(topic), canonical_answers(user_answers)
+    )
+
+def prompt_article(topic, article, user_answers):
+    # The article, or with ARTICLE_RETRIEVAL=bm25 and a long article, the passages the missed questions need
+    return retrieval.prompt_article(topic, article, incorrect_questions(user_answers, load_answer_sets(topic)))
+
+def get_cached_feedback(topic, article, correct_answers, user_answers):
+    cache = get_feedback_cache()
+    key = feedback_cache_key(topic, user_answers)
+    feedback = cache.get(key)
+    if feedback is None:
+        def generate():
+            # A flight that landed between the lookup above and this one has already cached it
+            feedback = cache.peek(key)
+            if feedback is None:
+                text, excerpt = prompt_article(topic, article, user_answers)
+                feedback = get_feedback(text, correct_answers, user_answers, excerpt)
+                if feedback:
+                    cache.set(key, feedback)
+            return feedback
+        feedback = feedback_flights.do(key, generate)
+    return feedback
+
+def stream_cached_feedback(topic, article, correct_answers, user_answers):
+    cache = get_feedback_cache()
+    key = feedback_cache_key(topic, user_answers)
+    feedback = cache.get(key)
+    if feedback is not None:
+        yield feedback
+        return
+
+    def generate():
+        feedback = cache.peek(key)
+        if feedback is not None:
+            yield feedback
+            return
+        parts = []
+        text, excerpt = prompt_article(topic, article, user_answers)
+        for part in stream_feedback(text, correct_answers, user_answers, excerpt):
+            parts.append(part)
+            yield part
+        # Only a stream that ran to completion is worth keeping
+        if parts:
+            cache.set(key, "".join(parts))
+    yield from feedback_flights.stream(key, generate)
+
+def incorrect_questions(user_answers, answer_sets):
+    # [(question index, sorted selection)] for every question whose selection doesn't match the key
+    normalized_user = {int(k): v for k, v in user_answers.items()}
+    missed = []
+    for q_idx, correct_ans_set in sorted(answer_sets.items()):
+        selected = set(normalized_user.get(q_idx, []))
+        if selected != correct_ans_set:
+            missed.append((q_idx, sorted(selected)))
+    return missed
+
+def get_question_feedback(article, question, correct_options, selected_options, excerpt=False):
+    messages = [
+        {"role": "system", "content": build_question_system_prompt()},
+        {"role": "user", "content": build_question_prompt(article, question, correct_options, selected_options, excerpt)}
+    ]
+    with _admit(messages) as slot:
+        response = _hedged(lambda model, client: _complete(messages, model, client), slot)
+        slot.settle(getattr(response, "usage", None))
+    content = response.choices[0].message.content
+    # The caller numbers the fragment, so drop any numbering the model adds itself
+    return re.sub(r"^\s*\d+[.)]\s*", "", content.strip())
+
+def fragment_cache_key(topic, q_idx, selected_options):
+    return feedback_key(
+        "fragment", topic, get_topic(topic)["fingerprint"], QUESTION_PROMPT_VERSION, FEEDBACK_MODEL,
+        retrieval.retrieval_tag(topic), int(q_idx), sorted(set(selected_options))
+    )
+
+def _generate_fragment(topic, article, q_idx, selected_options, key):
+    def generate():
+        fragment = get_feedback_cache().peek(key)
+        if fragment is None:
+            text, excerpt = retrieval.prompt_article(topic, article, [(q_idx, selected_options)])
+            fragment = get_question_feedback(
+                text, load_questions(topic)[q_idx], load_answer_sets(topic)[q_idx], selected_options, excerpt
+            )
+            if fragment:
+                get_feedback_cache().set(key, fragment)
+        return fragment
+    return feedback_flights.do(key, generate)
+
+def get_cached_question_feedback(topic, article, q_idx, selected_options):
+    key = fragment_cache_key(topic, q_idx, selected_options)
+    fragment = get_feedback_cache().get(key)
+    if fragment is None:
+        fragment = _generate_fragment(topic, article, q_idx, selected_options, key)
+    return fragment
+
+def _fragment_futures(topic, article, user_answers, pool):
+    # Cached fragments resolve immediately; only unseen (question, selection) pairs reach the model
+    cache = get_feedback_cache()
+    futures = []
+    for q_idx, selected in incorrect_questions(user_answers, load_answer_sets(topic)):
+        key = fragment_cache_key(topic, q_idx, selected)
+        fragment = cache.get(key)
+        if fragment is None:
+            futures.append((q_idx, pool.submit(_generate_fragment, topic, article, q_idx, selected, key)))
+        else:
+            futures.append((q_idx, fragment))
+    return futures
 
+def _fragment_result(future):
+    return future if isinstance(future, str) else future.result()
+
+def get_composed_feedback(topic, article, user_answers):
+    with ThreadPoolExecutor(max_workers=FRAGMENT_CONCURRENCY) as pool:
+        futures = _fragment_futures(topic, article, user_answers, pool)
+        return "\n\n".join(f"{q_idx + 1}. {_fragment_result(f)}" for q_idx, f in futures)
+
+def stream_composed_feedback(topic, article, user_answers):
+    # Fragments are generated concurrently but yielded in question order
+    with ThreadPoolExecutor(max_workers=FRAGMENT_CONCURRENCY) as pool:
+        futures = _fragment_futures(topic, article, user_answers, pool)
+        for i, (q_idx, f) in enumerate(futures):
+            yield ("\n\n" if i else "") + f"{q_idx + 1}. {_fragment_result(f)}"
+
+def generate_feedback(topic, article, correct_answers, user_answers, stream=False):
+    # Returns the feedback text, or a lazy generator of it when stream=True
+    if FEEDBACK_MODE == "per_question":
+        if stream:
+            return stream_composed_feedback(topic, article, user_answers)
+        return get_composed_feedback(topic, article, user_answers)
+    if stream:
+        return stream_cached_feedback(topic, article, correct_answers, user_answers)
+    return get_cached_feedback(topic, article, correct_answers, user_answers)
+
+def fallback_feedback(topic, user_answers):
+    # (feedback, degraded) when the model doesn't answer in time: the whole response if an identical
+    # submission has cached it meanwhile, otherwise cached per-question fragments (warmup.py --mode
+    # per_question fills them) with a template built from the question for the rest
+    cache = get_feedback_cache()
+    if FEEDBACK_MODE != "per_question":
+        feedback = cache.peek(feedback_cache_key(topic, user_answers))
+        if feedback is not None:
+            return feedback, False
+    questions = load_questions(topic)
+    degraded = FEEDBACK_MODE != "per_question"
+    items = []
+    for q_idx, selected in incorrect_questions(user_answers, load_answer_sets(topic)):
+        fragment = cache.peek(fragment_cache_key(topic, q_idx, selected))
+        if fragment is None:
+            fragment = build_template_feedback(questions[q_idx], selected)
+            degraded = True
+        items.append(f"{q_idx + 1}. {fragment}")
+    return "\n\n".join(items), degraded
+
+def _degraded(topic, user_answers, error=None):
+    if error is None:
+        metrics.inc("feedback.over_budget")
+    else:
+        print(f"Warning: feedback generation failed: {error}")
+        metrics.inc("feedback.failed")
+    feedback, degraded = fallback_feedback(topic, user_answers)
+    if degraded:
+        metrics.inc("feedback.degraded")
+    return feedback, degraded
+
+def budgeted_feedback(topic, article, correct_answers, user_answers):
+    # (feedback, degraded) within FEEDBACK_BUDGET seconds. A generation still running past the budget
+    # carries on in the background and caches its answer for the next identical submission.
+    try:
+        if FEEDBACK_BUDGET <= 0:
+            return generate_feedback(topic, article, correct_answers, user_answers), False
+        future = _in_background(generate_feedback, topic, article, correct_answers, user_answers)
+        return future.result(timeout=FEEDBACK_BUDGET), False
+    except FutureTimeout:
+        return _degraded(topic, user_answers)
+    except Exception as e:
+        return _degraded(topic, user_answers, e)
+
+def _drain(stream):
+    try:
+        for _ in stream:
+            pass
+    except Exception as e:
+        print(f"Warning: feedback generation failed: {e}")
+
+def _rest_or_fallback(stream, topic, user_answers, on_degraded=None):
+    # The stream after its first text. If it breaks off (an upstream read error, or a shared stream's
+    # waiter timing out), the student gets the fallback feedback after what already arrived.
+    try:
+        yield from stream
+    except Exception as e:
+        feedback, degraded = _degraded(topic, user_answers, e)
+        if degraded and on_degraded is not None:
+            on_degraded()
+        yield "\n\n" + feedback
+
+def budgeted_stream(topic, article, correct_answers, user_answers, on_degraded=None):
+    # (stream, degraded): waits up to FEEDBACK_BUDGET seconds for the first text, so the record can
+    # say whether the student got real feedback; the rest streams as it arrives. on_degraded() is
+    # called if the stream falls back part-way.
+    stream = generate_feedback(topic, article, correct_answers, user_answers, stream=True)
+    if FEEDBACK_BUDGET <= 0:
+        return _rest_or_fallback(stream, topic, user_answers, on_degraded), False
+    first = _in_background(next, stream, None)
+    try:
+        text = first.result(timeout=FEEDBACK_BUDGET)
+    except FutureTimeout:
+        # Read to the end on another thread (never this one: the callback runs right here if the first
+        # text has just arrived), so the cache still gets the answer
+        first.add_done_callback(lambda f: f.exception() is None and _in_background(_drain, stream))
+        feedback, degraded = _degraded(topic, user_answers)
+        return iter([feedback]), degraded
+    except Exception as e:
+        feedback, degraded = _degraded(topic, user_answers, e)
+        return iter([feedback]), degraded
+    if text is None:
+        return iter(()), False
+    return _rest_or_fallback(itertools.chain([text], stream), topic, user_answers, on_degraded), False
+
+# For asyncio callers. These run the same path as budgeted_feedback/budgeted_stream (cache,
+# single-flight, scheduler, hedging, budget), with each blocking step on its own thread (as
+# _in_background does), so the event loop is never blocked and no executor caps concurrent students.
+
+async def budgeted_feedback_async(topic, article, correct_answers, user_answers):
+    return await asyncio.wrap_future(_in_background(budgeted_feedback, topic, article, correct_answers, user_answers))
+
+async def _aiter_background(iterator):
+    pending = None
+    try:
+        while True:
+            pending = _in_background(next, iterator, None)
+            text = await asyncio.wrap_future(pending)
+            if text is None:
+                pending = None
+                return
+            yield text
+    finally:
+        if pending is not None:
+            # Left early: read the rest on another thread once the last read is done, so the answer
+            # is still cached
+            pending.add_done_callback(lambda _: _in_background(_drain, iterator))
+
+async def budgeted_stream_async(topic, article, correct_answers, user_answers):
+    # (async iterator of text, degraded), like budgeted_stream
+    stream, degraded = await asyncio.wrap_future(
+        _in_background(budgeted_stream, topic, article, correct_answers, user_answers)
+    )
+    return _aiter_background(stream), degraded
+
+def _save_after(stream, record, claim_id):
+    # The feedback stream, saving the record once it ends, so feedback_degraded also covers a fallback
+    # part-way through; the claim holds the attempt meanwhile. A stream dropped unread is read to the
+    # end for the cache and the record saved when it is garbage-collected (or at exit).
+    saved = threading.Event()
+
+    def save(unread=False):
+        if saved.is_set():
+            return
+        saved.set()
+        if unread:
+            _in_background(_drain, stream)
+        try:
+            with metrics.timer("submit.write"):
+                save_record(record, claim_id)
+        except Exception:
+            # Nothing was recorded, so the student keeps the attempt
+            release_attempt(claim_id)
+            if not unread:
+                raise
+            print("Warning: failed to write submission after unread feedback")
+
+    def run():
+        try:
+            yield from stream
+        finally:
+            save()
+
+    wrapped = run()
+    weakref.finalize(wrapped, save, True)
+    return wrapped
+
+def needs_feedback(attempt_number, score):
     # Attempt 1 feedback rule
-    feedback = None
-    if attempt_number == 0 and score < 100:
-        feedback = get_feedback(article, correct_answers, user_answers)
-        #feedback = "Simulated feedback.."
+    return attempt_number == 0 and score < 100
+
+def prompt_variant():
+    # Which feedback prompt a submission got, so analysis can compare prompt versions
+    if FEEDBACK_MODE == "per_question":
+        return f"per_question/{QUESTION_PROMPT_VERSION}"
+    return f"full/{PROMPT_VERSION}"
 
+def build_record(user_id, topic, attempt_number, score, user_answers, flat, feedback_degraded=False):
     record = {
         "user_id": user_id,
         "topic": topic,
         "timestamp": dt.datetime.now().isoformat(),
         "attempt": attempt_number + 1,
         "score": score,
-        "user_answers": user_answers
+        "user_answers": user_answers,
+        "prompt_version": prompt_variant(),
+        # True when the student got fallback feedback because the model missed the latency budget
+        "feedback_degraded": feedback_degraded
     }
     record.update(flat)
-    try:
-        #secrets_obj = getattr(st, "secrets", None)
-        use_google_sheets = (
-            hasattr(st, "secrets")
-            and "GOOGLE_SHEETS_CREDENTIALS" in st.secrets
-            and "GOOGLE_SHEET_ID" in st.secrets
-        )
-    except Exception:
-        use_google_sheets = False
+    return record
 
+def save_record(record, claim_id=None):
     write_ok = False
-    if use_google_sheets:
-        write_ok = save_submission_to_sheets(record)
+    if use_google_sheets():
+        write_ok = save_submission_to_sheets(record, claim_id)
     else:
-        write_ok = save_submission_local(record)
+        write_ok = save_submission_local(record, claim_id)
 
     if write_ok == False:
         print("Warning: failed to write submission")
         raise RuntimeError("Failed to save submission record")
+
+def score_submission(submission_payload):
+    topic = submission_payload["topic"]
+    user_answers = submission_payload["answers"]
+    correct_answers = load_answers(topic)
+    score = compute_score(user_answers, correct_answers, load_answer_sets(topic))
+    flat = flatten_answers(user_answers, correct_answers, load_normalized_answers(topic))
+    return score, flat
+
+def blocked_result(attempt_number):
+    return {
+        "feedback": None,
+        "attempt": attempt_number + 1,
+        "score": None,
+        "blocked": True
+    }
+
+def handle_submission(submission_payload, stream=False):
+    with metrics.timer("submit.total"):
+        return _handle_submission(submission_payload, stream)
+
+def _handle_submission(submission_payload, stream):
+    user_id = submission_payload["user_id"]
+    topic = submission_payload["topic"]
+    article = load_article(topic)
+    user_answers = submission_payload["answers"]
+
+    correct_answers = load_answers(topic)
+    with metrics.timer("submit.scoring"):
+        score, flat = score_submission(submission_payload)
+
+    # Reserves the attempt atomically, so two fast clicks or two workers can't both be attempt 1
+    with metrics.timer("submit.attempt_lookup"):
+        attempt_number, claim_id = claim_attempt(user_id, topic, MAX_ATTEMPTS)
+
+    # Block if already attempted twice (no saving, no feedback)
+    if claim_id is None:
+        metrics.inc("submit.blocked")
+        return blocked_result(attempt_number)
+
+    try:
+        feedback = None
+        feedback_stream = None
+        degraded = False
+        record = None
+        if needs_feedback(attempt_number, score):
+            with metrics.timer("submit.llm"):
+                if stream:
+                    record = build_record(user_id, topic, attempt_number, score, user_answers, flat)
+                    feedback_stream, degraded = budgeted_stream(
+                        topic, article, correct_answers, user_answers,
+                        on_degraded=lambda: record.update(feedback_degraded=True),
+                    )
+                    record["feedback_degraded"] = degraded
+                else:
+                    feedback, degraded = budgeted_feedback(topic, article, correct_answers, user_answers)
+            #feedback = "Simulated feedback.."
+
+        if feedback_stream is not None:
+            feedback_stream = _save_after(feedback_stream, record, claim_id)
+        else:
+            with metrics.timer("submit.write"):
+                save_record(build_record(user_id, topic, attempt_number, score, user_answers, flat, degraded),
+                            claim_id)
+    except Exception:
+        # Nothing was recorded, so the student keeps the attempt
+        release_attempt(claim_id)
+        raise
     
     return {
         "feedback": feedback,
+        "feedback_stream": feedback_stream,
+        "feedback_degraded": degraded,
         "attempt": attempt_number + 1,
         "score": score,
         "blocked": False
-    }
\ No newline at end of file
+    }
@@ -0,0 +1,313 @@
+import contextlib
+import json
+import threading
+import time
+from types import SimpleNamespace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Stand-ins for the external services, used by benchmark.py and for trying the app offline.
+
+FAKE_FEEDBACK = (
+    "1. It is understandable that you read the passage this way, because the article mentions "
+    "several related ideas close together. The article frames this concept by tying it to how "
+    "the system actually works. A useful strategy for similar questions might be to re-read the "
+    "sentence that introduces the idea before choosing."
+)
+
+
+class _Server(ThreadingHTTPServer):
+    # A classroom burst opens many connections at once; the default backlog of 5 would drop SYNs
+    request_queue_size = 256
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        pass
+
+
+class FakeOpenAIServer:
+    # Minimal OpenAI-compatible /v1/chat/completions endpoint, with and without stream=True.
+    # first_token_delay models the model "thinking"; token_delay is the gap between streamed chunks;
+    # prompt_token_delay adds that many seconds per 1000 prompt tokens before the first token (prefill).
+    def __init__(self, text=FAKE_FEEDBACK, first_token_delay=0.5, token_delay=0.02, prompt_token_delay=0.0,
+                 host="127.0.0.1", port=0):
+        self.text = text
+        self.first_token_delay = first_token_delay
+        self.token_delay = token_delay
+        self.prompt_token_delay = prompt_token_delay
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = _Server((host, port), self._handler())
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-openai", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def tokens(self):
+        words = self.text.split(" ")
+        return [w if i == 0 else " " + w for i, w in enumerate(words)]
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                with fake._lock:
+                    fake.requests += 1
+                model = body.get("model", "fake")
+                # About four characters per token, which is close enough for a latency model
+                prompt_tokens = sum(len(m.get("content") or "") for m in body.get("messages", [])) // 4
+                time.sleep(fake.first_token_delay + fake.prompt_token_delay * prompt_tokens / 1000)
+                if body.get("stream"):
+                    self._stream(model)
+                else:
+                    self._complete(model, prompt_tokens)
+
+            def _complete(self, model, prompt_tokens=0):
+                payload = json.dumps({
+                    "id": "chatcmpl-fake",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": fake.text},
+                        "finish_reason": "stop",
+                    }],
+                    "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(fake.tokens()),
+                              "total_tokens": prompt_tokens + len(fake.tokens())},
+                }).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _stream(self, model):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for i, token in enumerate(fake.tokens()):
+                    if i:
+                        time.sleep(fake.token_delay)
+                    self._chunk(model, {"content": token}, None)
+                self._chunk(model, {}, "stop")
+                self._write(b"data: [DONE]\n\n")
+                self._write(b"")
+
+            def _chunk(self, model, delta, finish_reason):
+                event = {
+                    "id": "chatcmpl-fake",
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+                }
+                self._write(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+
+            def _write(self, data):
+                self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+                self.wfile.flush()
+
+        return Handler
+
+
+class FakeRateLimitError(Exception):
+    # Shaped like openai.RateLimitError where the scheduler looks: status_code and response.headers
+    status_code = 429
+
+    def __init__(self, retry_after=None):
+        super().__init__("fake rate limit exceeded")
+        self.response = SimpleNamespace(headers={"retry-after": str(retry_after)} if retry_after else {})
+
+
+class FakeOpenAIClient:
+    # In-process stand-in for OpenAI().chat.completions.create, sleeping `latency` per call; a
+    # stall_rate share of calls takes stall_latency instead, like a provider's latency tail.
+    # With max_in_flight set, calls beyond that many at once are refused with a 429.
+    def __init__(self, text=FAKE_FEEDBACK, latency=1.0, token_delay=0.0, fail_rate=0.0,
+                 stall_rate=0.0, stall_latency=30.0, max_in_flight=None, seed=None):
+        import random
+        self.text = text
+        self.latency = latency
+        self.token_delay = token_delay
+        self.fail_rate = fail_rate
+        self.stall_rate = stall_rate
+        self.stall_latency = stall_latency
+        self.max_in_flight = max_in_flight
+        self.requests = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.rate_limited = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, model=None, messages=None, stream=False, **kwargs):
+        with self._lock:
+            self.requests += 1
+            fail = self._random.random() < self.fail_rate
+            stall = self._random.random() < self.stall_rate
+            if self.max_in_flight is not None and self.in_flight >= self.max_in_flight:
+                self.rate_limited += 1
+                raise FakeRateLimitError()
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            time.sleep(self.stall_latency if stall else self.latency)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+        if fail:
+            raise RuntimeError("fake upstream error")
+        if stream:
+            return self._stream(model)
+        usage = SimpleNamespace(prompt_tokens=0, completion_tokens=len(self.text.split()),
+                                total_tokens=len(self.text.split()))
+        message = SimpleNamespace(role="assistant", content=self.text)
+        return SimpleNamespace(model=model, usage=usage,
+                               choices=[SimpleNamespace(index=0, message=message, finish_reason="stop")])
+
+    def _stream(self, model):
+        for i, word in enumerate(self.text.split(" ")):
+            if i:
+                time.sleep(self.token_delay)
+            delta = SimpleNamespace(content=word if i == 0 else " " + word)
+            yield SimpleNamespace(model=model, choices=[SimpleNamespace(index=0, delta=delta, finish_reason=None)])
+
+
+class FakeOpenAIProvider:
+    # Drop-in for engine.OpenAIProvider: engine.set_provider(FakeOpenAIProvider(latency=...))
+    def __init__(self, **kwargs):
+        self.client = FakeOpenAIClient(**kwargs)
+        self.stats = {"requests": 0, "connects": 0, "connect_seconds": 0.0, "tls_seconds": 0.0}
+
+    def close(self):
+        pass
+
+
+SHEET_HEADER = ["User ID", "Attempt", "Topic", "Score", "Timestamp", "Answers"]
+
+
+class FakeWorksheet:
+    # The parts of gspread.Worksheet the app uses, backed by a list, with per-call latency.
+    # fail_next makes the next n write calls raise, like a quota error.
+    def __init__(self, rows=None, latency=0.0, header=SHEET_HEADER):
+        self.rows = [list(header)] + [list(r) for r in (rows or [])]
+        self.latency = latency
+        self.fail_next = 0
+        self.calls = {}
+        self._lock = threading.Lock()
+
+    def _call(self, name, write=False):
+        time.sleep(self.latency)
+        with self._lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+            if write and self.fail_next:
+                self.fail_next -= 1
+                raise RuntimeError("APIError: [429] Quota exceeded (fake)")
+
+    def append_row(self, values, **kwargs):
+        self._call("append_row", write=True)
+        with self._lock:
+            self.rows.append([str(v) for v in values])
+
+    def append_rows(self, values, **kwargs):
+        self._call("append_rows", write=True)
+        with self._lock:
+            self.rows.extend([str(v) for v in row] for row in values)
+
+    def get_all_values(self, **kwargs):
+        self._call("get_all_values")
+        with self._lock:
+            return [list(r) for r in self.rows]
+
+    def get_values(self, range_name=None, **kwargs):
+        # Only the open-ended "A<n>:<col>" ranges the mirror asks for
+        self._call("get_values")
+        start = int(range_name.split(":")[0][1:]) if range_name else 1
+        with self._lock:
+            return [list(r) for r in self.rows[start - 1:]]
+
+
+class SharedFakeWorksheet(FakeWorksheet):
+    # A FakeWorksheet kept in a JSONL file, so several processes (loadtest --processes) append to
+    # and read one sheet. Every call takes an flock on the file.
+    def __init__(self, path, rows=None, latency=0.0, header=SHEET_HEADER):
+        super().__init__(latency=latency, header=header)
+        self.path = path
+        with self._locked() as f:
+            if not f.read(1):
+                f.write("".join(json.dumps(r) + "\n" for r in [list(header)] + [list(r) for r in (rows or [])]))
+
+    @contextlib.contextmanager
+    def _locked(self):
+        import fcntl
+        with open(self.path, "a+", encoding="utf-8") as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                yield f
+            finally:
+                f.flush()
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    @property
+    def rows(self):
+        with self._locked() as f:
+            return [json.loads(line) for line in f]
+
+    @rows.setter
+    def rows(self, value):
+        # Set by FakeWorksheet.__init__; the file is the real store
+        pass
+
+    def _append(self, rows):
+        with self._locked() as f:
+            f.write("".join(json.dumps([str(v) for v in row]) + "\n" for row in rows))
+
+    def append_row(self, values, **kwargs):
+        self._call("append_row", write=True)
+        self._append([values])
+
+    def append_rows(self, values, **kwargs):
+        self._call("append_rows", write=True)
+        self._append(values)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run a fake OpenAI-compatible server")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--first-token-delay", type=float, default=0.5)
+    parser.add_argument("--token-delay", type=float, default=0.02)
+    args = parser.parse_args()
+    server = FakeOpenAIServer(first_token_delay=args.first_token_delay,
+                              token_delay=args.token_delay, port=args.port)
+    print(f"Fake OpenAI server on {server.base_url} (set OPENAI_BASE_URL to this)")
+    server._server.serve_forever()
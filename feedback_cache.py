@@ -0,0 +1,247 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+
+def canonical_answers(user_answers):
+    # Same selections -> same key, whatever the key types, option order or duplicates.
+    # Unanswered questions are dropped, as compute_score treats them like an empty selection.
+    canonical = {}
+    for idx, selected in user_answers.items():
+        options = sorted(set(selected if isinstance(selected, list) else [selected]))
+        if options:
+            canonical[str(int(idx))] = options
+    return canonical
+
+
+def feedback_key(*parts):
+    blob = json.dumps(parts, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class FeedbackCache:
+    # In-memory LRU with optional TTL, optionally backed by a SQLite file shared between processes.
+    # The file keeps at most max_disk_entries rows (default max_entries), dropping the oldest first.
+    def __init__(self, max_entries=1024, ttl=None, path=None, max_disk_entries=None):
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries or max_entries
+        self.ttl = ttl
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS feedback ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS feedback_created ON feedback (created)")
+            self._conn.commit()
+
+    def _expired(self, created, now):
+        return self.ttl is not None and now - created > self.ttl
+
+    def _remember(self, key, value, created):
+        self._entries[key] = (value, created)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _lookup(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if not self._expired(entry[1], now):
+                    self._entries.move_to_end(key)
+                    return entry[0]
+                del self._entries[key]
+            if self._conn is not None:
+                row = self._conn.execute(
+                    "SELECT value, created FROM feedback WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and not self._expired(row[1], now):
+                    self._remember(key, row[0], row[1])
+                    return row[0]
+        return None
+
+    def peek(self, key):
+        return self._lookup(key)
+
+    def get(self, key):
+        value = self._lookup(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        metrics.inc("feedback_cache.misses" if value is None else "feedback_cache.hits")
+        return value
+
+    def set(self, key, value):
+        now = time.time()
+        with self._lock:
+            self._remember(key, value, now)
+            if self._conn is not None:
+                with self._conn:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO feedback (key, value, created) VALUES (?, ?, ?)",
+                        (key, value, now),
+                    )
+                    self._prune(now)
+
+    def _prune(self, now):
+        # Expired rows, then everything past the newest max_disk_entries
+        if self.ttl is not None:
+            self._conn.execute("DELETE FROM feedback WHERE created < ?", (now - self.ttl,))
+        self._conn.execute(
+            "DELETE FROM feedback WHERE key IN "
+            "(SELECT key FROM feedback ORDER BY created DESC LIMIT -1 OFFSET ?)",
+            (self.max_disk_entries,),
+        )
+
+    def __contains__(self, key):
+        return self.peek(key) is not None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._conn is not None:
+                with self._conn:
+                    self._conn.execute("DELETE FROM feedback")
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "size": len(self._entries),
+            }
+
+
+class _Flight:
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.parts = []
+        self.done = False
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    # Concurrent calls with the same key share one execution: the first caller runs it and the rest
+    # wait for its result, or get its exception. Nothing is kept once the call returns; the cache
+    # does that. Waiters give up with TimeoutError after `timeout` seconds (for streams, between parts).
+    def __init__(self, timeout=None):
+        self.timeout = timeout
+        self.leaders = 0
+        self.coalesced = 0
+        self.timeouts = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def _join(self, key):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.leaders += 1
+            else:
+                self.coalesced += 1
+        metrics.inc("singleflight.leaders" if leader else "singleflight.coalesced")
+        return flight, leader
+
+    def _land(self, key, flight, result=None, error=None):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        with flight.cond:
+            flight.result, flight.error, flight.done = result, error, True
+            flight.cond.notify_all()
+
+    def _timed_out(self):
+        with self._lock:
+            self.timeouts += 1
+        metrics.inc("singleflight.timeouts")
+        return TimeoutError(f"gave up waiting for a shared request after {self.timeout}s")
+
+    def do(self, key, fn):
+        flight, leader = self._join(key)
+        if leader:
+            try:
+                result = fn()
+            except BaseException as e:
+                self._land(key, flight, error=e)
+                raise
+            self._land(key, flight, result=result)
+            return result
+        with flight.cond:
+            if not flight.cond.wait_for(lambda: flight.done, self.timeout):
+                raise self._timed_out()
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    def stream(self, key, fn):
+        # Like do() for a generator: waiters receive the leader's parts as they are produced
+        flight, leader = self._join(key)
+        if leader:
+            try:
+                for part in fn():
+                    with flight.cond:
+                        flight.parts.append(part)
+                        flight.cond.notify_all()
+                    yield part
+            except GeneratorExit:
+                # The leader's reader went away mid-stream; the waiters can't get the rest either
+                self._land(key, flight, error=RuntimeError("the shared request was abandoned"))
+                raise
+            except BaseException as e:
+                self._land(key, flight, error=e)
+                raise
+            self._land(key, flight, result="".join(flight.parts))
+            return
+        seen = 0
+        while True:
+            with flight.cond:
+                if not flight.cond.wait_for(lambda: len(flight.parts) > seen or flight.done, self.timeout):
+                    raise self._timed_out()
+                parts = flight.parts[seen:]
+                done = flight.done
+            seen += len(parts)
+            yield from parts
+            if done:
+                if flight.error is not None:
+                    raise flight.error
+                if not seen and flight.result:
+                    # The leader was a do() call, which has no parts
+                    yield flight.result
+                return
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._flights)
+
+    def stats(self):
+        with self._lock:
+            calls = self.leaders + self.coalesced
+            return {
+                "leaders": self.leaders,
+                "coalesced": self.coalesced,
+                "timeouts": self.timeouts,
+                "coalescing_ratio": self.coalesced / calls if calls else 0.0,
+                "in_flight": len(self._flights),
+            }
@@ -0,0 +1,323 @@
+import argparse
+import json
+import math
+import os
+import threading
+from collections import Counter
+
+from utils import (ARCHIVE_STATE_PATH, SUBMISSIONS_PATH, use_google_sheets, get_sheet_mirror, submissions_lock,
+                   sealed_segments, _iter_log_file)
+
+# The attempt 1 vs attempt 2 summary from analysis.py, kept up to date as submissions arrive instead
+# of recomputed from the whole log. Each topic holds running sufficient statistics (Welford means,
+# sums of squares and the co-moment), so a completed pair of attempts is an O(1) update. Students
+# whose second attempt hasn't arrived yet wait in a pending map. Like the attempt index, state is
+# per process and catches up from the shared source: the local log from a byte offset, or the rows
+# the sheet mirror has fetched.
+
+MASTERY_THRESHOLD = 80
+
+
+class PairStats:
+    # Running statistics over (attempt 1, attempt 2) score pairs, matching analysis.summarize
+    def __init__(self, threshold=MASTERY_THRESHOLD):
+        self.threshold = threshold
+        self.n = 0
+        self.mean1 = 0.0
+        self.mean2 = 0.0
+        self.m2_1 = 0.0
+        self.m2_2 = 0.0
+        self.c12 = 0.0
+        self.improved = 0
+        self.gain_sum = 0.0
+        # Scores take a few discrete values per topic, so an exact median costs a handful of entries
+        self.improvements = Counter()
+        self.mastery = Counter()
+
+    def add(self, score1, score2):
+        self.n += 1
+        d1 = score1 - self.mean1
+        self.mean1 += d1 / self.n
+        d2 = score2 - self.mean2
+        self.mean2 += d2 / self.n
+        self.m2_1 += d1 * (score1 - self.mean1)
+        self.m2_2 += d2 * (score2 - self.mean2)
+        self.c12 += d1 * (score2 - self.mean2)
+        improvement = score2 - score1
+        self.improved += improvement > 0
+        self.gain_sum += improvement / (100 - score1)
+        self.improvements[improvement] += 1
+        self.mastery[(score1 >= self.threshold, score2 >= self.threshold)] += 1
+
+    def merge(self, other):
+        # Chan et al.'s pairwise update, for the all-topics row
+        if not other.n:
+            return self
+        n = self.n + other.n
+        d1 = other.mean1 - self.mean1
+        d2 = other.mean2 - self.mean2
+        self.m2_1 += other.m2_1 + d1 * d1 * self.n * other.n / n
+        self.m2_2 += other.m2_2 + d2 * d2 * self.n * other.n / n
+        self.c12 += other.c12 + d1 * d2 * self.n * other.n / n
+        self.mean1 += d1 * other.n / n
+        self.mean2 += d2 * other.n / n
+        self.n = n
+        self.improved += other.improved
+        self.gain_sum += other.gain_sum
+        self.improvements.update(other.improvements)
+        self.mastery.update(other.mastery)
+        return self
+
+    def median_improvement(self):
+        if not self.n:
+            return float("nan")
+        lo, hi = (self.n - 1) // 2, self.n // 2
+        seen = 0
+        low_value = None
+        for value in sorted(self.improvements):
+            count = self.improvements[value]
+            if low_value is None and seen + count > lo:
+                low_value = value
+            if seen + count > hi:
+                return (low_value + value) / 2
+            seen += count
+
+    def summary(self):
+        n = self.n
+        nan = float("nan")
+        sd1 = math.sqrt(self.m2_1 / (n - 1)) if n > 1 else nan
+        sd2 = math.sqrt(self.m2_2 / (n - 1)) if n > 1 else nan
+        denominator = math.sqrt(self.m2_1 * self.m2_2)
+        percent_improved = 100 * self.improved / n if n else nan
+        mean_improvement = self.mean2 - self.mean1 if n else nan
+        return {
+            "percent_improved": percent_improved,
+            "mean_improvement": mean_improvement,
+            "mean_attempt1": self.mean1 if n else nan,
+            "mean_attempt2": self.mean2 if n else nan,
+            "improvement_metrics": {
+                "percent_improved": percent_improved,
+                "average_improvement": mean_improvement,
+                "median_improvement": self.median_improvement(),
+                "normalized_gain": self.gain_sum / n if n else nan,
+            },
+            "consistency_metrics": {
+                "sd_attempt1": sd1,
+                "sd_attempt2": sd2,
+                "variance_reduction": sd1 - sd2,
+                "correlation": self.c12 / denominator if n > 1 and denominator else nan,
+            },
+            "mastery_threshold_metrics": {
+                "moved_to_mastery": 100 * self.mastery[(False, True)] / n if n else nan,
+                "remained_below": 100 * self.mastery[(False, False)] / n if n else nan,
+                "remained_mastery": 100 * self.mastery[(True, True)] / n if n else nan,
+            },
+            "sample_size": n,
+        }
+
+
+class LiveAnalytics:
+    def __init__(self, threshold=MASTERY_THRESHOLD):
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        # One catch-up at a time, so sessions polling together don't read the same rows twice
+        self._sync_lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.topics = {}
+        # (user_id, topic) -> {attempt: score} until both attempts are in
+        self._pending = {}
+        self.perfect_first = Counter()
+        self._segments = None
+        self._offset = 0
+        self._sheet_rows = 0
+
+    def add(self, user_id, topic, attempt, score):
+        try:
+            attempt, score = int(attempt), float(score)
+        except (TypeError, ValueError):
+            return
+        if attempt not in (1, 2) or math.isnan(score):
+            return
+        key = (str(user_id).strip(), str(topic).strip())
+        with self._lock:
+            scores = self._pending.setdefault(key, {})
+            scores[attempt] = score
+            if len(scores) < 2:
+                return
+            del self._pending[key]
+            if scores[1] >= 100:
+                # analysis.remove_perfect_first_attempt leaves these out
+                self.perfect_first[key[1]] += 1
+                return
+            stats = self.topics.get(key[1])
+            if stats is None:
+                stats = self.topics[key[1]] = PairStats(self.threshold)
+            stats.add(scores[1], scores[2])
+
+    def _add_record(self, rec):
+        self.add(rec.get("user_id"), rec.get("topic"), rec.get("attempt"), rec.get("score"))
+
+    def _sync_local(self):
+        # Same bookkeeping as sync_local_index: read only what was appended since the last sync. Only
+        # the segment list and the log's size are taken under the lock (and the log opened, so it stays
+        # readable if it is sealed meanwhile); the reading happens outside it, up to that size, so a
+        # first full build doesn't hold up submissions in other workers. Sealed segments never change.
+        with submissions_lock():
+            segments = sealed_segments()
+            size = os.path.getsize(SUBMISSIONS_PATH) if os.path.exists(SUBMISSIONS_PATH) else 0
+            active = open(SUBMISSIONS_PATH, "rb") if size else None
+        try:
+            if self._segments is None or len(segments) < self._segments or (
+                    len(segments) == self._segments and self._offset > size):
+                self._reset()
+                for rec in _iter_all_records(segments, active, size):
+                    self._add_record(rec)
+            else:
+                # The active log we were reading may have been sealed since; finish it first
+                for i, path in enumerate(segments[self._segments:]):
+                    for rec in _iter_log_file(path, self._offset if i == 0 else 0):
+                        self._add_record(rec)
+                start = 0 if len(segments) > self._segments else self._offset
+                for rec in _iter_log_range(active, start, size):
+                    self._add_record(rec)
+        finally:
+            if active is not None:
+                active.close()
+        self._segments = len(segments)
+        self._offset = size
+
+    def _sync_sheets(self):
+        rows = get_sheet_mirror().sheet_rows(self._sheet_rows)
+        for row in rows:
+            if len(row) >= 4:
+                self.add(row[0], row[2], row[1], row[3])
+        self._sheet_rows += len(rows)
+
+    def sync(self):
+        with self._sync_lock:
+            if use_google_sheets():
+                self._sync_sheets()
+            else:
+                self._sync_local()
+
+    def summaries(self):
+        # {topic: summary} plus "all topics", pooled like analysis.main
+        with self._lock:
+            overall = PairStats(self.threshold)
+            result = {}
+            for topic in sorted(self.topics):
+                result[topic] = self.topics[topic].summary()
+                overall.merge(self.topics[topic])
+            result["all topics"] = overall.summary()
+            return result
+
+    def waiting(self):
+        # Students with a first attempt and no second one yet, per topic
+        with self._lock:
+            return Counter(topic for (_, topic), scores in self._pending.items() if 1 in scores)
+
+
+def _iter_log_range(f, start, end):
+    # Records in an open log between two byte offsets taken at line boundaries
+    if f is None:
+        return
+    f.seek(start)
+    pos = start
+    while pos < end:
+        line = f.readline()
+        if not line:
+            break
+        pos += len(line)
+        try:
+            yield json.loads(line)
+        except ValueError:
+            continue
+
+
+def _iter_all_records(segments=None, active=None, size=None):
+    # Archived segments from Parquet (four columns), the rest from the log. A missing, partial or
+    # unreadable archive falls back to the segments, like utils._iter_local_attempt_keys.
+    archived, records = set(), []
+    if os.path.exists(ARCHIVE_STATE_PATH):
+        try:
+            import archive
+            archived = archive.compacted_segments()
+            if archived:
+                records = archive.read_archive(columns=["user_id", "topic", "attempt", "score"]).to_pylist()
+        except Exception as e:
+            if archived:
+                print(f"Warning: could not read the submission archive, falling back to the log: {e}")
+            archived, records = set(), []
+    yield from records
+    for path in (sealed_segments() if segments is None else segments):
+        if os.path.basename(path) not in archived:
+            yield from _iter_log_file(path)
+    if active is None:
+        yield from _iter_log_file(SUBMISSIONS_PATH)
+    else:
+        yield from _iter_log_range(active, 0, size)
+
+
+_live_analytics = None
+_live_analytics_lock = threading.Lock()
+
+def get_live_analytics():
+    global _live_analytics
+    if _live_analytics is None:
+        with _live_analytics_lock:
+            if _live_analytics is None:
+                _live_analytics = LiveAnalytics()
+    _live_analytics.sync()
+    return _live_analytics
+
+
+def _check(live):
+    # Compares with the batch analysis over the same submissions
+    import pandas as pd
+    import analysis
+
+    if use_google_sheets():
+        df = analysis.load_sheet_data()
+    else:
+        df = pd.DataFrame([{"User ID": str(r.get("user_id")).strip(), "Topic": str(r.get("topic")).strip(),
+                            "Attempt": int(r.get("attempt")), "Score": float(r.get("score"))}
+                           for r in _iter_all_records()])
+    paired = analysis.compute_improvement(analysis.remove_perfect_first_attempt(
+        analysis.pivot_attempts(analysis.filter_attempts(df))))
+    batch = analysis.summarize(paired)
+    incremental = live.summaries()["all topics"]
+
+    def flatten(summary, prefix=""):
+        for k, v in summary.items():
+            if isinstance(v, dict):
+                yield from flatten(v, f"{prefix}{k}.")
+            else:
+                yield f"{prefix}{k}", float(v)
+    expected = dict(flatten(batch))
+    mismatches = [(k, v, expected[k]) for k, v in flatten(incremental)
+                  if not math.isclose(v, expected[k], rel_tol=1e-9, abs_tol=1e-9)
+                  and not (math.isnan(v) and math.isnan(expected[k]))]
+    for k, live_value, batch_value in mismatches:
+        print(f"  mismatch {k}: live {live_value} batch {batch_value}")
+    print(f"{len(mismatches)} mismatches against analysis.summarize")
+    return not mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-topic attempt 1 vs attempt 2 summary from running statistics")
+    parser.add_argument("--check", action="store_true", help="compare with the batch analysis")
+    args = parser.parse_args()
+    live = get_live_analytics()
+    for topic, s in live.summaries().items():
+        print(f"{topic:<14} n={s['sample_size']:<6} attempt 1 {s['mean_attempt1']:6.2f}  "
+              f"attempt 2 {s['mean_attempt2']:6.2f}  improved {s['percent_improved']:6.2f}%  "
+              f"r={s['consistency_metrics']['correlation']:.3f}  "
+              f"to mastery {s['mastery_threshold_metrics']['moved_to_mastery']:.1f}%")
+    if args.check and not _check(live):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
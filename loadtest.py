@@ -0,0 +1,185 @@
+import argparse
+import multiprocessing
+import os
+import random
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Drives engine.handle_submission the way a classroom would: many students pressing
+# "Submit Answers" within the same minute, against fakes for OpenAI and Google Sheets.
+
+STAGES = {
+    # stage name -> engine function that implements it
+    "attempt_lookup": "claim_attempt",
+    "scoring": "score_submission",
+    # Timed on the request thread: the generation itself runs on a background thread under the budget
+    "llm": "budgeted_feedback",
+    "write": "save_record",
+}
+
+_timings = threading.local()
+
+
+def _timed(stage, fn):
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            stages = getattr(_timings, "stages", None)
+            if stages is not None:
+                stages[stage] = stages.get(stage, 0.0) + time.perf_counter() - start
+    return wrapper
+
+
+def build_payloads(topic, students, attempts, perfect_rate, seed):
+    from utils import read_questions, read_answers
+
+    rng = random.Random(seed)
+    questions = read_questions(topic)
+    answers = read_answers(topic)
+    payloads = []
+    for i in range(students):
+        user_id = f"+20{i:010d}"
+        for _ in range(attempts):
+            if rng.random() < perfect_rate:
+                user_answers = {int(k): list(v) for k, v in answers.items()}
+            else:
+                user_answers = {q_idx: rng.sample(q["options"], rng.randint(0, len(q["options"])))
+                                for q_idx, q in enumerate(questions)}
+            payloads.append({"user_id": user_id, "topic": topic, "answers": user_answers,
+                             "num_questions": len(questions)})
+    rng.shuffle(payloads)
+    return payloads
+
+
+def setup(config):
+    # Runs once in every process that drives submissions
+    import engine
+    import utils
+    from fakes import FakeOpenAIProvider, FakeOpenAIServer, FakeWorksheet, SharedFakeWorksheet
+    from feedback_cache import FeedbackCache
+
+    os.chdir(config["workdir"])
+    if config["openai"] == "server":
+        server = FakeOpenAIServer(first_token_delay=config["llm_latency"], token_delay=0).start()
+        os.environ["OPENAI_BASE_URL"] = server.base_url
+        os.environ.setdefault("OPENAI_API_KEY", "fake-key")
+        engine.set_provider(engine.OpenAIProvider())
+    else:
+        engine.set_provider(FakeOpenAIProvider(latency=config["llm_latency"]))
+    if config["storage"] == "sheets" and config["processes"] > 1:
+        # One sheet for every process, as replicas share the real one
+        utils.set_worksheet(SharedFakeWorksheet(os.path.join(config["workdir"], "sheet.jsonl"),
+                                                latency=config["sheets_latency"]))
+    elif config["storage"] == "sheets":
+        utils.set_worksheet(FakeWorksheet(latency=config["sheets_latency"]))
+    if not config["feedback_cache"]:
+        engine.set_feedback_cache(FeedbackCache(max_entries=0))
+    for stage, name in STAGES.items():
+        setattr(engine, name, _timed(stage, getattr(engine, name)))
+
+
+def run_one(payload):
+    import engine
+
+    _timings.stages = {}
+    start = time.perf_counter()
+    error = None
+    blocked = False
+    try:
+        blocked = engine.handle_submission(payload)["blocked"]
+    except Exception as e:
+        error = repr(e)
+    return {"latency": time.perf_counter() - start, "stages": _timings.stages,
+            "blocked": blocked, "error": error}
+
+
+def run_batch(config, payloads):
+    with ThreadPoolExecutor(max_workers=config["threads"]) as pool:
+        return list(pool.map(run_one, payloads))
+
+
+def _process_main(args):
+    config, payloads = args
+    setup(config)
+    return run_batch(config, payloads)
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def report(results, elapsed):
+    latencies = [r["latency"] for r in results]
+    errors = [r for r in results if r["error"]]
+    blocked = sum(1 for r in results if r["blocked"])
+    print("\n===== Load Test Summary =====")
+    print(f"Submissions: {len(results)} ({blocked} blocked, {len(errors)} errors)")
+    print(f"Wall time: {elapsed:.2f}s")
+    print(f"Throughput: {len(results) / elapsed:.1f} submissions/s")
+    print(f"Latency p50: {percentile(latencies, 50) * 1000:.1f} ms")
+    print(f"Latency p95: {percentile(latencies, 95) * 1000:.1f} ms")
+    print(f"Latency p99: {percentile(latencies, 99) * 1000:.1f} ms")
+    print("\n===== Time per Stage (ms) =====")
+    print(f"{'stage':<16}{'calls':>8}{'mean':>10}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for stage in STAGES:
+        times = [r["stages"][stage] for r in results if stage in r["stages"]]
+        if not times:
+            continue
+        print(f"{stage:<16}{len(times):>8}{1000 * sum(times) / len(times):>10.1f}"
+              f"{1000 * percentile(times, 50):>10.1f}{1000 * percentile(times, 95):>10.1f}"
+              f"{1000 * percentile(times, 99):>10.1f}")
+    for r in errors[:5]:
+        print(f"error: {r['error']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate a classroom submitting concurrently")
+    parser.add_argument("--topic", default="gps")
+    parser.add_argument("--students", type=int, default=200)
+    parser.add_argument("--attempts", type=int, default=1, help="submissions per student")
+    parser.add_argument("--perfect-rate", type=float, default=0.1, help="share of perfect (no feedback) submissions")
+    parser.add_argument("--threads", type=int, default=32, help="concurrent submitters per process")
+    parser.add_argument("--processes", type=int, default=1, help="worker processes (like several app replicas)")
+    parser.add_argument("--openai", choices=["client", "server"], default="client",
+                        help="in-process fake client, or the fake HTTP server through the real SDK")
+    parser.add_argument("--llm-latency", type=float, default=2.0, help="seconds per fake completion")
+    parser.add_argument("--storage", choices=["local", "sheets"], default="local")
+    parser.add_argument("--sheets-latency", type=float, default=0.3, help="seconds per fake Sheets API call")
+    parser.add_argument("--no-feedback-cache", dest="feedback_cache", action="store_false")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    payloads = build_payloads(args.topic, args.students, args.attempts, args.perfect_rate, args.seed)
+    with tempfile.TemporaryDirectory() as workdir:
+        config = dict(vars(args), workdir=workdir)
+        print(f"{len(payloads)} submissions, {args.processes} process(es) x {args.threads} threads, "
+              f"LLM {args.llm_latency}s, storage {args.storage}")
+        cwd = os.getcwd()
+        start = time.perf_counter()
+        try:
+            if args.processes == 1:
+                setup(config)
+                results = run_batch(config, payloads)
+            else:
+                # All of a student's submissions go to one process, as a student stays on one replica
+                shards = [[] for _ in range(args.processes)]
+                for p in payloads:
+                    shards[hash(p["user_id"]) % args.processes].append(p)
+                ctx = multiprocessing.get_context("spawn")
+                with ctx.Pool(args.processes) as pool:
+                    results = [r for shard in pool.map(_process_main, [(config, s) for s in shards]) for r in shard]
+            elapsed = time.perf_counter() - start
+        finally:
+            os.chdir(cwd)
+    report(results, elapsed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+import contextlib
+import functools
+import json
+import logging
+import logging.handlers
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# In-process counters, gauges and latency histograms. Recording is a dict update under a lock, so it
+# stays on in production. Set METRICS_PATH to append a snapshot to a rotating JSONL file every
+# METRICS_INTERVAL seconds, and/or METRICS_PORT to serve Prometheus text on /metrics.
+
+METRICS_PATH = os.getenv("METRICS_PATH", "")
+METRICS_INTERVAL = float(os.getenv("METRICS_INTERVAL", 60))
+METRICS_MAX_BYTES = int(os.getenv("METRICS_MAX_BYTES", 10 * 1024 * 1024))
+METRICS_BACKUPS = int(os.getenv("METRICS_BACKUPS", 5))
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+
+# Upper bounds in seconds; the last bucket catches everything slower
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, float("inf"))
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        # Linear interpolation inside the bucket that holds the q-th observation
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for bound, n in zip(self.buckets, self.counts):
+            if seen + n >= rank and n:
+                if bound == float("inf"):
+                    return lower
+                return lower + (bound - lower) * (rank - seen) / n
+            seen += n
+            lower = bound
+        return lower
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else 0.0,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "buckets": {("+Inf" if b == float("inf") else str(b)): n for b, n in zip(self.buckets, self.counts)},
+        }
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+        self.started = time.time()
+
+    def inc(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, name, seconds):
+        with self._lock:
+            hist = self.histograms.get(name)
+            if hist is None:
+                hist = self.histograms[name] = Histogram()
+            hist.observe(seconds)
+
+    def gauge(self, name, fn):
+        # fn is called at snapshot time, e.g. lambda: queue.qsize()
+        with self._lock:
+            self.gauges[name] = fn
+
+    def snapshot(self):
+        with self._lock:
+            counters = dict(self.counters)
+            histograms = {name: h.snapshot() for name, h in self.histograms.items()}
+            gauges = dict(self.gauges)
+        values = {}
+        for name, fn in gauges.items():
+            try:
+                values[name] = fn()
+            except Exception:
+                values[name] = None
+        return {"time": time.time(), "uptime": time.time() - self.started,
+                "counters": counters, "gauges": values, "histograms": histograms}
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+
+registry = Registry()
+
+
+def inc(name, n=1):
+    registry.inc(name, n)
+
+
+def observe(name, seconds):
+    registry.observe(name, seconds)
+
+
+def gauge(name, fn):
+    registry.gauge(name, fn)
+
+
+def snapshot():
+    return registry.snapshot()
+
+
+@contextlib.contextmanager
+def timer(name):
+    # Records the duration even when the block raises, and counts the failure
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        registry.inc(f"{name}.errors")
+        raise
+    finally:
+        registry.observe(name, time.perf_counter() - start)
+
+
+def timed(name):
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with timer(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_usage(prefix, usage):
+    # Token counts from an OpenAI response's usage block, if the response has one
+    if usage is None:
+        return
+    for field in ("prompt_tokens", "completion_tokens", "total_tokens"):
+        value = getattr(usage, field, None)
+        if value:
+            registry.inc(f"{prefix}.{field}", value)
+
+
+def _metric_name(name):
+    return "feedback_tool_" + "".join(c if c.isalnum() else "_" for c in name)
+
+
+def render_prometheus(snap=None):
+    snap = snap or snapshot()
+    lines = []
+    for name, value in sorted(snap["counters"].items()):
+        lines.append(f"# TYPE {_metric_name(name)}_total counter")
+        lines.append(f"{_metric_name(name)}_total {value}")
+    for name, value in sorted(snap["gauges"].items()):
+        if isinstance(value, (int, float)):
+            lines.append(f"# TYPE {_metric_name(name)} gauge")
+            lines.append(f"{_metric_name(name)} {value}")
+    for name, hist in sorted(snap["histograms"].items()):
+        metric = _metric_name(name) + "_seconds"
+        lines.append(f"# TYPE {metric} histogram")
+        cumulative = 0
+        for bound, n in hist["buckets"].items():
+            cumulative += n
+            lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f"{metric}_sum {hist['sum']}")
+        lines.append(f"{metric}_count {hist['count']}")
+    return "\n".join(lines) + "\n"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+_exporters_started = False
+_exporters_lock = threading.Lock()
+
+
+def start_exporters(path=METRICS_PATH, interval=METRICS_INTERVAL, port=METRICS_PORT):
+    # Idempotent; called from the app on startup. Does nothing unless a path or port is configured.
+    global _exporters_started
+    with _exporters_lock:
+        if _exporters_started:
+            return
+        _exporters_started = True
+    if path:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        logger = logging.getLogger("feedback_tool.metrics")
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        handler = logging.handlers.RotatingFileHandler(path, maxBytes=METRICS_MAX_BYTES, backupCount=METRICS_BACKUPS)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+
+        def write_snapshots():
+            while True:
+                time.sleep(interval)
+                logger.info(json.dumps(snapshot()))
+
+        threading.Thread(target=write_snapshots, name="metrics-file", daemon=True).start()
+    if port:
+        try:
+            server = ThreadingHTTPServer(("0.0.0.0", port), _Handler)
+        except OSError as e:
+            # Another worker process on this host already serves the port
+            print(f"Warning: metrics endpoint not started on port {port}: {e}")
+            return
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
@@ -0,0 +1,151 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import engine
+import metrics
+from utils import load_article, load_answers, claim_attempt, release_attempt
+
+PIPELINE_WORKERS = int(os.getenv("PIPELINE_WORKERS", 16))
+# Submissions whose persistence or feedback is still running; past this, new submits wait
+PIPELINE_MAX_PENDING = int(os.getenv("PIPELINE_MAX_PENDING", 200))
+PIPELINE_SUBMIT_TIMEOUT = float(os.getenv("PIPELINE_SUBMIT_TIMEOUT", 10))
+PIPELINE_SAVE_RETRIES = int(os.getenv("PIPELINE_SAVE_RETRIES", 3))
+# Finished feedback jobs are forgotten after this many seconds
+PIPELINE_JOB_TTL = float(os.getenv("PIPELINE_JOB_TTL", 900))
+
+
+class QueueFull(RuntimeError):
+    pass
+
+
+class SubmissionPipeline:
+    # Scores and claims the attempt on the caller's thread, then hands persistence and feedback to a
+    # worker pool. Feedback becomes a job the results page polls with status(job_id).
+    def __init__(self, workers=PIPELINE_WORKERS, max_pending=PIPELINE_MAX_PENDING,
+                 submit_timeout=PIPELINE_SUBMIT_TIMEOUT, save_retries=PIPELINE_SAVE_RETRIES,
+                 job_ttl=PIPELINE_JOB_TTL):
+        self.submit_timeout = submit_timeout
+        self.save_retries = save_retries
+        self.job_ttl = job_ttl
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="submission")
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, submission_payload):
+        with metrics.timer("pipeline.submit"):
+            return self._submit(submission_payload)
+
+    def _submit(self, submission_payload):
+        # Backpressure: wait for a free slot, and refuse the submit (keeping the attempt) if none frees up
+        if not self._slots.acquire(timeout=self.submit_timeout):
+            metrics.inc("pipeline.rejected")
+            raise QueueFull("Too many submissions are being processed; please try again shortly")
+        try:
+            user_id = submission_payload["user_id"]
+            topic = submission_payload["topic"]
+            score, flat = engine.score_submission(submission_payload)
+            attempt_number, claim_id = claim_attempt(user_id, topic, engine.MAX_ATTEMPTS)
+        except Exception:
+            self._slots.release()
+            raise
+        if claim_id is None:
+            self._slots.release()
+            return engine.blocked_result(attempt_number)
+
+        record = engine.build_record(user_id, topic, attempt_number, score,
+                                     submission_payload["answers"], flat)
+        job_id = None
+        if engine.needs_feedback(attempt_number, score):
+            job_id = self._new_job()
+
+        # With feedback, the record is written once it is known whether the feedback was degraded,
+        # which engine.FEEDBACK_BUDGET bounds; the slot frees up when the record is written
+        if job_id is None:
+            task = self._pool.submit(self._save, record, claim_id)
+        else:
+            task = self._pool.submit(self._feedback_and_save, job_id, submission_payload, record, claim_id)
+        task.add_done_callback(lambda _future: self._slots.release())
+        return {
+            "feedback": None,
+            "job_id": job_id,
+            "attempt": attempt_number + 1,
+            "score": score,
+            "blocked": False
+        }
+
+    def _new_job(self):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            for old_id in [j for j, job in self._jobs.items()
+                           if job["finished"] and now - job["finished"] > self.job_ttl]:
+                del self._jobs[old_id]
+            self._jobs[job_id] = {"status": "queued", "feedback": None, "degraded": False, "error": None,
+                                  "created": now, "finished": None}
+        return job_id
+
+    def _update(self, job_id, **fields):
+        if job_id is None:
+            return
+        with self._lock:
+            self._jobs[job_id].update(fields)
+
+    def _save(self, record, claim_id):
+        for attempt in range(self.save_retries + 1):
+            try:
+                with metrics.timer("submit.write"):
+                    engine.save_record(record, claim_id)
+                return
+            except Exception as e:
+                print(f"Warning: failed to save submission (try {attempt + 1}): {e}")
+                time.sleep(min(2 ** attempt, 10))
+        # The score was shown but never stored; give the attempt back rather than lose it silently
+        release_attempt(claim_id)
+
+    def _feedback(self, job_id, submission_payload):
+        # Returns whether the student got degraded (or no) feedback
+        topic = submission_payload["topic"]
+        self._update(job_id, status="running")
+        try:
+            with metrics.timer("submit.llm"):
+                feedback, degraded = engine.budgeted_feedback(topic, load_article(topic), load_answers(topic),
+                                                              submission_payload["answers"])
+            self._update(job_id, status="done", feedback=feedback, degraded=degraded, finished=time.time())
+            return degraded
+        except Exception as e:
+            print(f"Warning: feedback generation failed: {e}")
+            self._update(job_id, status="failed", error=str(e), finished=time.time())
+            return True
+
+    def _feedback_and_save(self, job_id, submission_payload, record, claim_id):
+        record["feedback_degraded"] = self._feedback(job_id, submission_payload)
+        self._save(record, claim_id)
+
+    def status(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else {"status": "unknown", "feedback": None, "error": None}
+
+    def pending(self):
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job["status"] in ("queued", "running"))
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
+
+
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+def get_pipeline():
+    global _pipeline
+    if _pipeline is None:
+        with _pipeline_lock:
+            if _pipeline is None:
+                _pipeline = SubmissionPipeline()
+                metrics.gauge("pipeline.pending_feedback", _pipeline.pending)
+    return _pipeline
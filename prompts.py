@@ -1,5 +1,14 @@
+import hashlib
 import json
 
+ARTICLE_HEADING = "Here is the article the student read:"
+# Retrieval (retrieval.py) may send only the passages that bear on the missed questions
+EXCERPT_HEADING = "Here are the passages of the article the student read that relate to the questions they missed ([...] marks omitted text):"
+
+
+def _compact(value):
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
 def build_system_prompt():
     system_prompt = """
 You are a formative feedback coach who responds in a slightly academic, reflective, and supportive tone. Your role is to guide students in developing deeper comprehension and awareness of their reasoning while maintaining encouragement and confidence.
@@ -40,16 +49,16 @@ Your goal is not to assess performance, but to help the learner refine reading c
     return system_prompt
 
 
-def build_user_prompt(article, correct_answers, user_answers):
+def build_user_prompt(article, correct_answers, user_answers, excerpt=False):
     user_prompt = f"""
-Here is the article the student read:
+{EXCERPT_HEADING if excerpt else ARTICLE_HEADING}
 {article}
 
 Here are the correct answers:
-{json.dumps(correct_answers, indent=2)}
+{_compact(correct_answers)}
 
 Here are the student's answers:
-{json.dumps(user_answers, indent=2)}
+{_compact(user_answers)}
 
 Please provide formative feedback that is:
 • reflective and academically toned, yet still approachable
@@ -95,6 +104,88 @@ Do not:
     return user_prompt
 
 
+def build_question_system_prompt():
+    # Per-question variant: one reusable paragraph, numbered by the caller when feedback is assembled
+    return build_system_prompt().replace("""Required structure:
+• Provide a numbered list in which each number corresponds to the question number (starting at 1)
+• Only include numbers for questions answered incorrectly
+• Write 2–4 sentences per numbered item""", """Required structure:
+• Respond with a single paragraph about the one question you are given
+• Write 2–4 sentences
+• Do not number the paragraph or repeat the question""")
+
+
+def build_question_prompt(article, question, correct_options, selected_options, excerpt=False):
+    question_prompt = f"""
+{EXCERPT_HEADING if excerpt else ARTICLE_HEADING}
+{article}
+
+Here is the question:
+{question["question"]}
+
+Options:
+{_compact(question["options"])}
+
+The correct selection is:
+{_compact(sorted(correct_options))}
+
+The student selected:
+{_compact(sorted(selected_options))}
+
+Please write one paragraph of formative feedback for this question only that:
+• acknowledges the student’s likely logical interpretation
+• references how the article presents the relevant concept
+• contrasts the student’s reasoning with the text in a gentle way
+• ends with one constructive forward-looking suggestion
+
+Do not restate or list the correct answer directly, and do not use evaluative language (e.g., “wrong,” “incorrect”).
+"""
+    return question_prompt
+
+
+def build_template_feedback(question, selected_options):
+    # Stands in for a model fragment when the model doesn't answer in time; points back to the article
+    # in the same tone without giving the answer away
+    if selected_options:
+        chosen = "choosing " + ", ".join(f"“{option}”" for option in sorted(selected_options))
+    else:
+        chosen = "leaving it unanswered"
+    return (
+        f"It is understandable that you approached “{question['question']}” by {chosen}. "
+        "The article addresses this idea directly, and rereading that passage with each option in mind "
+        "may show how the text frames it. "
+        "A useful strategy for similar questions might be to check every option against the article, "
+        "since more than one may be supported."
+    )
+
+
+_encoding = None
+
+def estimate_tokens(text):
+    # tiktoken's count when it is installed, otherwise about four characters per token
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("o200k_base")
+        except Exception:
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text))
+    return (len(text) + 3) // 4
+
+
+def _version(*texts):
+    return hashlib.sha256("".join(texts).encode("utf-8")).hexdigest()[:12]
+
+# Change whenever the prompt wording does, so cached feedback from older prompts is not reused
+PROMPT_VERSION = _version(build_system_prompt(), build_user_prompt("", {}, {}))
+QUESTION_PROMPT_VERSION = _version(
+    build_question_system_prompt(),
+    build_question_prompt("", {"question": "", "options": []}, [], [])
+)
+
+
 
 # import json
 
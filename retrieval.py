@@ -0,0 +1,152 @@
+import math
+import os
+import re
+import threading
+from collections import Counter
+
+import metrics
+from prompts import estimate_tokens
+from utils import get_topic
+
+# Optional retrieval stage for long readings: each article is split into passages and indexed once
+# per topic (BM25 over an inverted index, rebuilt when the topic's fingerprint changes), and the
+# prompt carries only the passages that match the questions the student missed instead of the whole
+# article. Articles below RETRIEVAL_MIN_TOKENS are always sent whole; short readings gain nothing.
+
+# "off" sends the whole article; "bm25" sends the retrieved passages for long articles
+ARTICLE_RETRIEVAL = os.getenv("ARTICLE_RETRIEVAL", "off")
+RETRIEVAL_MIN_TOKENS = int(os.getenv("RETRIEVAL_MIN_TOKENS", 1500))
+PASSAGES_PER_QUESTION = int(os.getenv("RETRIEVAL_PASSAGES", 2))
+PASSAGE_WORDS = 120
+BM25_K1 = 1.5
+BM25_B = 0.75
+EXCERPT_SEPARATOR = "\n\n[...]\n\n"
+
+STOPWORDS = frozenset("""
+a about above after again all also an and any are as at be because been before being below between both
+but by can could did do does doing during each few for from further had has have having he her here hers
+him his how i if in into is it its itself just may might more most much must my no nor not of off on once
+only or other our out over own same she should so some such than that the their them then there these they
+this those through to too under until up very was we were what when where which while who whom why will
+with would you your
+""".split())
+
+
+def _stem(word):
+    # Light suffix stripping, enough for "signals"/"signal" and "interfere"/"interferes" to meet
+    for suffix in ("ing", "ed", "es", "s"):
+        if len(word) > len(suffix) + 3 and word.endswith(suffix):
+            return word[:-len(suffix)]
+    return word
+
+
+def terms(text):
+    return [_stem(w) for w in re.findall(r"[a-z0-9]+", text.lower()) if w not in STOPWORDS]
+
+
+def split_passages(article, words=PASSAGE_WORDS):
+    # Paragraphs, with long ones cut at sentence ends into ~words-sized pieces and short ones
+    # (headings, one-liners) joined to the paragraph after them
+    passages = []
+    carry = ""
+    for paragraph in re.split(r"\n\s*\n", article.strip()):
+        paragraph = (carry + "\n" + paragraph.strip()).strip()
+        if len(paragraph.split()) < words // 4:
+            carry = paragraph
+            continue
+        carry = ""
+        piece = []
+        for sentence in re.split(r"(?<=[.!?])\s+", paragraph):
+            piece.append(sentence)
+            if sum(len(s.split()) for s in piece) >= words:
+                passages.append(" ".join(piece))
+                piece = []
+        if piece:
+            passages.append(" ".join(piece))
+    if carry:
+        passages.append(carry)
+    return passages
+
+
+class PassageIndex:
+    def __init__(self, article, words=PASSAGE_WORDS):
+        self.article_tokens = estimate_tokens(article)
+        self.passages = split_passages(article, words)
+        docs = [terms(p) for p in self.passages]
+        self.lengths = [len(d) for d in docs]
+        self.average_length = (sum(self.lengths) / len(docs) if docs else 0) or 1
+        # term -> [(passage, term frequency)]
+        self.postings = {}
+        for i, doc in enumerate(docs):
+            for term, tf in Counter(doc).items():
+                self.postings.setdefault(term, []).append((i, tf))
+        n = len(docs)
+        self.idf = {term: math.log(1 + (n - len(p) + 0.5) / (len(p) + 0.5)) for term, p in self.postings.items()}
+
+    def scores(self, query):
+        scores = [0.0] * len(self.passages)
+        for term in set(terms(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for i, tf in self.postings[term]:
+                norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[i] / self.average_length)
+                scores[i] += idf * tf * (BM25_K1 + 1) / norm
+        return scores
+
+    def top(self, query, k=PASSAGES_PER_QUESTION):
+        scores = self.scores(query)
+        ranked = sorted(range(len(scores)), key=lambda i: -scores[i])
+        return [i for i in ranked[:k] if scores[i] > 0]
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def get_index(topic):
+    # Built once per topic and content version; the catalog's fingerprint changes when the article does
+    bundle = get_topic(topic)
+    entry = _indexes.get(topic)
+    if entry is None or entry[0] != bundle["fingerprint"]:
+        with _indexes_lock:
+            entry = _indexes.get(topic)
+            if entry is None or entry[0] != bundle["fingerprint"]:
+                metrics.inc("retrieval.index_builds")
+                entry = _indexes[topic] = (bundle["fingerprint"], PassageIndex(bundle["article"]))
+    return entry[1]
+
+
+def uses_retrieval(topic):
+    return ARTICLE_RETRIEVAL == "bm25" and get_index(topic).article_tokens >= RETRIEVAL_MIN_TOKENS
+
+
+def retrieval_tag(topic):
+    # Part of the feedback cache keys: feedback written from an excerpt isn't reused for the whole
+    # article or for differently sized excerpts, and vice versa
+    if not uses_retrieval(topic):
+        return None
+    return f"bm25/{PASSAGES_PER_QUESTION}/{PASSAGE_WORDS}"
+
+
+def question_query(question, correct_options, selected_options):
+    return " ".join([question["question"], *correct_options, *selected_options])
+
+
+def prompt_article(topic, article, missed):
+    # (text, is_excerpt): the passages relevant to missed = [(question index, selection)] in article
+    # order, or the whole article when retrieval is off, the article is short or nothing matched
+    if not missed or not uses_retrieval(topic):
+        return article, False
+    bundle = get_topic(topic)
+    index = get_index(topic)
+    chosen = set()
+    for q_idx, selected in missed:
+        if q_idx < len(bundle["questions"]):
+            query = question_query(bundle["questions"][q_idx], bundle["answer_sets"].get(q_idx, ()), selected)
+            chosen.update(index.top(query))
+    if not chosen or len(chosen) == len(index.passages):
+        return article, False
+    excerpt = EXCERPT_SEPARATOR.join(index.passages[i] for i in sorted(chosen))
+    metrics.inc("retrieval.excerpts")
+    metrics.inc("retrieval.tokens_saved", max(index.article_tokens - estimate_tokens(excerpt), 0))
+    return excerpt, True
@@ -0,0 +1,383 @@
+import contextlib
+import contextvars
+import heapq
+import itertools
+import os
+import threading
+import time
+import uuid
+
+import metrics
+from utils import SharedSQLite
+
+# Admission control in front of the model. Every call takes a slot first: slots are handed out in
+# priority order (FIFO within a priority), only while the requests/min and tokens/min buckets have
+# room, and only up to a concurrency limit that halves when the provider answers 429 and creeps back
+# up by one per round of successful calls (AIMD).
+#
+# The rpm/tpm budget is the account's, so with a path every process that uses it (the app's workers,
+# warmup.py) draws on the same buckets in SQLite, and their queues meet there: each process's next
+# caller in line holds a ticket, and only the best ticket across processes may take from the buckets.
+# The concurrency limit stays per process.
+
+SCHEDULER_PATH = os.getenv("LLM_SCHEDULER_PATH", "submissions/llm_scheduler.sqlite3")
+# The account's requests and tokens per minute (0 = unlimited), read the same way by the app and warmup.py
+LLM_RPM = float(os.getenv("LLM_RPM", 0))
+LLM_TPM = float(os.getenv("LLM_TPM", 0))
+# How often a process that isn't first across processes checks again, and how long a ticket outlives
+# its last check (a process that died waiting stops holding the others up after that)
+SHARED_POLL = 0.05
+SHARED_TICKET_TTL = 5.0
+
+FIRST_ATTEMPT = 0
+WARMUP = 1
+PRIORITY_NAMES = {FIRST_ATTEMPT: "first_attempt", WARMUP: "warmup"}
+
+# Calls made outside a priority() block are a student's first attempt, the only feedback
+# handle_submission generates
+_priority = contextvars.ContextVar("llm_priority", default=FIRST_ATTEMPT)
+
+
+@contextlib.contextmanager
+def priority(level):
+    # Calls made inside the block (on this thread) queue at `level`
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority():
+    return _priority.get()
+
+
+def is_rate_limited(error):
+    # openai.RateLimitError and anything else carrying an HTTP 429, without importing openai
+    return getattr(error, "status_code", None) == 429
+
+
+def retry_after(error):
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after") or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class TokenBucket:
+    # per_minute units refilled continuously, holding at most `burst` seconds' worth, so a burst can't
+    # spend the whole minute's budget at once (providers enforce limits over shorter windows too).
+    # Times are wall-clock so a bucket stored in SQLite means the same thing to every process.
+    def __init__(self, per_minute, burst=1.0, level=None, stamp=None):
+        self.rate = per_minute / 60.0
+        self.capacity = max(self.rate * burst, 1.0)
+        self.level = self.capacity if level is None else level
+        self.stamp = time.time() if stamp is None else stamp
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + max(now - self.stamp, 0.0) * self.rate)
+        self.stamp = now
+
+    def wait_time(self, n, now):
+        # Seconds until n units are available; a request bigger than the bucket waits for a full one
+        self._refill(now)
+        n = min(n, self.capacity)
+        return 0.0 if self.level >= n else (n - self.level) / self.rate
+
+    def take(self, n):
+        self.level -= min(n, self.capacity)
+
+    def adjust(self, n):
+        # Charge (or refund) the difference once the real count is known; the level may go negative
+        self.level = min(self.capacity, self.level - n)
+
+
+class LocalBudget:
+    # The rpm/tpm buckets for one process. The scheduler's own queue already decides who is next.
+    def __init__(self, rpm=0, tpm=0, burst=1.0):
+        self.requests = TokenBucket(rpm, burst) if rpm else None
+        self.tokens = TokenBucket(tpm, burst) if tpm else None
+        self.paused_until = 0.0
+
+    def admit(self, level, queued, tokens):
+        # 0 once the call's request and tokens are taken, else seconds to wait before asking again
+        now = time.time()
+        delay = max(self.paused_until - now, 0.0)
+        if self.requests is not None:
+            delay = max(delay, self.requests.wait_time(1, now))
+        if self.tokens is not None:
+            delay = max(delay, self.tokens.wait_time(tokens, now))
+        if delay == 0:
+            if self.requests is not None:
+                self.requests.take(1)
+            if self.tokens is not None:
+                self.tokens.take(tokens)
+        return delay
+
+    def charge(self, requests, tokens):
+        # Takes from the buckets without waiting, e.g. for a hedge sent alongside an admitted call
+        if self.requests is not None:
+            self.requests.adjust(requests)
+        if self.tokens is not None:
+            self.tokens.adjust(tokens)
+
+    def settle(self, n):
+        if self.tokens is not None:
+            self.tokens.adjust(n)
+
+    def back_off(self, seconds):
+        self.paused_until = max(self.paused_until, time.time() + seconds)
+
+    def cancel(self):
+        pass
+
+
+class SharedBudget(SharedSQLite):
+    # The same buckets in SQLite, shared by every process with the same path, plus the cross-process
+    # queue: one ticket per waiting process, carrying its first caller's priority and queue time.
+    # Every process should be started with the same rpm/tpm.
+    def __init__(self, path, rpm=0, tpm=0, burst=1.0):
+        super().__init__(path)
+        self.rpm = rpm
+        self.tpm = tpm
+        self.burst = burst
+        self.ticket = f"{os.getpid()}-{uuid.uuid4().hex}"
+        with self._transaction() as c:
+            c.execute(
+                "CREATE TABLE IF NOT EXISTS buckets ("
+                "name TEXT PRIMARY KEY, level REAL NOT NULL, stamp REAL NOT NULL)"
+            )
+            c.execute(
+                "CREATE TABLE IF NOT EXISTS tickets ("
+                "ticket TEXT PRIMARY KEY, priority INTEGER NOT NULL, queued REAL NOT NULL, seen REAL NOT NULL)"
+            )
+
+    def _buckets(self, c):
+        rows = {name: (level, stamp) for name, level, stamp in c.execute("SELECT name, level, stamp FROM buckets")}
+        buckets = {}
+        for name, per_minute in (("requests", self.rpm), ("tokens", self.tpm)):
+            if per_minute:
+                level, stamp = rows.get(name, (None, None))
+                buckets[name] = TokenBucket(per_minute, self.burst, level, stamp)
+        paused_until = rows.get("paused", (0.0, 0.0))[0]
+        return buckets, paused_until
+
+    def _store(self, c, buckets):
+        c.executemany(
+            "INSERT OR REPLACE INTO buckets (name, level, stamp) VALUES (?, ?, ?)",
+            [(name, bucket.level, bucket.stamp) for name, bucket in buckets.items()],
+        )
+
+    def admit(self, level, queued, tokens):
+        # Like LocalBudget.admit, for this process's first caller in line. `queued` is wall-clock.
+        now = time.time()
+        with self._transaction() as c:
+            c.execute("DELETE FROM tickets WHERE seen < ?", (now - SHARED_TICKET_TTL,))
+            c.execute(
+                "INSERT INTO tickets (ticket, priority, queued, seen) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(ticket) DO UPDATE SET priority = excluded.priority, queued = excluded.queued, "
+                "seen = excluded.seen",
+                (self.ticket, level, queued, now),
+            )
+            first = c.execute("SELECT ticket FROM tickets ORDER BY priority, queued LIMIT 1").fetchone()[0]
+            if first != self.ticket:
+                return SHARED_POLL
+            buckets, paused_until = self._buckets(c)
+            delay = max(paused_until - now, 0.0)
+            if "requests" in buckets:
+                delay = max(delay, buckets["requests"].wait_time(1, now))
+            if "tokens" in buckets:
+                delay = max(delay, buckets["tokens"].wait_time(tokens, now))
+            if delay > 0:
+                # Checks back before the ticket expires
+                return min(delay, SHARED_TICKET_TTL / 2)
+            if "requests" in buckets:
+                buckets["requests"].take(1)
+            if "tokens" in buckets:
+                buckets["tokens"].take(tokens)
+            self._store(c, buckets)
+            c.execute("DELETE FROM tickets WHERE ticket = ?", (self.ticket,))
+        return 0.0
+
+    def charge(self, requests, tokens):
+        now = time.time()
+        with self._transaction() as c:
+            buckets, _ = self._buckets(c)
+            for name, n in (("requests", requests), ("tokens", tokens)):
+                if name in buckets:
+                    buckets[name]._refill(now)
+                    buckets[name].adjust(n)
+            self._store(c, buckets)
+
+    def settle(self, n):
+        if self.tpm:
+            self.charge(0, n)
+
+    def back_off(self, seconds):
+        with self._transaction() as c:
+            c.execute(
+                "INSERT INTO buckets (name, level, stamp) VALUES ('paused', ?, 0) "
+                "ON CONFLICT(name) DO UPDATE SET level = MAX(level, excluded.level)",
+                (time.time() + seconds,),
+            )
+
+    def cancel(self):
+        # Withdraws this process's ticket, when its caller gives up waiting
+        with self._transaction() as c:
+            c.execute("DELETE FROM tickets WHERE ticket = ?", (self.ticket,))
+
+
+class Slot:
+    def __init__(self, scheduler, tokens, level):
+        self.scheduler = scheduler
+        self.tokens = tokens
+        self.priority = level
+        self.queued = time.monotonic()
+        # Orders this call against other processes' callers
+        self.queued_at = time.time()
+        self.admitted = None
+        self.responded = None
+
+    def first_response(self):
+        # For streams: latency is measured to the first text, not to the end of a long answer
+        if self.responded is None:
+            self.responded = time.monotonic()
+
+    def settle(self, usage):
+        # Replaces the estimate with the token count the response reports
+        total = getattr(usage, "total_tokens", None) if usage is not None else None
+        if total:
+            self.scheduler._settle(total - self.tokens)
+            self.tokens = total
+
+    def charge_extra(self):
+        # Another request for the same work (a hedge) costs the account a request and tokens of its own
+        self.scheduler.charge(1, self.tokens)
+        metrics.inc("scheduler.extra_requests")
+
+
+class Scheduler:
+    def __init__(self, rpm=0, tpm=0, max_concurrency=100, min_concurrency=1, latency_target=0.0, burst=1.0,
+                 path=None):
+        # rpm/tpm of 0 leave that budget unlimited; min_concurrency == max_concurrency pins the limit.
+        # Calls slower than latency_target seconds (0 = ignore latency) take the limit down by one per
+        # round instead of up. With a path the rpm/tpm budget is shared with other processes (see above);
+        # with no budget to share there is nothing for processes to queue for, so it stays local.
+        if path and (rpm or tpm):
+            self.budget = SharedBudget(path, rpm, tpm, burst)
+        else:
+            self.budget = LocalBudget(rpm, tpm, burst)
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min(min_concurrency, max_concurrency)
+        self.latency_target = latency_target
+        self.limit = float(max_concurrency)
+        self.in_flight = 0
+        self.admitted = 0
+        self.rate_limited = 0
+        self._last_cut = 0.0
+        self._queue = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+
+    def _admit(self, slot):
+        # 0 once the slot has taken its budget, else seconds it still has to wait; None until it is at
+        # the head and under the concurrency limit (a release wakes it)
+        if self._queue[0][2] is not slot or self.in_flight >= max(int(self.limit), self.min_concurrency):
+            return None
+        return self.budget.admit(slot.priority, slot.queued_at, slot.tokens)
+
+    def acquire(self, tokens, level=None):
+        slot = Slot(self, tokens, current_priority() if level is None else level)
+        with self._cond:
+            heapq.heappush(self._queue, (slot.priority, next(self._seq), slot))
+            try:
+                while True:
+                    delay = self._admit(slot)
+                    if delay == 0:
+                        break
+                    self._cond.wait(delay)
+            except BaseException:
+                # A caller interrupted while waiting gives up its place, and its process's ticket
+                self._queue = [entry for entry in self._queue if entry[2] is not slot]
+                heapq.heapify(self._queue)
+                self.budget.cancel()
+                self._cond.notify_all()
+                raise
+            heapq.heappop(self._queue)
+            self.in_flight += 1
+            self.admitted += 1
+            # The next slot in line may fit as well
+            self._cond.notify_all()
+        slot.admitted = time.monotonic()
+        waited = slot.admitted - slot.queued
+        metrics.observe("scheduler.wait", waited)
+        metrics.observe(f"scheduler.wait.{PRIORITY_NAMES.get(slot.priority, slot.priority)}", waited)
+        return slot
+
+    def release(self, slot, error=None):
+        now = time.monotonic()
+        latency = (slot.responded or now) - slot.admitted
+        with self._cond:
+            self.in_flight -= 1
+            if error is not None and is_rate_limited(error):
+                self.rate_limited += 1
+                if retry_after(error):
+                    self.budget.back_off(retry_after(error))
+                # One cut per round trip: calls admitted before the last cut saw the old limit
+                if slot.admitted >= self._last_cut:
+                    self.limit = max(self.limit / 2, self.min_concurrency)
+                    self._last_cut = now
+            elif error is None:
+                if self.latency_target and latency > self.latency_target:
+                    self.limit = max(self.limit - 1 / self.limit, self.min_concurrency)
+                else:
+                    self.limit = min(self.limit + 1 / self.limit, self.max_concurrency)
+            self._cond.notify_all()
+        if error is not None and is_rate_limited(error):
+            metrics.inc("scheduler.rate_limited")
+        elif error is None:
+            metrics.observe("scheduler.latency", latency)
+
+    def back_off(self, seconds):
+        # Holds every admission for `seconds` (in every process sharing the budget), e.g. after a 429
+        # that didn't say how long to wait
+        with self._cond:
+            self.budget.back_off(seconds)
+            self._cond.notify_all()
+
+    def charge(self, requests, tokens):
+        with self._cond:
+            self.budget.charge(requests, tokens)
+
+    def _settle(self, n):
+        with self._cond:
+            self.budget.settle(n)
+
+    @contextlib.contextmanager
+    def slot(self, tokens, level=None):
+        slot = self.acquire(tokens, level)
+        try:
+            yield slot
+        except BaseException as e:
+            # A 429 lowers the limit; other errors (and an abandoned stream) leave it alone
+            self.release(slot, e)
+            raise
+        self.release(slot)
+
+    def queue_depth(self, level=None):
+        with self._cond:
+            return sum(1 for p, _, _ in self._queue if level is None or p == level)
+
+    def stats(self):
+        with self._cond:
+            depth = {name: sum(1 for p, _, _ in self._queue if p == level) for level, name in PRIORITY_NAMES.items()}
+            return {
+                "queue_depth": len(self._queue),
+                "queued": depth,
+                "in_flight": self.in_flight,
+                "concurrency_limit": max(int(self.limit), self.min_concurrency),
+                "admitted": self.admitted,
+                "rate_limited": self.rate_limited,
+            }
@@ -1,120 +1,796 @@
 #utils.py
+import atexit
+import contextlib
+import glob
+import hashlib
 import json
 import os
-import gspread
-import streamlit as st
+import sqlite3
+import threading
+import time
+import uuid
+import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows: only threads within one process are serialized
+    fcntl = None
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DATA_DIR = os.path.join(BASE_DIR, "data")
+SUBMISSIONS_DIR = "submissions"
+SUBMISSIONS_PATH = "submissions/submissions.jsonl"
+SUBMISSIONS_LOCK_PATH = "submissions/.lock"
+# The active log is sealed as submissions-NNNNN.jsonl once it would grow past this
+SUBMISSIONS_SEGMENT_BYTES = int(os.getenv("SUBMISSIONS_SEGMENT_BYTES", 64 * 1024 * 1024))
+ATTEMPT_INDEX_PATH = "submissions/attempt_index.sqlite3"
+# Written by archive.py; defined here so the log readers can check for an archive without loading pyarrow
+ARCHIVE_DIR = os.path.join(SUBMISSIONS_DIR, "archive")
+ARCHIVE_STATE_PATH = os.path.join(ARCHIVE_DIR, "_state.json")
+# A claimed attempt that is never saved (e.g. the worker died mid-feedback) stops counting after this
+ATTEMPT_CLAIM_TTL = float(os.getenv("ATTEMPT_CLAIM_TTL", 300))
+# Each process spools to its own sheets_spool-<pid>-<id>.jsonl; the single spool older versions
+# shared is taken over like any other orphan
+SHEETS_SPOOL_PATH = "submissions/sheets_spool.jsonl"
+SHEETS_SPOOL_PATTERN = "submissions/sheets_spool-*.jsonl"
+SHEETS_BATCH_SIZE = int(os.getenv("SHEETS_BATCH_SIZE", 50))
+SHEETS_FLUSH_INTERVAL = float(os.getenv("SHEETS_FLUSH_INTERVAL", 2.0))
+SHEETS_REFRESH_INTERVAL = float(os.getenv("SHEETS_REFRESH_INTERVAL", 5.0))
 
-def load_article(topic):
+TOPIC_FILES = ("article.txt", "questions.json", "answers.json")
+# How often (seconds) a cached topic re-checks its files for edits
+TOPIC_CHECK_INTERVAL = 1.0
+
+def read_article(topic):
     path = os.path.join(DATA_DIR, topic, "article.txt")
     with open(path, "r", encoding="utf-8") as f:
         return f.read()
 
-def load_questions(topic):
+def read_questions(topic):
     path = os.path.join(DATA_DIR, topic, "questions.json")
     with open(path, "r", encoding="utf-8") as f:
         return json.load(f)
 
-def load_answers(topic):
+def read_answers(topic):
     path = os.path.join(DATA_DIR, topic, "answers.json")
     with open(path, "r", encoding="utf-8") as f:
         return json.load(f)
 
-def compute_score(user_answers, correct_answers):
-    normalized_correct = {int(k): (v if isinstance(v, list) else [v])
-                          for k, v in correct_answers.items()}
+def normalize_answers(correct_answers):
+    return {int(k): (v if isinstance(v, list) else [v])
+            for k, v in correct_answers.items()}
+
+_catalog = {}
+_catalog_lock = threading.Lock()
+
+def _topic_mtimes(topic):
+    return tuple(os.stat(os.path.join(DATA_DIR, topic, name)).st_mtime_ns
+                 for name in TOPIC_FILES)
+
+def get_topic(topic):
+    # Each data/<topic>/ bundle is loaded once per process and reloaded only when a file changes on disk.
+    # The returned objects are shared between sessions, so callers must not mutate them.
+    now = time.monotonic()
+    bundle = _catalog.get(topic)
+    if bundle is not None and now - bundle["checked_at"] < TOPIC_CHECK_INTERVAL:
+        return bundle
+    mtimes = _topic_mtimes(topic)
+    if bundle is not None and bundle["mtimes"] == mtimes:
+        bundle["checked_at"] = now
+        return bundle
+    with _catalog_lock:
+        bundle = _catalog.get(topic)
+        if bundle is None or bundle["mtimes"] != mtimes:
+            metrics.inc("catalog.loads")
+            article = read_article(topic)
+            questions = read_questions(topic)
+            answers = read_answers(topic)
+            normalized = normalize_answers(answers)
+            # Changes whenever the content does, so derived caches (e.g. feedback) can key on it
+            fingerprint = hashlib.sha256(
+                json.dumps([article, questions, answers], sort_keys=True).encode("utf-8")
+            ).hexdigest()[:16]
+            bundle = {
+                "mtimes": mtimes,
+                "checked_at": now,
+                "fingerprint": fingerprint,
+                "article": article,
+                "questions": questions,
+                "answers": answers,
+                "normalized_answers": normalized,
+                "answer_sets": {k: frozenset(v) for k, v in normalized.items()},
+            }
+            _catalog[topic] = bundle
+    return bundle
+
+def clear_topic_cache():
+    with _catalog_lock:
+        _catalog.clear()
+
+def load_article(topic):
+    return get_topic(topic)["article"]
+
+def load_questions(topic):
+    return get_topic(topic)["questions"]
+
+def load_answers(topic):
+    return get_topic(topic)["answers"]
+
+def load_answer_sets(topic):
+    return get_topic(topic)["answer_sets"]
+
+def load_normalized_answers(topic):
+    return get_topic(topic)["normalized_answers"]
+
+def compute_score(user_answers, correct_answers, answer_sets=None):
+    if answer_sets is None:
+        answer_sets = {k: set(v) for k, v in normalize_answers(correct_answers).items()}
     normalized_user = {int(k): v for k, v in user_answers.items()}
-    total = len(normalized_correct)
+    total = len(answer_sets)
     correct = 0
-    for q_idx, correct_ans_list in normalized_correct.items():
+    for q_idx, correct_ans_set in answer_sets.items():
         user_ans_list = normalized_user.get(q_idx, [])
-        if set(user_ans_list) == set(correct_ans_list):
+        if set(user_ans_list) == correct_ans_set:
             correct += 1
     return (100 * correct / total) if total > 0 else 0
 
-def flatten_answers(user_answers, correct_answers):
+def flatten_answers(user_answers, correct_answers, normalized_correct=None):
     flat = {}
-    normalized_correct = {int(k): (v if isinstance(v, list) else [v])
-                          for k, v in correct_answers.items()}
+    if normalized_correct is None:
+        normalized_correct = normalize_answers(correct_answers)
     for idx, ans in user_answers.items():
         flat[f"q{int(idx)}_answer"] = ans
     for idx, ans in normalized_correct.items():
         flat[f"q{int(idx)}_correct"] = ans
     return flat
 
-def count_user_attempts(user_id, topic):
-    try:
-        #secrets_obj = getattr(st, "secrets", None)
-        use_google_sheets = (
-            hasattr(st, "secrets")
-            and "GOOGLE_SHEETS_CREDENTIALS" in st.secrets
-            and "GOOGLE_SHEET_ID" in st.secrets
-        )
-    except Exception:
-        use_google_sheets = False
+_sheets_configured = None
 
-    if use_google_sheets:
+def use_google_sheets():
+    # Decided on first use and then fixed for the process; streamlit is only imported for st.secrets here
+    global _sheets_configured
+    if _worksheet_override:
+        return True
+    if _sheets_configured is None:
         try:
-            creds = st.secrets["GOOGLE_SHEETS_CREDENTIALS"]
-            gc = gspread.service_account_from_dict(creds)
-            sh = gc.open_by_key(st.secrets["GOOGLE_SHEET_ID"])
-            worksheet = sh.sheet1
-            rows = worksheet.get_all_values()
-            data_rows = rows[1:]
-            return sum(
-                1 for row in data_rows
-                if len(row) >= 3
-                and str(row[0]).strip() == str(user_id).strip()
-                and str(row[2]).strip() == str(topic).strip()
+            import streamlit as st
+            #secrets_obj = getattr(st, "secrets", None)
+            _sheets_configured = bool(
+                hasattr(st, "secrets")
+                and "GOOGLE_SHEETS_CREDENTIALS" in st.secrets
+                and "GOOGLE_SHEET_ID" in st.secrets
             )
-        except Exception as e:
-            raise RuntimeError(f"Failed to read from Google Sheets: {e}")
-            
-    path = f"submissions/submissions.jsonl"
-    if not os.path.exists(path):
-        return 0
+        except Exception:
+            _sheets_configured = False
+    return _sheets_configured
+
+_submissions_lock = threading.RLock()
+_submissions_lock_depth = threading.local()
+
+@contextlib.contextmanager
+def submissions_lock():
+    # Exclusive across threads and worker processes; re-entrant within a thread
+    with _submissions_lock:
+        depth = getattr(_submissions_lock_depth, "n", 0)
+        if depth:
+            _submissions_lock_depth.n = depth + 1
+            try:
+                yield
+            finally:
+                _submissions_lock_depth.n = depth
+            return
+        os.makedirs(SUBMISSIONS_DIR, exist_ok=True)
+        with open(SUBMISSIONS_LOCK_PATH, "a") as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            _submissions_lock_depth.n = 1
+            try:
+                yield
+            finally:
+                _submissions_lock_depth.n = 0
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+def sealed_segments():
+    return sorted(glob.glob(os.path.join(SUBMISSIONS_DIR, "submissions-*.jsonl")))
+
+def next_segment_path():
+    segments = sealed_segments()
+    last = int(os.path.basename(segments[-1])[len("submissions-"):-len(".jsonl")]) if segments else 0
+    return os.path.join(SUBMISSIONS_DIR, f"submissions-{last + 1:05d}.jsonl")
 
-    count = 0
+def _iter_log_file(path, offset=0):
+    if not os.path.exists(path):
+        return
     with open(path, "r", encoding="utf-8") as f:
+        f.seek(offset)
         for line in f:
             try:
                 rec = json.loads(line)
-                if rec.get("user_id") == user_id and rec.get("topic") == topic:
-                    count += 1
+            except ValueError:
+                continue
+            yield rec
+
+def iter_local_submissions():
+    # Oldest first: sealed segments, then the active log
+    for path in sealed_segments() + [SUBMISSIONS_PATH]:
+        yield from _iter_log_file(path)
+
+_worksheet = None
+_worksheet_lock = threading.Lock()
+_worksheet_override = False
+
+def set_worksheet(worksheet):
+    # Use this worksheet (e.g. fakes.FakeWorksheet) as the submissions sheet instead of the one in st.secrets
+    global _worksheet, _worksheet_override
+    with _worksheet_lock:
+        _worksheet = worksheet
+        _worksheet_override = worksheet is not None
+
+def get_worksheet():
+    # Authorize and open the sheet once per process rather than on every read or write
+    global _worksheet
+    if _worksheet is None:
+        with _worksheet_lock:
+            if _worksheet is None:
+                import gspread
+                import streamlit as st
+                creds = st.secrets["GOOGLE_SHEETS_CREDENTIALS"]
+                gc = gspread.service_account_from_dict(creds)
+                sh = gc.open_by_key(st.secrets["GOOGLE_SHEET_ID"])
+                ensure_sheet_header(sh.sheet1)
+                _worksheet = sh.sheet1
+    return _worksheet
+
+def _attempt_keys(records):
+    for rec in records:
+        if rec.get("user_id") is not None and rec.get("topic") is not None:
+            yield str(rec["user_id"]).strip(), str(rec["topic"]).strip()
+
+def iter_attempt_keys():
+    # (user_id, topic) for every stored submission, from whichever backend is active
+    if use_google_sheets():
+        for row in get_sheet_mirror().rows():
+            if len(row) >= 3:
+                yield str(row[0]).strip(), str(row[2]).strip()
+    else:
+        yield from _iter_local_attempt_keys()
+
+def _iter_local_attempt_keys():
+    # Segments already compacted into the Parquet archive are read from there (two columns, no JSON).
+    # archive (and pyarrow) is only imported when an archive exists.
+    archived, keys = set(), []
+    if os.path.exists(ARCHIVE_STATE_PATH):
+        try:
+            import archive
+            archived = archive.compacted_segments()
+            if archived:
+                keys = list(archive.iter_archived_attempt_keys())
+        except Exception as e:
+            if archived:
+                print(f"Warning: could not read the submission archive, falling back to the log: {e}")
+            archived, keys = set(), []
+    yield from keys
+    for path in sealed_segments():
+        if os.path.basename(path) not in archived:
+            yield from _attempt_keys(_iter_log_file(path))
+    yield from _attempt_keys(_iter_log_file(SUBMISSIONS_PATH))
+
+
+class SharedSQLite:
+    # A SQLite file that several processes read and write through one connection per process
+    def __init__(self, path):
+        self.path = path
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        # BEGIN IMMEDIATE takes SQLite's write lock up front, so check-then-write is atomic across processes
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
             except:
-                pass
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+class AttemptIndex(SharedSQLite):
+    # Keyed (user_id, topic) -> attempt count, so a submit never has to scan the whole log.
+    # Shared by every worker process through SQLite; claims reserve an attempt while feedback is generated.
+    def __init__(self, path=ATTEMPT_INDEX_PATH):
+        super().__init__(path)
+        with self._transaction() as c:
+            c.execute(
+                "CREATE TABLE IF NOT EXISTS attempts ("
+                "user_id TEXT NOT NULL, topic TEXT NOT NULL, count INTEGER NOT NULL, "
+                "PRIMARY KEY (user_id, topic))"
+            )
+            c.execute(
+                "CREATE TABLE IF NOT EXISTS claims ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT NOT NULL, topic TEXT NOT NULL, "
+                "claimed_at REAL NOT NULL)"
+            )
+            c.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+    def _add(self, c, user_id, topic, n=1):
+        c.execute(
+            "INSERT INTO attempts (user_id, topic, count) VALUES (?, ?, ?) "
+            "ON CONFLICT(user_id, topic) DO UPDATE SET count = count + excluded.count",
+            (str(user_id).strip(), str(topic).strip(), n),
+        )
+
+    def _set_meta(self, c, meta):
+        c.executemany(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+            [(k, str(v)) for k, v in (meta or {}).items()],
+        )
+
+    def get_meta(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def rebuild(self, keys, meta=None):
+        counts = {}
+        for key in keys:
+            counts[key] = counts.get(key, 0) + 1
+        with self._transaction() as c:
+            c.execute("DELETE FROM attempts")
+            c.execute("DELETE FROM meta")
+            c.executemany(
+                "INSERT INTO attempts (user_id, topic, count) VALUES (?, ?, ?)",
+                [(u, t, n) for (u, t), n in counts.items()],
+            )
+            self._set_meta(c, meta)
+
+    def add(self, keys, meta=None):
+        with self._transaction() as c:
+            for user_id, topic in keys:
+                self._add(c, user_id, topic)
+            self._set_meta(c, meta)
+
+    def count(self, user_id, topic):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT count FROM attempts WHERE user_id = ? AND topic = ?",
+                (str(user_id).strip(), str(topic).strip()),
+            ).fetchone()
+        return row[0] if row else 0
+
+    def claim(self, user_id, topic, limit, ttl=ATTEMPT_CLAIM_TTL):
+        # Returns (attempts already used or in flight, claim id); the id is None once the limit is reached
+        user_id, topic = str(user_id).strip(), str(topic).strip()
+        now = time.time()
+        with self._transaction() as c:
+            c.execute("DELETE FROM claims WHERE claimed_at < ?", (now - ttl,))
+            row = c.execute(
+                "SELECT count FROM attempts WHERE user_id = ? AND topic = ?", (user_id, topic)
+            ).fetchone()
+            in_flight = c.execute(
+                "SELECT COUNT(*) FROM claims WHERE user_id = ? AND topic = ?", (user_id, topic)
+            ).fetchone()[0]
+            used = (row[0] if row else 0) + in_flight
+            if used >= limit:
+                return used, None
+            cur = c.execute(
+                "INSERT INTO claims (user_id, topic, claimed_at) VALUES (?, ?, ?)", (user_id, topic, now)
+            )
+            return used, cur.lastrowid
 
-    return count
+    def release(self, claim_id):
+        with self._transaction() as c:
+            c.execute("DELETE FROM claims WHERE id = ?", (claim_id,))
 
-def save_submission_local(record):
-    os.makedirs(f"submissions", exist_ok=True)
-    with open(f"submissions/submissions.jsonl", "a", encoding="utf-8") as f:
-        f.write(json.dumps(record) + "\n")
+    def increment(self, user_id, topic, claim_id=None, meta=None):
+        # Turns a claim (if any) into a recorded attempt in the same transaction
+        with self._transaction() as c:
+            if claim_id is not None:
+                c.execute("DELETE FROM claims WHERE id = ?", (claim_id,))
+            self._add(c, user_id, topic)
+            self._set_meta(c, meta)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def sync_local_index(index):
+    # Brings the index up to date with the local log: only bytes past the recorded offset are read,
+    # and a full rebuild happens only if the index is new or the log was rotated or replaced behind it
+    with submissions_lock():
+        segments = len(sealed_segments())
+        size = os.path.getsize(SUBMISSIONS_PATH) if os.path.exists(SUBMISSIONS_PATH) else 0
+        stored_segments = index.get_meta("sealed_segments")
+        offset = int(index.get_meta("offset") or 0)
+        if stored_segments is None or int(stored_segments) != segments or offset > size:
+            index.rebuild(iter_attempt_keys(), meta={"sealed_segments": segments, "offset": size})
+        elif offset < size:
+            index.add(_attempt_keys(_iter_log_file(SUBMISSIONS_PATH, offset)), meta={"offset": size})
+
+
+_attempt_index = None
+_attempt_index_lock = threading.Lock()
+
+def get_attempt_index():
+    # Local mode shares one index file between workers and catches up from the log. In Sheets mode the
+    # sheet is the shared state, so each process keeps its own in-memory index built from its mirror.
+    global _attempt_index
+    if _attempt_index is None:
+        with _attempt_index_lock:
+            if _attempt_index is None:
+                if use_google_sheets():
+                    index = AttemptIndex(":memory:")
+                    index.rebuild(iter_attempt_keys())
+                else:
+                    index = AttemptIndex()
+                    sync_local_index(index)
+                _attempt_index = index
+    return _attempt_index
+
+def _refresh_attempt_index(index):
+    if use_google_sheets():
+        # Picks up rows other replicas appended since the last look (throttled)
+        get_sheet_mirror().refresh()
+    else:
+        sync_local_index(index)
+
+def record_attempt(record, claim_id=None):
+    # An index that hasn't been built yet will pick the record up from the source when it is
+    if _attempt_index is not None:
+        _attempt_index.increment(record["user_id"], record["topic"], claim_id)
+
+@metrics.timed("utils.count_user_attempts")
+def count_user_attempts(user_id, topic):
+    index = get_attempt_index()
+    _refresh_attempt_index(index)
+    return index.count(user_id, topic)
+
+@metrics.timed("utils.claim_attempt")
+def claim_attempt(user_id, topic, limit):
+    # Atomic check-and-reserve: (attempts used before this one, claim id or None if blocked)
+    index = get_attempt_index()
+    _refresh_attempt_index(index)
+    return index.claim(user_id, topic, limit)
+
+def release_attempt(claim_id):
+    if claim_id is not None:
+        get_attempt_index().release(claim_id)
+
+@metrics.timed("utils.save_submission_local")
+def save_submission_local(record, claim_id=None):
+    line = (json.dumps(record) + "\n").encode("utf-8")
+    # Built before taking the log lock, as building it may take that lock itself
+    index = get_attempt_index()
+    with submissions_lock():
+        sync_local_index(index)
+        size = os.path.getsize(SUBMISSIONS_PATH) if os.path.exists(SUBMISSIONS_PATH) else 0
+        if size and size + len(line) > SUBMISSIONS_SEGMENT_BYTES:
+            os.replace(SUBMISSIONS_PATH, next_segment_path())
+            size = 0
+        # One write on an O_APPEND descriptor, so a line is never interleaved with another writer's
+        fd = os.open(SUBMISSIONS_PATH, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        index.increment(record["user_id"], record["topic"], claim_id,
+                        meta={"sealed_segments": len(sealed_segments()), "offset": size + len(line)})
     return True
         
-def save_submission_to_sheets(record):
-    if not hasattr(st, "secrets"):
-        return False
-    if "GOOGLE_SHEETS_CREDENTIALS" not in st.secrets:
-        return False
-    if "GOOGLE_SHEET_ID" not in st.secrets:
-        return False
-
-    creds = st.secrets["GOOGLE_SHEETS_CREDENTIALS"]
-    gc = gspread.service_account_from_dict(creds)
-    sh = gc.open_by_key(st.secrets["GOOGLE_SHEET_ID"])
-    worksheet = sh.sheet1
+# Column names of submission_row, in order. Prompt Version and Feedback Degraded were added later, so
+# a sheet set up before them may not name them in its header row (see sheet_header).
+SHEET_COLUMNS = ["User ID", "Attempt", "Topic", "Score", "Timestamp", "Answers", "Prompt Version",
+                 "Feedback Degraded"]
 
-    row = [
+def submission_row(record):
+    return [
         record["user_id"],
         record["attempt"],
         record["topic"],
         record["score"],
         record["timestamp"],
-        json.dumps(record["user_answers"])
+        json.dumps(record["user_answers"]),
+        record.get("prompt_version", ""),
+        bool(record.get("feedback_degraded", False))
     ]
 
-    worksheet.append_row(row)
-    return True
\ No newline at end of file
+def sheet_header(header):
+    # The sheet's header row, stripped, plus names for trailing columns it doesn't have yet
+    header = [str(h).strip() for h in header]
+    return header + [c for c in SHEET_COLUMNS[len(header):] if c not in header]
+
+def ensure_sheet_header(worksheet):
+    # Names the columns submission_row writes in the sheet's header row, so a CSV export of a sheet set
+    # up before Prompt Version and Feedback Degraded has a name for every field. A no-op once done.
+    header = worksheet.row_values(1)
+    full = sheet_header(header) if header else list(SHEET_COLUMNS)
+    if full == header:
+        return
+    if worksheet.col_count < len(full):
+        worksheet.add_cols(len(full) - worksheet.col_count)
+    worksheet.update(range_name="A1", values=[full])
+
+
+def _read_spool(path):
+    rows = []
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    rows.append(json.loads(line))
+                except ValueError:
+                    # A torn last line from a crash mid-write was never acknowledged
+                    pass
+    return rows
+
+def _lock_spool(path):
+    # The owner holds this lock for as long as it lives, so a spool whose lock can be taken is orphaned
+    f = open(path + ".lock", "a")
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return None
+    return f
+
+def _remove_spool(path, lock):
+    for name in (path, path + ".lock"):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(name)
+    if lock is not None:
+        lock.close()
+
+def _open_process_spool():
+    # (path, lock) of a new spool for this process, holding the rows of any spools left behind by
+    # processes that have exited. Claimed under the submissions lock, so two processes starting at
+    # once can't both take the same orphan. Without fcntl only the old shared spool is taken over.
+    path = os.path.join(SUBMISSIONS_DIR, f"sheets_spool-{os.getpid()}-{uuid.uuid4().hex[:8]}.jsonl")
+    with submissions_lock():
+        lock = _lock_spool(path) if fcntl is not None else None
+        others = {SHEETS_SPOOL_PATH}
+        if fcntl is not None:
+            others |= set(glob.glob(SHEETS_SPOOL_PATTERN))
+            others |= {name[:-len(".lock")] for name in glob.glob(SHEETS_SPOOL_PATTERN + ".lock")}
+        others.discard(path)
+        rows, orphans = [], []
+        for other in sorted(others):
+            if not os.path.exists(other) and not os.path.exists(other + ".lock"):
+                continue
+            other_lock = _lock_spool(other) if fcntl is not None else None
+            if fcntl is not None and other_lock is None:
+                continue
+            rows += _read_spool(other)
+            orphans.append((other, other_lock))
+        if rows:
+            with open(path, "a", encoding="utf-8") as f:
+                for row in rows:
+                    f.write(json.dumps(row) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            metrics.inc("sheets.rows_reclaimed", len(rows))
+        # Only once the rows are safe in this process's spool
+        for other, other_lock in orphans:
+            _remove_spool(other, other_lock)
+    return path, lock
+
+
+class SheetWriter:
+    # Write-behind queue for the submissions sheet. Rows are spooled to disk before they are
+    # acknowledged, then sent in batches with append_rows from a background thread. Every process
+    # has its own spool; anything left in one (e.g. after a crash) is taken over and re-sent by the
+    # next process to start, so delivery is at-least-once.
+    def __init__(self, worksheet=get_worksheet, spool_path=None,
+                 batch_size=SHEETS_BATCH_SIZE, flush_interval=SHEETS_FLUSH_INTERVAL):
+        self._worksheet = worksheet
+        self._spool_lock = None
+        if spool_path is None:
+            spool_path, self._spool_lock = _open_process_spool()
+        self.spool_path = spool_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = False
+        self._pending = _read_spool(spool_path)
+        self._thread = threading.Thread(target=self._run, name="sheet-writer", daemon=True)
+        self._thread.start()
+
+    def _rewrite_spool(self):
+        tmp = self.spool_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for row in self._pending:
+                f.write(json.dumps(row) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.spool_path)
+
+    def append(self, row):
+        with self._lock:
+            os.makedirs(os.path.dirname(self.spool_path) or ".", exist_ok=True)
+            with open(self.spool_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(row) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self._pending.append(row)
+            if len(self._pending) >= self.batch_size:
+                self._wake.set()
+
+    def pending_rows(self):
+        with self._lock:
+            return list(self._pending)
+
+    def flush(self):
+        # Sends everything pending; raises if the sheet rejects a batch (the rows stay spooled)
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    batch = self._pending[:self.batch_size]
+                if not batch:
+                    return
+                with metrics.timer("sheets.append_rows"):
+                    self._worksheet().append_rows(batch)
+                metrics.inc("sheets.rows_written", len(batch))
+                with self._lock:
+                    # Only this method removes rows, so the batch is still at the front
+                    del self._pending[:len(batch)]
+                    self._rewrite_spool()
+
+    def _run(self):
+        backoff = self.flush_interval
+        while not self._stopped:
+            self._wake.wait(backoff)
+            self._wake.clear()
+            try:
+                self.flush()
+                backoff = self.flush_interval
+            except Exception as e:
+                print(f"Warning: failed to flush submissions to Google Sheets: {e}")
+                backoff = min(backoff * 2, 60)
+
+    def close(self):
+        self._stopped = True
+        self._wake.set()
+        self._thread.join(timeout=self.flush_interval + 5)
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"Warning: {len(self.pending_rows())} submissions left in {self.spool_path}: {e}")
+            return
+        if self._spool_lock is not None:
+            # Nothing left to send, so there is nothing for another process to take over
+            with submissions_lock():
+                _remove_spool(self.spool_path, self._spool_lock)
+            self._spool_lock = None
+
+
+def sheet_row_key(row):
+    # (user_id, topic, timestamp) identifies a submission whether it came back from the sheet as
+    # strings or is still a pending row with numbers in it
+    return (str(row[0]), str(row[2]), str(row[4])) if len(row) >= 5 else tuple(str(v) for v in row)
+
+
+class SheetMirror:
+    # Local copy of the submissions sheet. The first load downloads everything; after that only rows
+    # past the last one seen are fetched. rows() also includes this process's writes still in the
+    # SheetWriter queue. Rows written by other processes are reported to on_new_row.
+    def __init__(self, worksheet=get_worksheet, writer=None, refresh_interval=SHEETS_REFRESH_INTERVAL,
+                 on_new_row=None):
+        self._worksheet = worksheet
+        self._writer = writer
+        self.refresh_interval = refresh_interval
+        self.on_new_row = on_new_row
+        self.header = None
+        self._rows = []
+        # Sheet rows read past the header, blank ones included, so the next fetch starts after them
+        self._fetched = 0
+        self._seen = set()
+        self._lock = threading.Lock()
+        self._refreshed_at = None
+
+    def note_local(self, row):
+        # Rows this process wrote are already counted, so don't report them when they show up in the sheet
+        with self._lock:
+            self._seen.add(sheet_row_key(row))
+
+    def _fetch(self):
+        if self.header is None:
+            return self._worksheet().get_all_values()
+        # Sheet row numbers are 1-based and row 1 is the header
+        return self._worksheet().get_values(f"A{self._fetched + 2}:ZZ")
+
+    def refresh(self, force=False):
+        with self._lock:
+            now = time.monotonic()
+            if not force and self._refreshed_at is not None and now - self._refreshed_at < self.refresh_interval:
+                return
+            try:
+                with metrics.timer("sheets.read"):
+                    fetched = self._fetch()
+            except Exception as e:
+                raise RuntimeError(f"Failed to read from Google Sheets: {e}")
+            initial = self.header is None
+            if initial:
+                self.header = fetched[0] if fetched else []
+                fetched = fetched[1:]
+            self._refreshed_at = now
+            self._fetched += len(fetched)
+            new_rows = []
+            for row in fetched:
+                if not any(str(v).strip() for v in row):
+                    continue
+                self._rows.append(row)
+                key = sheet_row_key(row)
+                if key not in self._seen:
+                    self._seen.add(key)
+                    if not initial:
+                        new_rows.append(row)
+        if self.on_new_row is not None:
+            for row in new_rows:
+                self.on_new_row(row)
+
+    def rows(self):
+        self.refresh()
+        with self._lock:
+            rows = list(self._rows)
+            in_sheet = {sheet_row_key(row) for row in rows}
+        if self._writer is not None:
+            rows += [row for row in self._writer.pending_rows() if sheet_row_key(row) not in in_sheet]
+        return rows
+
+    def sheet_rows(self, start=0):
+        # Rows already in the sheet from position start on; unlike rows(), positions never shift
+        self.refresh()
+        with self._lock:
+            return self._rows[start:]
+
+
+def _count_remote_row(row):
+    if _attempt_index is not None and len(row) >= 3:
+        _attempt_index.increment(str(row[0]).strip(), str(row[2]).strip())
+
+_sheet_mirror = None
+_sheet_mirror_lock = threading.Lock()
+
+def get_sheet_mirror():
+    global _sheet_mirror
+    if _sheet_mirror is None:
+        with _sheet_mirror_lock:
+            if _sheet_mirror is None:
+                writer = get_sheet_writer()
+                mirror = SheetMirror(writer=writer, on_new_row=_count_remote_row)
+                # Rows taken over from a spool are counted through pending_rows() until they are sent;
+                # they mustn't be counted again when they reach the sheet
+                for row in writer.pending_rows():
+                    mirror.note_local(row)
+                _sheet_mirror = mirror
+    return _sheet_mirror
+
+_sheet_writer = None
+_sheet_writer_lock = threading.Lock()
+
+def get_sheet_writer():
+    global _sheet_writer
+    if _sheet_writer is None:
+        with _sheet_writer_lock:
+            if _sheet_writer is None:
+                _sheet_writer = SheetWriter()
+                atexit.register(_sheet_writer.close)
+                metrics.gauge("sheets.pending_rows", lambda: len(_sheet_writer.pending_rows()))
+    return _sheet_writer
+
+@metrics.timed("utils.save_submission_to_sheets")
+def save_submission_to_sheets(record, claim_id=None):
+    if not use_google_sheets():
+        return False
+
+    row = submission_row(record)
+    get_sheet_mirror().note_local(row)
+    get_sheet_writer().append(row)
+    record_attempt(record, claim_id)
+    return True
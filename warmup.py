@@ -0,0 +1,189 @@
+import argparse
+import itertools
+import os
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import openai
+
+import engine
+import scheduler
+from utils import get_topic, iter_local_submissions
+
+
+def observed_selections(topic):
+    # How often each wrong selection was chosen per question on first attempts, from the local log
+    answer_sets = get_topic(topic)["answer_sets"]
+    per_question = {q_idx: Counter() for q_idx in answer_sets}
+    patterns = Counter()
+    for rec in iter_local_submissions():
+        if rec.get("topic") != topic or rec.get("attempt") != 1:
+            continue
+        user_answers = rec.get("user_answers") or {}
+        missed = engine.incorrect_questions(user_answers, answer_sets)
+        for q_idx, selected in missed:
+            per_question[q_idx][tuple(selected)] += 1
+        if missed:
+            patterns[tuple((q_idx, tuple(selected)) for q_idx, selected in missed)] += 1
+    return per_question, patterns
+
+
+def near_misses(options, correct):
+    # Plausible slips, closest to the key first: drop one right option, add one distractor, then single options
+    correct = set(correct)
+    distractors = [o for o in options if o not in correct]
+    candidates = []
+    for o in sorted(correct):
+        candidates.append(sorted(correct - {o}))
+    for o in distractors:
+        candidates.append(sorted(correct | {o}))
+    for o in options:
+        candidates.append([o])
+    for o, d in itertools.product(sorted(correct), distractors):
+        candidates.append(sorted((correct - {o}) | {d}))
+    return [c for c in candidates if set(c) != correct]
+
+
+def likely_selections(topic, per_question_limit):
+    bundle = get_topic(topic)
+    observed, patterns = observed_selections(topic)
+    likely = {}
+    for q_idx, correct in sorted(bundle["answer_sets"].items()):
+        seen = []
+        ranked = [list(sel) for sel, _ in observed[q_idx].most_common()]
+        for selection in ranked + near_misses(bundle["questions"][q_idx]["options"], correct):
+            if selection not in seen:
+                seen.append(selection)
+            if len(seen) >= per_question_limit:
+                break
+        likely[q_idx] = seen
+    return likely, patterns
+
+
+def answers_with(topic, missed):
+    answers = {q_idx: sorted(correct) for q_idx, correct in get_topic(topic)["answer_sets"].items()}
+    for q_idx, selected in missed:
+        answers[q_idx] = list(selected)
+    return answers
+
+
+def plan_jobs(topic, mode, per_question_limit, max_mistakes):
+    # Each job is (cache key, label, callable that generates and caches the feedback)
+    article = get_topic(topic)["article"]
+    correct_answers = get_topic(topic)["answers"]
+    likely, patterns = likely_selections(topic, per_question_limit)
+    jobs = []
+    if mode == "per_question":
+        for q_idx, selections in likely.items():
+            for selected in selections:
+                jobs.append((
+                    engine.fragment_cache_key(topic, q_idx, selected),
+                    f"Q{q_idx + 1} {selected}",
+                    lambda q_idx=q_idx, selected=selected:
+                        engine.get_cached_question_feedback(topic, article, q_idx, selected),
+                ))
+        return jobs
+
+    combos = [list(missed) for missed, _ in patterns.most_common()]
+    singles = [(q_idx, tuple(sel)) for q_idx, sels in likely.items() for sel in sels]
+    for n in range(1, max_mistakes + 1):
+        for missed in itertools.combinations(singles, n):
+            if len({q_idx for q_idx, _ in missed}) == n:
+                combos.append(list(missed))
+    seen = set()
+    for missed in combos:
+        answers = answers_with(topic, missed)
+        key = engine.feedback_cache_key(topic, answers)
+        if key in seen:
+            continue
+        seen.add(key)
+        label = ", ".join(f"Q{q_idx + 1} {list(sel)}" for q_idx, sel in missed)
+        jobs.append((
+            key,
+            label,
+            lambda answers=answers: engine.get_cached_feedback(topic, article, correct_answers, answers),
+        ))
+    return jobs
+
+
+def run_job(job, retries):
+    # Queued at warm-up priority, so submissions from a class already in session go first
+    key, label, generate = job
+    for attempt in range(retries + 1):
+        try:
+            with scheduler.priority(scheduler.WARMUP):
+                generate()
+            return True
+        except openai.RateLimitError as e:
+            # The SDK has already retried and the scheduler has cut its concurrency; if the response
+            # didn't say how long to wait, hold every worker back before trying again
+            delay = scheduler.retry_after(e) or 2 ** attempt * 5
+            print(f"Rate limited on {label}; backing off {delay:.0f}s")
+            engine.get_scheduler().back_off(delay)
+        except Exception as e:
+            print(f"Failed {label}: {e}")
+            return False
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-generate feedback for likely mistakes before a class opens a topic")
+    parser.add_argument("topic")
+    parser.add_argument("--mode", choices=["full", "per_question"], default=engine.FEEDBACK_MODE)
+    parser.add_argument("--per-question", type=int, default=5, help="selections to warm per question")
+    parser.add_argument("--max-mistakes", type=int, default=1, help="full mode: wrong questions per combination")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--rpm", type=float, default=scheduler.LLM_RPM,
+                        help="the account's requests per minute, shared with the app (0 = unlimited)")
+    parser.add_argument("--tpm", type=float, default=scheduler.LLM_TPM,
+                        help="the account's tokens per minute, shared with the app (0 = unlimited)")
+    parser.add_argument("--retries", type=int, default=3)
+    parser.add_argument("--cache", default=os.getenv("FEEDBACK_CACHE_PATH"), help="on-disk feedback cache to fill")
+    parser.add_argument("--dry-run", action="store_true", help="only report coverage")
+    args = parser.parse_args()
+
+    if not args.cache:
+        parser.error("set FEEDBACK_CACHE_PATH (or --cache) so the app can read what is generated")
+    if not args.rpm and not args.tpm:
+        print("Warning: no LLM_RPM/LLM_TPM (or --rpm/--tpm) set, so there is no budget shared with the app: "
+              "warm-up runs unthrottled and doesn't yield to students' first attempts")
+    elif (args.rpm, args.tpm) != (scheduler.LLM_RPM, scheduler.LLM_TPM):
+        print(f"Warning: --rpm/--tpm differ from the app's LLM_RPM/LLM_TPM ({scheduler.LLM_RPM:g}/"
+              f"{scheduler.LLM_TPM:g}); the shared budget only holds if every process uses the same limits")
+    os.environ["FEEDBACK_CACHE_PATH"] = args.cache
+    cache = engine.get_feedback_cache()
+
+    start = time.perf_counter()
+    jobs = plan_jobs(args.topic, args.mode, args.per_question, args.max_mistakes)
+    # Anything already cached was done by an earlier run, so a rerun resumes where it stopped
+    pending = [job for job in jobs if job[0] not in cache]
+    print(f"{args.topic} ({args.mode}): {len(jobs)} combinations, {len(jobs) - len(pending)} already cached")
+
+    generated = failed = 0
+    if not args.dry_run and pending:
+        # Same budget file as the app, so warm-up only gets what the students' first attempts leave over
+        engine.set_scheduler(scheduler.Scheduler(
+            rpm=args.rpm, tpm=args.tpm, max_concurrency=args.concurrency, path=scheduler.SCHEDULER_PATH
+        ))
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            futures = [pool.submit(run_job, job, args.retries) for job in pending]
+            for i, future in enumerate(as_completed(futures), 1):
+                if future.result():
+                    generated += 1
+                else:
+                    failed += 1
+                if i % 10 == 0 or i == len(futures):
+                    print(f"  {i}/{len(futures)} done")
+
+    cached = sum(1 for job in jobs if job[0] in cache)
+    elapsed = time.perf_counter() - start
+    print("\n===== Warm-up Summary =====")
+    print(f"Generated: {generated}")
+    print(f"Failed: {failed}")
+    print(f"Coverage: {cached}/{len(jobs)} ({100 * cached / len(jobs) if jobs else 100:.1f}%)")
+    print(f"Time spent: {elapsed:.1f}s")
+
+
+if __name__ == "__main__":
+    main()